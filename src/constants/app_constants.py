@@ -2,6 +2,7 @@ from os.path import join as join_path
 
 KALDI_PATH_FILE = './kaldi/path.sh'
 KALDI_QUEUE_FILE = './kaldi/queue.pl'
+KALDI_LOCAL_RUN_FILE = './kaldi/local_run.py'
 
 QUEUE_DELETE_CMD = 'qdel {}'
 QUEUE_GPU_USAGE_CMD = "qstat -q gpu.q -u \* | tail -n +3 | awk -F '[ ,@]+' '{print $10}'"
@@ -12,6 +13,7 @@ SAVE_LOC = '/home/anandm/workspace/speaker-recognition/save'
 
 DATA_DIR = 'data'
 EMB_DIR = 'embeddings'
+EMB_STORE_DIR = 'store'
 EGS_DIR = 'egs'
 LOGS_DIR = 'logs'
 MFCC_DIR = 'mfcc'
@@ -25,6 +27,9 @@ NUM_EGS = 134
 NUM_FEATURES = 23
 NUM_CPU_WORKERS = 10
 
+DCF_P_TARGETS = [0.01, 0.005]
+SCORE_NORM_TOP_K = 200
+
 TRAIN_SPLIT = 'train'
 DEV_SPLIT = 'dev'
 ENROLL_SPLIT = 'enroll'
@@ -39,16 +44,27 @@ EMB_SCP_FILE = join_path(DATA_DIR, 'embeddings.scp')
 ENROLL_SPK_EMB_SCP_FILE = join_path(DATA_DIR, 'enroll_spk_xvector.scp')
 TMP_SCP_FILE = join_path(TMP_DIR, 'tmp_{}.scp')
 
+DATA_LIST_COLUMNS_FILE = 'columns.json'
+FEATS_REPORT_FILE = 'feats_report.json'
 FEATS_SCP_FILE = 'feats.scp'
+FILE_INDEX_FILE = 'file_index.pkl'
 UTT2NUM_FRAMES_FILE = 'utt2num_frames'
 VAD_SCP_FILE = 'vad.scp'
+WAV_MANIFEST_FILE = 'wav_manifest.json'
+WAV_PACK_FILE = 'wavs.pack'
 
 NUM_UTT_FILE = join_path(DATA_DIR, 'num_utt')
 SPK_UTT_FILE = join_path(DATA_DIR, 'spk2utt')
 TRIALS_FILE = join_path(DATA_DIR, 'trials')
+TRIAL_LIST_DIR = '{}.trial_list'
 UTT_SPK_FILE = join_path(DATA_DIR, 'utt2spk')
 
+COHORT_STATS_DIR = 'cohort_stats'
+ENROLLMENT_DIR = 'enrollment'
+INDEX_DIR = 'speaker_index'
+PREPROCESSED_DIR = 'preprocessed'
 BATCH_LOADER_FILE = join_path(TMP_DIR, 'batch_loader_{}.pkl')
 
 SCORES_FILE = 'score.txt'
-EER_INPUT_FILE = 'eer_input.txt'
+IDENTIFICATION_FILE = 'identification.txt'
+METRICS_FILE = 'metrics.json'
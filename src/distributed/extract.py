@@ -1,16 +1,19 @@
 from os.path import abspath, join as join_path
 
-from constants.app_constants import TMP_DIR, EMB_DIR
+from constants.app_constants import TMP_DIR, EMB_DIR, EMB_STORE_DIR
 from constants.tf_constants import LATEST_CHECKPOINT
 from input_model import get_model
 from services.common import make_directory, use_gpu, save_array, run_parallel
-from services.kaldi import read_feat
+from services.embedding_store import EmbeddingWriter
+from services.kaldi import read_feat, write_kaldi_vector
 
 import tensorflow as tf
 import argparse as ap
 import numpy as np
 
 parser = ap.ArgumentParser()
+parser.add_argument('--ark-file', default=None, help='Write binary Kaldi vectors to this ark instead of one .npy per utterance.')
+parser.add_argument('--embedding-store', action='store_true', default=False, help='Append to the embedding store instead of one .npy per utterance.')
 parser.add_argument('--feats-scp', help='Feats scp file.')
 parser.add_argument('--gpu', type=int, default=-1, help='Select GPU')
 parser.add_argument('--max-chunk-size', type=int, default=5000, help='Max chunk size of utterance, after which it will be averaged.')
@@ -20,6 +23,7 @@ parser.add_argument('--num-features', type=int, default=23, help='Number of MFCC
 parser.add_argument('--num-classes', type=int, default=3769, help='Number of MFCC Co-efficients')
 parser.add_argument('--num-workers', type=int, default=10, help='Number of Workers')
 parser.add_argument('--save', default='../save', help='Save Location')
+parser.add_argument('--scp-file', default=None, help='Scp for the vectors of --ark-file.')
 parser.add_argument('--worker-id', type=int, default=0, help='Worker Id')
 args = parser.parse_args()
 
@@ -76,6 +80,11 @@ with tf.Session(config=config) as sess:
     saver = tf.train.Saver()
     saver.restore(sess, model_path)
 
+    writer = EmbeddingWriter(join_path(embedding_loc, EMB_STORE_DIR), args.worker_id) if args.embedding_store else None
+    if args.ark_file is not None:
+        # The scp is written alongside, so the embeddings are usable by Kaldi as soon as the worker finishes.
+        ark = open(abspath(args.ark_file), 'wb')
+        scp = open(args.scp_file, 'w')
     for b in range(num_batches):
         batch_x, key = batches[b]
         emb = sess.run(model.embeddings, feed_dict={
@@ -85,6 +94,20 @@ with tf.Session(config=config) as sess:
 
         emb = np.mean(emb, axis=0)
 
-        embedding_file = join_path(embedding_loc, '{}.npy'.format(key))
-        save_array(embedding_file, emb)
+        if writer is not None:
+            writer.write(key, emb)
+        elif args.ark_file is not None:
+            offset = write_kaldi_vector(ark, key, emb)
+            ark.flush()
+            scp.write('{} {}:{}\n'.format(key, abspath(args.ark_file), offset))
+            scp.flush()
+        else:
+            embedding_file = join_path(embedding_loc, '{}.npy'.format(key))
+            save_array(embedding_file, emb)
         print('{}/{}: Saved embedding for {}'.format(b + 1, num_batches, key))
+
+    if writer is not None:
+        writer.close()
+    if args.ark_file is not None:
+        ark.close()
+        scp.close()
@@ -0,0 +1,43 @@
+from os.path import join as join_path, abspath
+
+from constants.app_constants import DATA_DIR, PLDA_DIR
+from services.common import load_key_file, make_directory
+from services.kaldi import get_plda_adaptor, train_plda, write_kaldi_plda
+
+import argparse as ap
+import time
+
+parser = ap.ArgumentParser()
+parser.add_argument('--adapt-split', default=None, help='Split to adapt the PLDA model to (writes plda_adapt)')
+parser.add_argument('--between-covar-scale', type=float, default=0.25, help='Adaptation Between-Class Scale')
+parser.add_argument('--centering-split', default='sre_unlabelled', help='Split used for the centering mean')
+parser.add_argument('--lda-dim', type=int, default=150, help='LDA Dimension')
+parser.add_argument('--model-tag', default='HGRU', help='Model Tag')
+parser.add_argument('--save', default='../save', help='Save Location')
+parser.add_argument('--split', default='train_data', help='Split used for LDA and PLDA')
+parser.add_argument('--tcf', type=float, default=0.0, help='LDA Total Covariance Factor')
+parser.add_argument('--within-covar-scale', type=float, default=0.75, help='Adaptation Within-Class Scale')
+args = parser.parse_args()
+
+
+if __name__ == '__main__':
+    args.save = abspath(args.save)
+    data_loc = join_path(args.save, DATA_DIR)
+    work_loc = join_path(args.save, '{}/{}'.format(PLDA_DIR, args.model_tag))
+    make_directory(work_loc)
+
+    start_time = time.time()
+    split_loc = join_path(data_loc, args.split)
+    index_list, speaker_list = load_key_file(join_path(split_loc, 'utt2spk'), n_columns=2)
+    model = train_plda(join_path(split_loc, 'embeddings.{}.scp'.format(args.model_tag)),
+                       join_path(join_path(data_loc, args.centering_split), 'embeddings.{}.scp'.format(args.model_tag)),
+                       index_list, speaker_list, join_path(work_loc, 'mean.vec'), join_path(work_loc, 'transform.mat'),
+                       join_path(work_loc, 'plda'), args.lda_dim, args.tcf)
+    if args.adapt_split is not None:
+        print('PLDA: Adapting PLDA model...')
+        adapt_loc = join_path(data_loc, args.adapt_split)
+        adaptor = get_plda_adaptor(join_path(work_loc, 'transform.mat'),
+                                   join_path(adapt_loc, 'embeddings.{}.scp'.format(args.model_tag)))
+        write_kaldi_plda(join_path(work_loc, 'plda_adapt'),
+                         adaptor.adapt(model, args.within_covar_scale, args.between_covar_scale))
+    print('Finished training PLDA in {:.1f}s.'.format(time.time() - start_time))
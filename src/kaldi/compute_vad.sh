@@ -22,7 +22,12 @@ log_loc="$vad_loc/log"
 mkdir -p ${vad_loc} || exit 1;
 mkdir -p ${log_loc}|| exit 1;
 
-python split_scp.py --splits ${nj} --file ${feats_scp} --prefix feats --dest ${log_loc} || exit 1;
+utt2num_frames_opt=""
+if [ -f ${data_loc}/utt2num_frames ]; then
+  utt2num_frames_opt="--utt2num-frames ${data_loc}/utt2num_frames"
+fi
+
+python split_scp.py --splits ${nj} --file ${feats_scp} --prefix feats --dest ${log_loc} ${utt2num_frames_opt} || exit 1;
 
 ${cmd} JOB=1:${nj} ${log_loc}/vad.${name}.JOB.log \
   compute-vad --config=${vad_config} scp:${log_loc}/feats.JOB.scp \
@@ -30,4 +35,4 @@ ${cmd} JOB=1:${nj} ${log_loc}/vad.${name}.JOB.log \
 
 for ((n=1; n<=nj; n++)); do
   cat ${vad_loc}/vad.${name}.${n}.scp || exit 1;
-done > ${data_loc}/vad.scp
\ No newline at end of file
+done | LC_ALL=C sort -k1,1 > ${data_loc}/vad.scp
\ No newline at end of file
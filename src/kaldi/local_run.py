@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os.path import dirname
+from subprocess import Popen, STDOUT
+
+import multiprocessing as mp
+import os
+import re
+import sys
+import time
+
+# Local drop-in for queue.pl / run.pl: "local_run.py [options] [JOB=1:n] log-file command-line arguments..."
+# Tasks are pulled from a shared queue by a pool of workers sized to the machine, so a worker that finishes
+# early immediately picks up the next pending task instead of waiting on a static shard.
+
+USAGE = 'Usage: local_run.py [--max-jobs-run <n>] [--retries <n>] [JOB=1:n] log-file command-line arguments...'
+
+
+def get_time_stamp():
+    return time.strftime('%a %b %d %H:%M:%S %Z %Y')
+
+
+def parse_args(argv):
+    options = {'max_jobs_run': mp.cpu_count(), 'retries': 1}
+    job_name, job_start, job_end = None, 1, 1
+    argv = list(argv)
+    for _ in range(2):
+        while len(argv) >= 2 and argv[0].startswith('-'):
+            switch = argv.pop(0)
+            if switch == '-V':
+                continue
+            argument = argv.pop(0)
+            if switch == '--max-jobs-run':
+                options['max_jobs_run'] = int(argument)
+            elif switch == '--retries':
+                options['retries'] = int(argument)
+            elif switch == '-pe':
+                argv.pop(0)
+            # Remaining queue.pl / qsub options (--mem, --gpu, --num-threads, --config, -q ...) have no local meaning.
+
+        if len(argv) > 0:
+            match = re.match(r'^([\w_][\w\d_]*)=(\d+):(\d+)$', argv[0]) or re.match(r'^([\w_][\w\d_]*)=(\d+)$', argv[0])
+            if match is not None:
+                job_name = match.group(1)
+                job_start = int(match.group(2))
+                job_end = int(match.group(3)) if match.lastindex == 3 else job_start
+                argv.pop(0)
+                if job_start > job_end:
+                    raise ValueError('local_run.py: invalid job range {}'.format(match.group(0)))
+
+    if len(argv) < 2:
+        raise ValueError(USAGE)
+
+    log_file = argv[0]
+    if job_name is not None and job_end > job_start and job_name not in log_file:
+        raise ValueError('local_run.py: you are trying to run a parallel job but you are putting the output into '
+                         'just one log file ({})'.format(log_file))
+    return options, job_name, job_start, job_end, log_file, quote_command(argv[1:])
+
+
+def quote_command(args):
+    cmd = []
+    for x in args:
+        if re.match(r'^\S+$', x):
+            cmd.append(x)
+        elif '"' in x:
+            cmd.append("'{}'".format(x))
+        else:
+            cmd.append('"{}"'.format(x))
+    return ' '.join(cmd)
+
+
+def run_task(job_id, job_name, log_file, cmd, retries):
+    if job_name is not None:
+        log_file = log_file.replace(job_name, str(job_id))
+        cmd = cmd.replace(job_name, str(job_id))
+    if dirname(log_file) != '':
+        os.makedirs(dirname(log_file), exist_ok=True)
+
+    attempt = 0
+    task_start = time.time()
+    while True:
+        start = time.time()
+        with open(log_file, 'w' if attempt == 0 else 'a') as f:
+            f.write('# {}\n# Started at {}{}\n#\n'
+                    .format(cmd, get_time_stamp(), '' if attempt == 0 else ' (retry {})'.format(attempt)))
+            f.flush()
+            return_code = Popen(cmd, shell=True, executable='/bin/bash', stdout=f, stderr=STDOUT).wait()
+            elapsed = int(time.time() - start)
+            f.write('# Accounting: time={} threads=1\n'.format(elapsed))
+            f.write('# Ended (code {}) at {}, elapsed time {} seconds\n'.format(return_code, get_time_stamp(), elapsed))
+        if return_code == 0 or attempt >= retries:
+            return job_id, log_file, return_code, attempt, time.time() - task_start
+        attempt += 1
+
+
+def tail(file_name, n_lines=5):
+    try:
+        with open(file_name) as f:
+            return [line for line in f.readlines() if not line.startswith('#')][-n_lines:]
+    except IOError:
+        return []
+
+
+def main(argv):
+    try:
+        options, job_name, job_start, job_end, log_file, cmd = parse_args(argv)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    job_ids = list(range(job_start, job_end + 1))
+    n_workers = max(1, min(options['max_jobs_run'], len(job_ids)))
+    failed = []
+    retried = 0
+    job_seconds = []
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(run_task, job_id, job_name, log_file, cmd, options['retries']) for job_id in job_ids]
+        for future in as_completed(futures):
+            job_id, task_log, return_code, attempts, seconds = future.result()
+            job_seconds.append((seconds, job_id))
+            retried += 1 if attempts > 0 else 0
+            if return_code != 0:
+                failed.append((job_id, task_log, return_code))
+
+    if len(job_ids) > 1:
+        job_seconds.sort()
+        print('local_run.py: {} jobs on {} workers took {:.1f}s; median job {:.1f}s, slowest job {} ({:.1f}s)'
+              .format(len(job_ids), n_workers, time.time() - start, job_seconds[len(job_seconds) // 2][0],
+                      job_seconds[-1][1], job_seconds[-1][0]), file=sys.stderr)
+    if retried > 0:
+        print('local_run.py: {} / {} jobs needed a retry.'.format(retried, len(job_ids)), file=sys.stderr)
+    if len(failed) > 0:
+        failed.sort()
+        print('local_run.py: {} / {} failed, log is in {}'.format(len(failed), len(job_ids), log_file), file=sys.stderr)
+        for job_id, task_log, return_code in failed:
+            print('local_run.py: job {} exited with code {}, see {}'.format(job_id, return_code, task_log),
+                  file=sys.stderr)
+            for line in tail(task_log):
+                print('    {}'.format(line.rstrip()), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -5,6 +5,8 @@ cd $PWD/kaldi
 cmd="perl queue.pl"
 nj=4
 compress=true
+native_audio=false
+sample_rate=8000
 mfcc_loc="./mfcc"
 mfcc_config="./mfcc/mfcc.conf"
 
@@ -29,12 +31,21 @@ if [ -f ${mfcc_loc}/feats.scp ]; then
   mv ${mfcc_loc}/feats.scp ${mfcc_loc}/.backup
 fi
 
-python split_scp.py --splits ${nj} --file ${wav_scp} --prefix wav --dest ${log_loc} || exit 1;
-
-${cmd} JOB=1:${nj} ${log_loc}/mfcc.${name}.JOB.log \
-    compute-mfcc-feats --verbose=2 --config=${mfcc_config} scp,p:${log_loc}/wav.JOB.scp ark:- \| \
-    copy-feats "--write-num-frames=ark,t:$log_loc/utt2num_${name}_frames.JOB" --compress=${compress} ark:- \
-    ark,scp:${mfcc_loc}/mfcc.${name}.JOB.ark,${mfcc_loc}/mfcc.${name}.JOB.scp || exit 1;
+python split_scp.py --splits ${nj} --file ${wav_scp} --prefix wav --dest ${log_loc} --weight-by-size --group-by-file || exit 1;
+
+if [ "${native_audio}" = true ]; then
+  # Decode SPHERE/WAV/FLAC in-process and stream a wav archive; unsupported entries fall back to their pipes.
+  ${cmd} JOB=1:${nj} ${log_loc}/mfcc.${name}.JOB.log \
+      python ${PWD}/../make_wav_ark.py --sample-rate ${sample_rate} ${log_loc}/wav.JOB.scp \| \
+      compute-mfcc-feats --verbose=2 --config=${mfcc_config} ark:- ark:- \| \
+      copy-feats "--write-num-frames=ark,t:$log_loc/utt2num_${name}_frames.JOB" --compress=${compress} ark:- \
+      ark,scp:${mfcc_loc}/mfcc.${name}.JOB.ark,${mfcc_loc}/mfcc.${name}.JOB.scp || exit 1;
+else
+  ${cmd} JOB=1:${nj} ${log_loc}/mfcc.${name}.JOB.log \
+      compute-mfcc-feats --verbose=2 --config=${mfcc_config} scp,p:${log_loc}/wav.JOB.scp ark:- \| \
+      copy-feats "--write-num-frames=ark,t:$log_loc/utt2num_${name}_frames.JOB" --compress=${compress} ark:- \
+      ark,scp:${mfcc_loc}/mfcc.${name}.JOB.ark,${mfcc_loc}/mfcc.${name}.JOB.scp || exit 1;
+fi
 
 if [ -f ${log_loc}/.error ]; then
   echo "Error producing mfcc features: "
@@ -44,4 +55,8 @@ fi
 
 for n in $(seq ${nj}); do
   cat ${mfcc_loc}/mfcc.${name}.${n}.scp || exit 1;
-done > ${data_loc}/feats.scp || exit 1
\ No newline at end of file
+done | LC_ALL=C sort -k1,1 > ${data_loc}/feats.scp || exit 1;
+
+for n in $(seq ${nj}); do
+  cat ${log_loc}/utt2num_${name}_frames.${n} || exit 1;
+done | LC_ALL=C sort -k1,1 > ${data_loc}/utt2num_frames || exit 1
\ No newline at end of file
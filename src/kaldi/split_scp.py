@@ -1,6 +1,7 @@
-from os.path import join as join_path
+from os.path import isfile, getsize, join as join_path
 
 import argparse as ap
+import heapq
 import numpy as np
 
 
@@ -11,14 +12,78 @@ def parse_args():
     parser.add_argument('--prefix', type=str, help='Prefix for split files.')
     parser.add_argument('--dest', type=str, help='Destination')
     parser.add_argument('--ext', type=str, default='scp', help='Destination')
+    parser.add_argument('--utt2num-frames', type=str, default=None, help='Balance splits by number of frames.')
+    parser.add_argument('--weight-by-size', action='store_true', help='Balance splits by size of the audio files.')
+    parser.add_argument('--group-by-file', action='store_true', help='Keep lines reading the same file in one split.')
     return parser.parse_args()
 
 
-def split_scp(file_path, num_splits, dest_loc, prefix, ext='scp'):
+def balanced_split(weights, num_splits, groups=None):
+    weights = np.array(weights, dtype=float)
+    if groups is not None:
+        # Pack whole groups, then expand each group back into its line indices.
+        keys, inverse = np.unique(np.array(groups), return_inverse=True)
+        group_splits = balanced_split(np.bincount(inverse, weights=weights, minlength=len(keys)), num_splits)
+        return [np.where(np.isin(inverse, idx))[0] for idx in group_splits]
+    loads = [(0.0, i) for i in range(num_splits)]
+    assignment = np.zeros(len(weights), dtype=int)
+    for idx in np.argsort(-weights, kind='stable'):
+        load, split = heapq.heappop(loads)
+        assignment[idx] = split
+        heapq.heappush(loads, (load + weights[idx], split))
+    order = np.argsort(assignment, kind='stable')
+    return np.split(order, np.cumsum(np.bincount(assignment, minlength=num_splits))[:-1])
+
+
+def get_file_path(line):
+    for token in reversed(line.split()[1:]):
+        if isfile(token):
+            return token
+    return None
+
+
+def get_file_size(line):
+    file_path = get_file_path(line)
+    return None if file_path is None else getsize(file_path)
+
+
+def get_line_groups(lines):
+    groups = []
+    for line in lines:
+        file_path = get_file_path(line)
+        groups.append(line.split(maxsplit=1)[0] if file_path is None else file_path)
+    return groups
+
+
+def get_line_weights(lines, utt2num_frames=None, weight_by_size=False):
+    if utt2num_frames is not None:
+        frames_dict = dict()
+        with open(utt2num_frames) as f:
+            for line in f.readlines():
+                tokens = line.split()
+                frames_dict[tokens[0]] = int(tokens[1])
+        weights = [frames_dict.get(line.split(maxsplit=1)[0]) for line in lines]
+    elif weight_by_size:
+        weights = [get_file_size(line) for line in lines]
+    else:
+        return np.ones(len(lines))
+
+    known = [w for w in weights if w is not None]
+    default = np.mean(known) if len(known) > 0 else 1.0
+    return np.array([default if w is None else w for w in weights], dtype=float)
+
+
+def split_scp(file_path, num_splits, dest_loc, prefix, ext='scp', utt2num_frames=None, weight_by_size=False,
+              group_by_file=False):
     with open(file_path, 'r') as f:
         lines = np.array(f.readlines())
 
-    idx = np.array_split(np.arange(0, len(lines), dtype=int), num_splits)
+    if utt2num_frames is None and not weight_by_size and not group_by_file:
+        idx = np.array_split(np.arange(0, len(lines), dtype=int), num_splits)
+    else:
+        idx = balanced_split(get_line_weights(lines, utt2num_frames, weight_by_size), num_splits,
+                             get_line_groups(lines) if group_by_file else None)
+
     for i in range(num_splits):
         file_name = join_path(dest_loc, '{}.{}.{}'.format(prefix, i+1, ext))
         with open(file_name, 'w') as f:
@@ -26,4 +91,5 @@ def split_scp(file_path, num_splits, dest_loc, prefix, ext='scp'):
 
 if __name__ == '__main__':
     args = parse_args()
-    split_scp(args.file, args.splits, args.dest, args.prefix, args.ext)
+    split_scp(args.file, args.splits, args.dest, args.prefix, args.ext, args.utt2num_frames, args.weight_by_size,
+              args.group_by_file)
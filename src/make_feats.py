@@ -7,16 +7,25 @@ from services.feature import MFCC
 import argparse as ap
 
 parser = ap.ArgumentParser()
+parser.add_argument('--chunk-frames', type=int, default=None,
+                    help='Frames per chunk for in-process extraction of long recordings (default: whole file)')
+parser.add_argument('--in-process', action='store_true', help='Compute MFCC, VAD and CMVN in-process with numpy')
 parser.add_argument('--num-features', type=int, default=23, help='Number of MFCC Co-efficients')
 parser.add_argument('-nj', '--num-jobs', type=int, default=40, help='Number of parallel jobs')
+parser.add_argument('--local', action='store_true', help='Run jobs on this machine instead of the queue')
+parser.add_argument('--native-audio', action='store_true', help='Decode audio in-process instead of sph2pipe/sox')
 parser.add_argument('--sample-rate', type=int, default=8000, help='Sampling Rate')
 parser.add_argument('--save', default='../save', help='Save Location')
+parser.add_argument('--sub-splits', type=int, default=4, help='Splits per job when running locally')
 args = parser.parse_args()
 
 
-def make_feats(mfcc, split, save_loc):
+def make_feats(mfcc, split, save_loc, in_process=False, chunk_frames=None):
     data_loc = join_path(join_path(save_loc, DATA_DIR), split)
-    mfcc.extract_with_vad_and_normalization(data_loc, split)
+    if in_process:
+        mfcc.extract_in_process(data_loc, split, chunk_frames=chunk_frames)
+    else:
+        mfcc.extract_with_vad_and_normalization(data_loc, split)
 
 
 if __name__ == '__main__':
@@ -26,9 +35,10 @@ if __name__ == '__main__':
     make_directory(mfcc_loc)
     make_directory(vad_loc)
     mfcc_ = MFCC(fs=args.sample_rate, fl=20, fh=3700, frame_len_ms=25, n_ceps=args.num_features,
-                 n_jobs=args.num_jobs, save_loc=args.save)
+                 n_jobs=args.num_jobs, local=args.local, sub_splits=args.sub_splits,
+                 native_audio=args.native_audio, save_loc=args.save)
     for split_ in ['train_data', 'sre_unlabelled', 'sre_dev_enroll', 'sre_dev_test', 'sre_eval_enroll',
                    'sre_eval_test']:
         print('Making features for {}..'.format(split_))
-        make_feats(mfcc_, split_, args.save)
+        make_feats(mfcc_, split_, args.save, args.in_process, args.chunk_frames)
         print('Finished making features for {}..'.format(split_))
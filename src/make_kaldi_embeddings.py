@@ -1,8 +1,9 @@
 from os.path import join as join_path, abspath
 
-from constants.app_constants import DATA_DIR, EMB_DIR
+from constants.app_constants import DATA_DIR, EMB_DIR, EMB_STORE_DIR
 from services.common import run_parallel, load_array
-from services.kaldi import write_vector, write_num_utterance
+from services.embedding_store import EmbeddingStore, is_store_current
+from services.kaldi import export_embedding_store, write_vector, write_num_utterance
 
 
 def write_embeddings(args):
@@ -24,6 +25,13 @@ def convert_embeddings(split, model_tag, save_loc, n_workers=5, p_bar=False):
             ark_file = join_path(embedding_loc, '{}.ark'.format(utt))
             args_list.append((utt, loc, ark_file))
 
+    store_loc = join_path(embedding_loc, EMB_STORE_DIR)
+    if is_store_current(store_loc, [a[1] for a in args_list]):
+        # One ark for the whole split from the embedding store instead of one per utterance.
+        export_embedding_store(EmbeddingStore(store_loc), join_path(embedding_loc, '{}.ark'.format(split)),
+                               join_path(data_loc, 'embeddings.{}.scp'.format(model_tag)), [a[0] for a in args_list])
+        return
+
     scp_list = run_parallel(write_embeddings, args_list, n_workers, p_bar=p_bar)
 
     with open(join_path(data_loc, 'embeddings.{}.scp'.format(model_tag)), 'w') as f:
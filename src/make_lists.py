@@ -1,15 +1,19 @@
 from os.path import abspath, join as join_path
 
-from constants.app_constants import DATA_DIR
-from services.common import save_object, make_directory
+from constants.app_constants import DATA_DIR, FILE_INDEX_FILE
+from services.common import make_directory
+from services.data_list import make_data_list
+from services.file_index import index_locations
 from services.kaldi import make_kaldi_data_dir
-from services.sre_data import get_train_data, make_sre18_dev_data, make_sre18_eval_data
+from services.sre_data import get_corpus_locations, get_train_data, make_sre18_dev_data, make_sre18_eval_data
 
 
 def make_sre_data(data_config, save_loc):
     save_loc = abspath(save_loc)
     data_loc = join_path(save_loc, DATA_DIR)
     make_directory(data_loc)
+    print('Indexing corpus files...')
+    index_locations(get_corpus_locations(data_config), join_path(data_loc, FILE_INDEX_FILE))
     train_data = get_train_data(data_config)
     make_kaldi_data_dir(train_data, join_path(data_loc, 'train_data'))
     print('Made {:d} files for training.'.format(train_data.shape[0]))
@@ -23,10 +27,12 @@ def make_sre_data(data_config, save_loc):
     make_kaldi_data_dir(sre_eval_test, join_path(data_loc, 'sre_eval_test'))
     print('Made {:d} enroll and {:d} test from sre2018 eval files.'.format(sre_eval_enroll.shape[0], sre_eval_test.shape[0]))
     print('Saving data lists..')
-    save_object(join_path(data_loc, 'train_data.pkl'), train_data)
-    save_object(join_path(data_loc, 'sre_unlabelled.pkl'), sre_unlabelled)
-    save_object(join_path(data_loc, 'sre_dev.pkl'), (sre_dev_enroll, sre_dev_test))
-    save_object(join_path(data_loc, 'sre_eval.pkl'), (sre_eval_enroll, sre_eval_test))
+    make_data_list(train_data, join_path(data_loc, 'train_data.list'))
+    make_data_list(sre_unlabelled, join_path(data_loc, 'sre_unlabelled.list'))
+    make_data_list(sre_dev_enroll, join_path(data_loc, 'sre_dev_enroll.list'))
+    make_data_list(sre_dev_test, join_path(data_loc, 'sre_dev_test.list'))
+    make_data_list(sre_eval_enroll, join_path(data_loc, 'sre_eval_enroll.list'))
+    make_data_list(sre_eval_test, join_path(data_loc, 'sre_eval_test.list'))
     print('Data lists saved at: {}'.format(data_loc))
     return train_data, sre_unlabelled, sre_dev_enroll, sre_dev_test, sre_eval_enroll, sre_eval_test
 
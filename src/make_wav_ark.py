@@ -0,0 +1,14 @@
+import argparse as ap
+import sys
+
+from services.audio import write_wav_ark
+
+parser = ap.ArgumentParser()
+parser.add_argument('wav_scp', help='wav.scp with sph2pipe / sox read commands')
+parser.add_argument('--sample-rate', type=int, default=8000, help='Sampling Rate')
+args = parser.parse_args()
+
+
+if __name__ == '__main__':
+    native, fallback = write_wav_ark(args.wav_scp, sys.stdout.buffer, fs=args.sample_rate)
+    print('make_wav_ark.py: Decoded {} files natively and {} through pipes.'.format(native, fallback), file=sys.stderr)
@@ -5,8 +5,11 @@ source ./kaldi/path.sh
 score_set='dev'
 model_tag='HGRU'
 lda_dim=150
+backend='kaldi'
+# backend='numpy'  # Train mean, LDA and PLDA in-process; writes the same files.
 
 train_cmd='perl ./kaldi/queue.pl'
+# train_cmd='python ./kaldi/local_run.py'  # Single node runs.
 save_dir='/home/anandm/workspace/speaker-recognition/save'
 data_dir=${save_dir}/data
 work_dir=${save_dir}/plda/${model_tag}
@@ -17,29 +20,35 @@ stage=1
 
 
 if [ ${stage} -le 0 ]; then
-    echo "$0: Computing mean"
-    ${train_cmd} ${work_dir}/log/compute_mean.log \
-        ivector-mean scp:${data_dir}/sre_unlabelled/embeddings.${model_tag}.scp \
-        ${work_dir}/mean.vec || exit 1;
+    if [ ${backend} == 'numpy' ]; then
+        echo "$0: Training mean, LDA, PLDA and adapting PLDA"
+        python fit_plda.py --save ${save_dir} --model-tag ${model_tag} --lda-dim ${lda_dim} \
+            --adapt-split sre_unlabelled --within-covar-scale 0.75 --between-covar-scale 0.25 || exit 1;
+    else
+        echo "$0: Computing mean"
+        ${train_cmd} ${work_dir}/log/compute_mean.log \
+            ivector-mean scp:${data_dir}/sre_unlabelled/embeddings.${model_tag}.scp \
+            ${work_dir}/mean.vec || exit 1;
 
-    echo "$0: Training LDA"
-    ${train_cmd} ${work_dir}/log/lda.log \
-        ivector-compute-lda --total-covariance-factor=0.0 --dim=${lda_dim} \
-        "ark:ivector-subtract-global-mean scp:${data_dir}/train_data/embeddings.${model_tag}.scp ark:- |" \
-        ark:${data_dir}/train_data/utt2spk ${work_dir}/transform.mat || exit 1;
+        echo "$0: Training LDA"
+        ${train_cmd} ${work_dir}/log/lda.log \
+            ivector-compute-lda --total-covariance-factor=0.0 --dim=${lda_dim} \
+            "ark:ivector-subtract-global-mean scp:${data_dir}/train_data/embeddings.${model_tag}.scp ark:- |" \
+            ark:${data_dir}/train_data/utt2spk ${work_dir}/transform.mat || exit 1;
 
-    echo "$0: Training PLDA"
-    ${train_cmd} ${work_dir}/log/plda.log \
-        ivector-compute-plda ark:${data_dir}/train_data/spk2utt \
-        "ark:ivector-subtract-global-mean scp:${data_dir}/train_data/embeddings.${model_tag}.scp ark:- | transform-vec ${work_dir}/transform.mat ark:- ark:- | ivector-normalize-length ark:-  ark:- |" \
-        ${work_dir}/plda || exit 1;
+        echo "$0: Training PLDA"
+        ${train_cmd} ${work_dir}/log/plda.log \
+            ivector-compute-plda ark:${data_dir}/train_data/spk2utt \
+            "ark:ivector-subtract-global-mean scp:${data_dir}/train_data/embeddings.${model_tag}.scp ark:- | transform-vec ${work_dir}/transform.mat ark:- ark:- | ivector-normalize-length ark:-  ark:- |" \
+            ${work_dir}/plda || exit 1;
 
-    echo "$0: Adapting PLDA"
-    ${train_cmd} ${work_dir}/log/plda_adapt.log \
-        ivector-adapt-plda --within-covar-scale=0.75 --between-covar-scale=0.25 \
-        ${work_dir}/plda \
-        "ark:ivector-subtract-global-mean scp:${data_dir}/sre_unlabelled/embeddings.${model_tag}.scp ark:- | transform-vec ${work_dir}/transform.mat ark:- ark:- | ivector-normalize-length ark:- ark:- |" \
-        ${work_dir}/plda_adapt || exit 1;
+        echo "$0: Adapting PLDA"
+        ${train_cmd} ${work_dir}/log/plda_adapt.log \
+            ivector-adapt-plda --within-covar-scale=0.75 --between-covar-scale=0.25 \
+            ${work_dir}/plda \
+            "ark:ivector-subtract-global-mean scp:${data_dir}/sre_unlabelled/embeddings.${model_tag}.scp ark:- | transform-vec ${work_dir}/transform.mat ark:- ark:- | ivector-normalize-length ark:- ark:- |" \
+            ${work_dir}/plda_adapt || exit 1;
+    fi
 fi
 
 
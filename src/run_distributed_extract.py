@@ -1,24 +1,31 @@
-from os.path import abspath, join as join_path
+from os.path import abspath, exists, join as join_path
 
 import argparse as ap
 
-from constants.app_constants import DATA_DIR, NUM_FEATURES, SAVE_LOC, TMP_DIR
+from constants.app_constants import DATA_DIR, EMB_DIR, EMB_STORE_DIR, NUM_FEATURES, SAVE_LOC, TMP_DIR, \
+    UTT2NUM_FRAMES_FILE
 from kaldi.split_scp import split_scp
-from services.common import make_directory
+from services.common import load_key_file, make_directory
 from services.distributed import submit_extract_worker_job, watch_jobs
+from services.embedding_store import EmbeddingStore
+from services.kaldi import export_embedding_store, merge_scp_files
 
 parser = ap.ArgumentParser()
 parser.add_argument('--iteration', type=int, default=72, help='Saved model iteration.')
 parser.add_argument('--max-chunk-size', type=int, default=5000, help='Max chunk size of utterance, after which it will be averaged.')
 parser.add_argument('--model-tag', default='HGRU', help='Model Tag')
 parser.add_argument('--num-features', type=int, default=NUM_FEATURES, help='Number of MFCC Co-efficients')
+parser.add_argument('--output', default='ark', choices=['ark', 'store', 'npy'], help='ark: per-worker Kaldi arks; store: embedding store; npy: one .npy per utterance (needs make_kaldi_embeddings.py).')
 parser.add_argument('--save', default=SAVE_LOC, help='Save Location')
+parser.add_argument('--store-dtype', default=None, choices=['float32', 'float16', 'int8'], help='Precision the embedding store is compacted to (default: keep).')
 parser.add_argument('--splits', default="train_data_full,sre_unlabelled,sre_dev_enroll,sre_dev_test,sre_eval_enroll,sre_eval_test", help='Splits')
 parser.add_argument('--num-workers', type=int, default=4, help='Number of Workers')
 args = parser.parse_args()
 
 save_loc = abspath(args.save)
 data_loc = join_path(save_loc, DATA_DIR)
+embedding_loc = join_path(save_loc, EMB_DIR, args.model_tag)
+make_directory(embedding_loc)
 tmp_loc = join_path(save_loc, '{}/{}'.format(TMP_DIR, args.model_tag))
 make_directory(tmp_loc)
 
@@ -28,11 +35,37 @@ for split in splits:
     print('Extracting embeddings for {} from {} model.'.format(split, args.model_tag))
     split_loc = join_path(data_loc, split)
     feats_scp = join_path(split_loc, 'voiced_feats.scp')
-    split_scp(feats_scp, args.num_workers, tmp_loc, prefix='feats.{}'.format(split))
+    utt2num_frames = join_path(split_loc, UTT2NUM_FRAMES_FILE)
+    split_scp(feats_scp, args.num_workers, tmp_loc, prefix='feats.{}'.format(split),
+              utt2num_frames=utt2num_frames if exists(utt2num_frames) else None)
     job_ids = []
+    worker_scps = []
     for worker_id in range(args.num_workers):
         split_feats_scp = join_path(tmp_loc, 'feats.{}.{}.scp'.format(split, worker_id + 1))
-        job_id = submit_extract_worker_job(args.model_tag, args.iteration, worker_id, split_feats_scp, args.max_chunk_size, save_loc, compute=None)
+        ark_file, scp_file = None, None
+        if args.output == 'ark':
+            ark_file = join_path(embedding_loc, '{}.{}.ark'.format(split, worker_id))
+            scp_file = join_path(tmp_loc, 'embeddings.{}.{}.scp'.format(split, worker_id))
+            worker_scps.append(scp_file)
+        job_id = submit_extract_worker_job(args.model_tag, args.iteration, worker_id, split_feats_scp, args.max_chunk_size, save_loc, compute=None,
+                                           embedding_store=args.output == 'store', ark_file=ark_file, scp_file=scp_file)
         print('Submitted job {} to worker {}.'.format(job_id, worker_id))
         job_ids.append(job_id)
     watch_jobs(job_ids)
+
+    # Ready for plda.sh without a conversion stage.
+    embedding_scp = join_path(split_loc, 'embeddings.{}.scp'.format(args.model_tag))
+    if args.output == 'ark':
+        merge_scp_files(worker_scps, embedding_scp)
+        print('Wrote {}.'.format(embedding_scp))
+
+if args.output == 'store':
+    # Compacted once after the last split, so the cost does not grow with every split; then each split is exported.
+    print('Compacting embedding store...')
+    store = EmbeddingStore(join_path(embedding_loc, EMB_STORE_DIR)).compact(dtype=args.store_dtype)
+    for split in splits:
+        split_loc = join_path(data_loc, split)
+        embedding_scp = join_path(split_loc, 'embeddings.{}.scp'.format(args.model_tag))
+        export_embedding_store(store, join_path(embedding_loc, '{}.ark'.format(split)), embedding_scp,
+                               load_key_file(join_path(split_loc, 'voiced_feats.scp'), n_columns=2)[0])
+        print('Wrote {}.'.format(embedding_scp))
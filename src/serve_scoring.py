@@ -0,0 +1,40 @@
+from os.path import join as join_path, abspath
+
+from constants.app_constants import ENROLL_SPLIT, UTT_SPK_FILE
+from services.common import load_key_file
+from services.kaldi import PLDA
+from services.scoring_server import make_server
+
+import argparse as ap
+
+parser = ap.ArgumentParser()
+parser.add_argument('--adapted', action='store_true', default=False, help='Score with the adapted PLDA model')
+parser.add_argument('--backend', default='numpy', help='numpy (PLDA) or cosine')
+parser.add_argument('--enroll-split', default=ENROLL_SPLIT, help='Enrolled split; its enrollment store takes updates')
+parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+parser.add_argument('--max-batch', type=int, default=256, help='Maximum embeddings per micro-batch')
+parser.add_argument('--max-wait-ms', type=float, default=5.0, help='Maximum wait for a micro-batch to fill')
+parser.add_argument('--model-tag', default='HGRU', help='Model Tag')
+parser.add_argument('--port', type=int, default=8642, help='Port')
+parser.add_argument('--save', default='../save', help='Save Location')
+args = parser.parse_args()
+
+
+if __name__ == '__main__':
+    args.save = abspath(args.save)
+    plda = PLDA(args.model_tag, backend=args.backend, save_loc=args.save)
+    index_list, speaker_list = load_key_file(join_path(args.save, '{}_{}'.format(UTT_SPK_FILE, args.enroll_split)),
+                                             n_columns=2)
+    if not plda.index_is_current(index_list, speaker_list, args.enroll_split, args.adapted):
+        # Missing, or built from another model, adaptation setting or enrollment.
+        plda.build_index(index_list, speaker_list, args.enroll_split, approximate=False, adapted=args.adapted)
+
+    backend = plda.get_scoring_backend(args.adapted, args.enroll_split)
+    if backend.store is None:
+        print('No enrollment store for {}: /enroll and /unenroll are disabled.'.format(args.enroll_split))
+    server = make_server(backend, args.host, args.port, args.max_batch, args.max_wait_ms / 1000.0)
+    print('Serving {} speakers on http://{}:{}'.format(backend.index.size, args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
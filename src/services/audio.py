@@ -0,0 +1,588 @@
+from collections import OrderedDict
+from shutil import which
+from subprocess import Popen, PIPE
+
+import numpy as np
+import shlex
+import struct
+
+AUDIO_CACHE_SIZE = 4
+SHORTEN_MAGIC = b'ajkg'
+SHORTEN_TYPES = {0: 'ulaw', 1: 's8', 2: 'u8', 3: 's16', 4: 'u16', 5: 's16', 6: 'u16', 7: 'ulaw_linear'}
+SPHERE_HEADER_ID = b'NIST_1A'
+
+
+class AudioCache:
+    # Decoded files keyed by (file, offset, length), so all channels and trims of one recording share a decode.
+    def __init__(self, capacity=AUDIO_CACHE_SIZE):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def get(self, file_name, offset=0, length=None):
+        key = (file_name, offset, length)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        value = decode_audio(file_name, offset, length)
+        self.entries[key] = value
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return value
+
+
+AUDIO_CACHE = AudioCache()
+
+
+class SampleReader:
+    # One channel of uncompressed audio read by sample range, so a long recording is never decoded whole.
+    def __init__(self, file_name, data_offset, n_samples, n_channels, channel, dtype, sample_rate, decode=None):
+        self.file_name = file_name
+        self.data_offset = data_offset
+        self.n_samples = n_samples
+        self.n_channels = n_channels
+        self.channel = channel
+        self.dtype = np.dtype(dtype)
+        self.sample_rate = sample_rate
+        self.decode = decode
+
+    def __getitem__(self, item):
+        start, stop, _ = item.indices(self.n_samples)
+        frame_bytes = self.n_channels * self.dtype.itemsize
+        with open(self.file_name, 'rb') as f:
+            f.seek(self.data_offset + start * frame_bytes)
+            data = f.read(max(stop - start, 0) * frame_bytes)
+        samples = np.frombuffer(data[:len(data) - len(data) % frame_bytes], dtype=self.dtype)
+        samples = samples.reshape([-1, self.n_channels])[:, self.channel - 1]
+        return (samples if self.decode is None else self.decode(samples)).astype(np.int16)
+
+    def __len__(self):
+        return self.n_samples
+
+
+class BitReader:
+    def __init__(self, data, offset=0):
+        self.data = data
+        self.pos = offset
+        self.buffer = 0
+        self.n_bits = 0
+
+    def fill(self):
+        chunk = self.data[self.pos:self.pos + 8]
+        if len(chunk) == 0:
+            raise EOFError('Unexpected end of shorten stream.')
+        self.pos += len(chunk)
+        self.buffer = (self.buffer << (8 * len(chunk))) | int.from_bytes(chunk, 'big')
+        self.n_bits += 8 * len(chunk)
+
+    def read(self, n):
+        while self.n_bits < n:
+            self.fill()
+        self.n_bits -= n
+        value = self.buffer >> self.n_bits
+        self.buffer &= (1 << self.n_bits) - 1
+        return value
+
+    def read_unary(self):
+        count = 0
+        while True:
+            if self.n_bits == 0:
+                self.fill()
+            if self.buffer == 0:
+                count += self.n_bits
+                self.n_bits = 0
+                continue
+            length = self.buffer.bit_length()
+            count += self.n_bits - length
+            self.n_bits = length - 1
+            self.buffer &= (1 << self.n_bits) - 1
+            return count
+
+    def svar(self, n):
+        value = self.uvar(n + 1)
+        return ~(value >> 1) if value & 1 else value >> 1
+
+    def ulong(self):
+        return self.uvar(self.uvar(2))
+
+    def uvar(self, n):
+        return (self.read_unary() << n) | self.read(n)
+
+
+def alaw_to_linear(data):
+    table = np.zeros(256, dtype=np.int16)
+    for code in range(256):
+        a = code ^ 0x55
+        t = (a & 0x0F) << 4
+        segment = (a & 0x70) >> 4
+        if segment == 0:
+            t += 8
+        else:
+            t = (t + 0x108) << (segment - 1)
+        table[code] = t if a & 0x80 else -t
+    codes = np.frombuffer(data, dtype=np.uint8) if isinstance(data, (bytes, bytearray)) else np.asarray(data, np.uint8)
+    return table[codes]
+
+
+def c_div(a, b):
+    q = abs(a) // abs(b)
+    return q if (a >= 0) == (b > 0) else -q
+
+
+def decode_audio(file_name, offset=0, length=None):
+    with open(file_name, 'rb') as f:
+        f.seek(offset)
+        data = f.read() if length is None else f.read(length)
+
+    if data[:7] == SPHERE_HEADER_ID:
+        return read_sphere(data, file_name if offset == 0 and length is None else None)
+    elif data[:4] == b'RIFF':
+        return read_wav(data)
+    elif data[:4] == b'fLaC':
+        return read_flac(file_name)
+    raise ValueError('Unknown audio format: {}'.format(file_name))
+
+
+def decode_shorten(data, offset=0):
+    if data[offset:offset + 4] != SHORTEN_MAGIC:
+        raise ValueError('Not a shorten stream.')
+    version = data[offset + 4]
+    reader = BitReader(data, offset + 5)
+
+    # Constants and bitstream layout follow shorten 2.x (fn codes, field widths and offsets).
+    ftype = reader.ulong() if version > 0 else reader.uvar(4)
+    n_channels = reader.ulong() if version > 0 else reader.uvar(0)
+    block_size, max_lpc, n_mean = 256, 0, 0
+    if version > 0:
+        block_size = reader.ulong()
+        max_lpc = reader.ulong()
+        n_mean = reader.ulong()
+        for _ in range(reader.ulong()):
+            reader.read(8)
+    if ftype not in SHORTEN_TYPES:
+        raise ValueError('Unsupported shorten sample type: {}'.format(ftype))
+
+    n_wrap = max(3, max_lpc)
+    lpc_offset = (1 << 5) if version > 1 else 0
+    mean = 0x80 if ftype == 2 else (0x8000 if ftype in (4, 6) else 0)
+    offsets = [[mean] * max(1, n_mean) for _ in range(n_channels)]
+    history = [[0] * n_wrap for _ in range(n_channels)]
+    output = [[] for _ in range(n_channels)]
+    bit_shift = 0
+    channel = 0
+
+    while True:
+        cmd = reader.uvar(2)
+        if cmd == 4:
+            break
+        elif cmd == 5:
+            block_size = reader.ulong()
+        elif cmd == 6:
+            bit_shift = reader.uvar(2)
+        elif cmd == 9:
+            for _ in range(reader.uvar(5)):
+                reader.uvar(8)
+        elif cmd in (0, 1, 2, 3, 7, 8):
+            residual_size = 0
+            if cmd != 8:
+                residual_size = reader.uvar(3)
+                if version == 0:
+                    residual_size -= 1
+
+            if n_mean == 0:
+                coffset = offsets[channel][0]
+            else:
+                total = sum(offsets[channel][:n_mean]) + (n_mean // 2 if version >= 2 else 0)
+                coffset = c_div(total, n_mean)
+                if version >= 2 and bit_shift > 0:
+                    coffset >>= bit_shift
+
+            buffer = list(history[channel])
+            if cmd == 8:
+                buffer.extend([0] * block_size)
+            else:
+                if cmd == 7:
+                    order = reader.uvar(2)
+                    coeffs = [reader.svar(5) for _ in range(order)]
+                    shift = 5
+                    init = lpc_offset
+                    for i in range(1, order + 1):
+                        buffer[-i] -= coffset
+                else:
+                    order = cmd
+                    coeffs = [[], [1], [2, -1], [3, -3, 1]][cmd]
+                    shift = 0
+                    init = coffset if order == 0 else 0
+                start = len(buffer)
+                for i in range(start, start + block_size):
+                    total = init
+                    for j in range(order):
+                        total += coeffs[j] * buffer[i - j - 1]
+                    buffer.append(reader.svar(residual_size) + (total >> shift))
+                if cmd == 7 and coffset != 0:
+                    for i in range(start, start + block_size):
+                        buffer[i] += coffset
+
+            block = buffer[n_wrap:]
+            if n_mean > 0:
+                total = sum(block) + (block_size // 2 if version >= 2 else 0)
+                offsets[channel] = offsets[channel][1:] + [c_div(total, block_size) << (bit_shift if version >= 2
+                                                                                        else 0)]
+            history[channel] = buffer[-n_wrap:]
+            output[channel].extend([s << bit_shift for s in block] if bit_shift > 0 else block)
+            channel = (channel + 1) % n_channels
+        else:
+            raise ValueError('Invalid shorten command: {}'.format(cmd))
+
+    length = min(len(o) for o in output)
+    samples = np.array([o[:length] for o in output], dtype=np.int64).T
+    sample_type = SHORTEN_TYPES[ftype]
+    if sample_type == 'ulaw_linear':
+        return ulaw_to_linear(linear_to_ulaw(samples << 3))
+    elif sample_type == 'ulaw':
+        return ulaw_to_linear(samples.astype(np.uint8))
+    elif sample_type == 'u8':
+        return ((samples - 0x80) << 8).astype(np.int16)
+    elif sample_type == 's8':
+        return (samples << 8).astype(np.int16)
+    elif sample_type == 'u16':
+        return (samples - 0x8000).astype(np.int16)
+    return samples.astype(np.int16)
+
+
+def linear_to_ulaw(samples):
+    samples = np.array(samples, dtype=np.int64)
+    sign = np.where(samples < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(samples), 32635) + 0x84
+    exponent = np.clip(np.frexp(magnitude)[1] - 8, 0, 7)
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+
+
+def load_audio(cmd, fs=8000):
+    if not cmd.rstrip().endswith('|'):
+        return read_audio(cmd.strip(), fs=fs)
+    spec = parse_read_command(cmd)
+    if spec is not None:
+        try:
+            return read_audio(spec['file'], spec['channel'], spec['start'], spec['duration'], spec['fs'] or fs,
+                              spec['offset'], spec['length'])
+        except (ImportError, IOError, ValueError, EOFError, IndexError):
+            pass
+    samples, sample_rate = read_wav(run_read_command(cmd.rstrip().rstrip('|')))
+    samples = samples[:, 0]
+    if sample_rate != fs:
+        samples = resample(samples, sample_rate, fs)
+    return samples, fs
+
+
+def open_audio(cmd, fs=8000):
+    # Returns a SampleReader where the audio can be read by range, otherwise the decoded samples of load_audio.
+    if cmd.rstrip().endswith('|'):
+        spec = parse_read_command(cmd)
+    else:
+        spec = {'file': cmd.strip(), 'channel': 1, 'start': None, 'duration': None, 'fs': None, 'offset': 0,
+                'length': None}
+    if spec is not None:
+        try:
+            reader = open_sample_reader(spec['file'], spec['channel'], spec['start'], spec['duration'],
+                                        spec['fs'] or fs, spec['offset'], spec['length'])
+            if reader is not None:
+                return reader, reader.sample_rate
+        except (IOError, ValueError, IndexError, struct.error):
+            pass
+    return load_audio(cmd, fs)
+
+
+def open_sample_reader(file_name, channel=1, start=None, duration=None, fs=None, offset=0, length=None):
+    with open(file_name, 'rb') as f:
+        f.seek(0, 2)
+        available = f.tell() - offset if length is None else length
+        f.seek(offset)
+        head = f.read(min(available, 1 << 16))
+
+    decode = None
+    if head[:7] == SPHERE_HEADER_ID:
+        header, data_start = parse_sphere_header(head)
+        n_channels = int(header.get('channel_count', 1))
+        sample_rate = int(header.get('sample_rate', 8000))
+        coding = str(header.get('sample_coding', 'pcm'))
+        if 'shorten' in coding:
+            return None
+        elif coding.startswith('ulaw') or coding.startswith('mu-law'):
+            dtype, decode = np.uint8, ulaw_to_linear
+        elif coding.startswith('alaw'):
+            dtype, decode = np.uint8, alaw_to_linear
+        elif coding.startswith('pcm') and int(header.get('sample_n_bytes', 2)) == 2:
+            dtype = '<i2' if header.get('sample_byte_format', '01') == '01' else '>i2'
+        else:
+            return None
+        data_size = available - data_start
+        if header.get('sample_count') is not None:
+            data_size = min(data_size, int(header['sample_count']) * n_channels * np.dtype(dtype).itemsize)
+    elif head[:4] == b'RIFF':
+        fmt, data_start, data_size = find_wav_data(head)
+        audio_format, n_channels, sample_rate, _, _, bits = fmt
+        if audio_format == 7:
+            dtype, decode = np.uint8, ulaw_to_linear
+        elif audio_format == 6:
+            dtype, decode = np.uint8, alaw_to_linear
+        elif audio_format in (1, 0xFFFE) and bits == 16:
+            dtype = '<i2'
+        else:
+            return None
+        data_size = min(data_size, available - data_start)
+    else:
+        return None
+
+    if fs is not None and fs != sample_rate:
+        return None
+    if channel > n_channels:
+        raise ValueError('{} has no channel {}.'.format(file_name, channel))
+    frame_bytes = n_channels * np.dtype(dtype).itemsize
+    n_samples = data_size // frame_bytes
+    start_idx = 0
+    if start is not None:
+        start_idx = min(int(round(start * sample_rate)), n_samples)
+        if duration is not None:
+            n_samples = min(n_samples, start_idx + int(round(duration * sample_rate)))
+    return SampleReader(file_name, offset + data_start + start_idx * frame_bytes, n_samples - start_idx, n_channels,
+                        channel, dtype, sample_rate, decode)
+
+
+def parse_read_command(cmd):
+    try:
+        tokens = shlex.split(cmd.strip().rstrip('|'))
+    except ValueError:
+        return None
+    if len(tokens) == 0:
+        return None
+
+    spec = {'channel': 1, 'start': None, 'duration': None, 'fs': None, 'offset': 0, 'length': None}
+    if tokens[0] == 'tail' and len(tokens) == 8 and tokens[1] == '-c' and tokens[4:7] == ['|', 'head', '-c']:
+        if not tokens[2].startswith('+'):
+            return None
+        spec['offset'] = int(tokens[2][1:]) - 1
+        spec['length'] = int(tokens[7])
+        spec['file'] = tokens[3]
+    elif tokens[0] == 'sph2pipe':
+        idx = 1
+        while idx < len(tokens) - 1:
+            if tokens[idx] == '-c':
+                spec['channel'] = int(tokens[idx + 1])
+                idx += 2
+            elif tokens[idx] == '-f':
+                idx += 2
+            elif tokens[idx] == '-p':
+                idx += 1
+            else:
+                return None
+        spec['file'] = tokens[-1]
+    elif tokens[0] == 'sox':
+        files = []
+        idx = 1
+        while idx < len(tokens):
+            token = tokens[idx]
+            if token in ('-t', '-V0') or token.startswith('-V'):
+                idx += 2 if token == '-t' else 1
+            elif token == '-r':
+                rate = tokens[idx + 1]
+                spec['fs'] = int(float(rate[:-1]) * 1000) if rate.endswith('k') else int(rate)
+                idx += 2
+            elif token == 'trim':
+                spec['start'] = float(tokens[idx + 1])
+                spec['duration'] = float(tokens[idx + 2]) if idx + 2 < len(tokens) else None
+                idx += 3
+            elif token == '-':
+                idx += 1
+            elif token.startswith('-'):
+                return None
+            else:
+                files.append(token)
+                idx += 1
+        if len(files) != 1:
+            return None
+        spec['file'] = files[0]
+    elif tokens[0] == 'cat' and len(tokens) == 2:
+        spec['file'] = tokens[1]
+    else:
+        return None
+    return spec
+
+
+def read_audio(file_name, channel=1, start=None, duration=None, fs=None, offset=0, length=None):
+    samples, sample_rate = AUDIO_CACHE.get(file_name, offset, length)
+    if channel > samples.shape[1]:
+        raise ValueError('{} has no channel {}.'.format(file_name, channel))
+    samples = samples[:, channel - 1]
+
+    if start is not None:
+        start_idx = int(round(start * sample_rate))
+        end_idx = samples.shape[0] if duration is None else start_idx + int(round(duration * sample_rate))
+        samples = samples[start_idx:end_idx]
+
+    if fs is not None and fs != sample_rate:
+        samples = resample(samples, sample_rate, fs)
+        sample_rate = fs
+    return samples, sample_rate
+
+
+def read_flac(file_name):
+    # FLAC decoding needs the optional soundfile package; callers fall back to the sox pipe without it.
+    import soundfile
+    samples, sample_rate = soundfile.read(file_name, dtype='int16', always_2d=True)
+    return samples, sample_rate
+
+
+def parse_sphere_header(data):
+    header_size = int(data[8:16].strip())
+    header = dict()
+    for line in data[16:header_size].decode('ascii', 'ignore').split('\n'):
+        tokens = line.strip().split(None, 2)
+        if len(tokens) == 0 or tokens[0] == 'end_head':
+            break
+        if len(tokens) == 3:
+            header[tokens[0]] = int(tokens[2]) if tokens[1] == '-i' else tokens[2]
+    return header, header_size
+
+
+def read_sphere(data, file_name=None):
+    header, header_size = parse_sphere_header(data)
+    n_channels = int(header.get('channel_count', 1))
+    sample_rate = int(header.get('sample_rate', 8000))
+    n_bytes = int(header.get('sample_n_bytes', 2))
+    coding = str(header.get('sample_coding', 'pcm'))
+    body = data[header_size:]
+
+    if 'shorten' in coding and file_name is not None and which('sph2pipe') is not None:
+        # The bit-serial shorten decoder is slow in Python; one sph2pipe call decodes all channels at once.
+        samples, _ = read_wav(run_read_command('sph2pipe -f wav -p {}'.format(shlex.quote(file_name))))
+    elif 'shorten' in coding:
+        samples = decode_shorten(body)
+    elif coding.startswith('ulaw') or coding.startswith('mu-law'):
+        samples = ulaw_to_linear(body)
+    elif coding.startswith('alaw'):
+        samples = alaw_to_linear(body)
+    elif coding.startswith('pcm') and n_bytes == 2:
+        byte_format = header.get('sample_byte_format', '01')
+        samples = np.frombuffer(body[:len(body) - len(body) % 2], dtype='<i2' if byte_format == '01' else '>i2')
+    else:
+        raise ValueError('Unsupported sphere sample coding: {}'.format(coding))
+
+    if samples.ndim == 1:
+        samples = samples[:len(samples) - len(samples) % n_channels].reshape([-1, n_channels])
+    sample_count = header.get('sample_count')
+    if sample_count is not None:
+        samples = samples[:int(sample_count)]
+    return samples.astype(np.int16), sample_rate
+
+
+def find_wav_data(data):
+    # Returns the fmt fields and the offset and size of the data chunk.
+    pos = 12
+    fmt = None
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        chunk_size = struct.unpack('<I', data[pos + 4:pos + 8])[0]
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', data[pos + 8:pos + 24])
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError('WAV data chunk before fmt chunk.')
+            return fmt, pos + 8, chunk_size
+        pos += 8 + chunk_size + chunk_size % 2
+    raise ValueError('No data chunk in WAV file.')
+
+
+def read_wav(data):
+    fmt, data_start, data_size = find_wav_data(data)
+    audio_format, n_channels, sample_rate, _, _, bits = fmt
+    body = data[data_start:data_start + data_size]
+    if audio_format == 7:
+        samples = ulaw_to_linear(body)
+    elif audio_format == 6:
+        samples = alaw_to_linear(body)
+    elif audio_format in (1, 0xFFFE) and bits == 16:
+        samples = np.frombuffer(body[:len(body) - len(body) % 2], dtype='<i2')
+    elif audio_format in (1, 0xFFFE) and bits == 8:
+        samples = ((np.frombuffer(body, dtype=np.uint8).astype(np.int16) - 128) << 8)
+    else:
+        raise ValueError('Unsupported WAV format {} with {} bits.'.format(audio_format, bits))
+    return samples.reshape([-1, n_channels]).astype(np.int16), sample_rate
+
+
+def resample(samples, fs_in, fs_out, half_width=16):
+    g = np.gcd(fs_in, fs_out)
+    up, down = fs_out // g, fs_in // g
+    cutoff = 1.0 / max(up, down)
+    n_taps = 2 * half_width * max(up, down) + 1
+    t = np.arange(n_taps) - (n_taps - 1) / 2.0
+    taps = cutoff * np.sinc(cutoff * t) * np.kaiser(n_taps, 8.0) * up
+
+    x = np.asarray(samples, dtype=np.float64)
+    n_out = int(np.ceil(len(x) * up / float(down)))
+    delay = (n_taps - 1) // 2
+    positions = np.arange(n_out) * down + delay
+    output = np.zeros(n_out)
+    for phase in range(up):
+        phase_taps = taps[phase::up]
+        idx = np.where(positions % up == phase)[0]
+        if len(idx) == 0:
+            continue
+        filtered = np.convolve(x, phase_taps)
+        src = (positions[idx] - phase) // up
+        valid = src < len(filtered)
+        output[idx[valid]] = filtered[src[valid]]
+    return np.clip(np.round(output), -32768, 32767).astype(np.int16)
+
+
+def run_read_command(cmd):
+    output, _ = Popen(cmd, stdout=PIPE, shell=True).communicate()
+    return output
+
+
+def source_file(cmd):
+    spec = parse_read_command(cmd) if cmd.rstrip().endswith('|') else {'file': cmd.strip()}
+    return cmd if spec is None else spec['file']
+
+
+def ulaw_to_linear(data):
+    table = np.zeros(256, dtype=np.int16)
+    for code in range(256):
+        u = ~code & 0xFF
+        sample = (((u & 0x0F) << 3) + 0x84) << ((u >> 4) & 0x07)
+        table[code] = (0x84 - sample) if u & 0x80 else (sample - 0x84)
+    codes = np.frombuffer(data, dtype=np.uint8) if isinstance(data, (bytes, bytearray)) else np.asarray(data, np.uint8)
+    return table[codes]
+
+
+def wav_bytes(samples, fs):
+    samples = np.asarray(samples, dtype='<i2')
+    data = samples.tobytes()
+    return b''.join([b'RIFF', struct.pack('<I', 36 + len(data)), b'WAVE',
+                     b'fmt ', struct.pack('<IHHIIHH', 16, 1, 1, fs, fs * 2, 2, 16),
+                     b'data', struct.pack('<I', len(data)), data])
+
+
+def write_wav_ark(wav_scp, out, fs=8000):
+    native, fallback = 0, 0
+    with open(wav_scp) as f:
+        entries = [line.strip().split(None, 1) for line in f]
+    # Entries reading the same recording are written back to back so they hit the decode cache.
+    entries = sorted([tokens for tokens in entries if len(tokens) == 2], key=lambda tokens: source_file(tokens[1]))
+    for utt, cmd in entries:
+        spec = parse_read_command(cmd)
+        wav = None
+        if spec is not None:
+            try:
+                samples, sample_rate = read_audio(spec['file'], spec['channel'], spec['start'], spec['duration'],
+                                                  spec['fs'] or fs, spec['offset'], spec['length'])
+                wav = wav_bytes(samples, sample_rate)
+                native += 1
+            except (ImportError, IOError, ValueError, EOFError, IndexError):
+                wav = None
+        if wav is None:
+            wav = run_read_command(cmd.rstrip().rstrip('|'))
+            fallback += 1
+        out.write('{} '.format(utt).encode('utf-8'))
+        out.write(wav)
+    return native, fallback
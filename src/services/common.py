@@ -1,15 +1,18 @@
+from json import dumps as dump_json, loads as load_json
 from os.path import join as join_path
 from subprocess import Popen, PIPE
-from fnmatch import fnmatch
 from tqdm import tqdm
 
 import multiprocessing as mp
 import numpy as np
 import pickle
+import re
 import time
 import os
 
-from constants.app_constants import DATA_DIR, EMB_DIR, LOGS_DIR, MFCC_DIR, MODELS_DIR, PLDA_DIR, VAD_DIR, TMP_DIR
+from constants.app_constants import DATA_DIR, EMB_DIR, LOGS_DIR, MFCC_DIR, MODELS_DIR, PLDA_DIR, VAD_DIR, TMP_DIR, \
+    WAV_MANIFEST_FILE, WAV_PACK_FILE
+from services.file_index import list_files
 
 
 def append_cwd_to_python_path(cmd):
@@ -41,25 +44,116 @@ def create_directories(save_loc):
     make_directory(join_path(save_loc, TMP_DIR))
 
 
-def create_wav(save_loc, args):
+def compact_wav_pack(pack_file, manifest):
+    # Rebuilt entries leave their old bytes behind; rewrite the pack once they make up more than half of it.
+    pack_size = os.path.getsize(pack_file) if os.path.exists(pack_file) else 0
+    packed = [utt for utt, entry in manifest.items() if 'offset' in entry]
+    entries = sorted([(manifest[utt]['offset'], utt) for utt in packed
+                      if manifest[utt]['offset'] + manifest[utt]['length'] <= pack_size])
+    live_size = sum([manifest[utt]['length'] for _, utt in entries])
+    if pack_size - live_size <= live_size:
+        return False
+
+    print('Compacting {}: {:.1f} MB of {:.1f} MB are stale.'.format(pack_file, (pack_size - live_size) / 1e6,
+                                                                     pack_size / 1e6))
+    tmp_file = '{}.{}.tmp'.format(pack_file, os.getpid())
+    offset = 0
+    with open(pack_file, 'rb') as src, open(tmp_file, 'wb') as dst:
+        for old_offset, utt in entries:
+            src.seek(old_offset)
+            dst.write(src.read(manifest[utt]['length']))
+            manifest[utt]['offset'] = offset
+            offset += manifest[utt]['length']
+    for utt in set(packed) - set([utt for _, utt in entries]):
+        del manifest[utt]
+    os.replace(tmp_file, pack_file)
+    return True
+
+
+def convert_wav(args):
+    cmd, wav_file = args
+    output = read_wav_bytes(cmd)
+    if len(output) == 0:
+        return False
+    tmp_file = '{}.{}.tmp'.format(wav_file, os.getpid())
+    with open(tmp_file, 'wb') as f:
+        f.write(output)
+    os.replace(tmp_file, wav_file)
+    return True
+
+
+def create_wav(save_loc, args, n_workers=20, packed=False):
     make_directory(save_loc)
+    manifest_file = join_path(save_loc, WAV_MANIFEST_FILE)
+    pack_file = join_path(save_loc, WAV_PACK_FILE)
+    manifest = load_json_file(manifest_file) if os.path.exists(manifest_file) else dict()
     wav_file_loc = [join_path(save_loc, '{}.wav'.format(a)) for a in args[:, 0]]
-    print('Checking if files exist...')
-    result = run_parallel(os.path.exists, wav_file_loc, n_workers=20)
-    present = np.sum(np.array(result, dtype=int))
+    source_mtime = [get_mtime(loc) for loc in args[:, 1]]
+
+    print('Checking manifest...')
+    if packed:
+        pack_size = os.path.getsize(pack_file) if os.path.exists(pack_file) else 0
+    else:
+        present_files = set(os.listdir(save_loc))
+    result = []
+    for i, (utt, cmd) in enumerate(zip(args[:, 0], args[:, 4])):
+        entry = manifest.get(utt)
+        valid = entry is not None and entry['cmd'] == cmd and entry['mtime'] == source_mtime[i]
+        if packed:
+            valid = valid and 'offset' in entry and entry['offset'] + entry['length'] <= pack_size
+        else:
+            valid = valid and 'offset' not in entry and '{}.wav'.format(utt) in present_files
+        result.append(valid)
+    result = np.array(result, dtype=bool)
+    present = int(np.sum(result))
     print('{} files present.'.format(present))
-    absent = args.shape[0] - present
-    if absent > 0:
-        result = np.invert(result)
-        convert_cmd = np.array(['{} > {}'.format(cmd, wav_file_loc[i]) for i, cmd in enumerate(args[:, 4])])
-        convert_cmd = convert_cmd[result]
+
+    absent = np.where(np.invert(result))[0]
+    if len(absent) > 0:
         print('Converting...')
-        result = run_parallel(run_command, convert_cmd, n_workers=20)
-        converted = np.sum(np.array(result, dtype=int))
-        print('Converted {} files to wav.'.format(converted))
-    args[:, 1] = wav_file_loc
-    args[:, 4] = ['cat {}'.format(l) for l in wav_file_loc]
-    return args
+        failed = []
+        if packed:
+            # Outputs are appended as workers finish them, so only the wavs in flight are held in memory.
+            outputs = iterate_parallel(read_wav_bytes, list(args[absent, 4]), n_workers=n_workers)
+            with open(pack_file, 'ab') as f:
+                offset = f.tell()
+                for i, output in zip(absent, outputs):
+                    if len(output) == 0:
+                        failed.append(args[i, 0])
+                        continue
+                    f.write(output)
+                    manifest[args[i, 0]] = {'cmd': args[i, 4], 'mtime': source_mtime[i], 'offset': offset,
+                                            'length': len(output)}
+                    offset += len(output)
+            compact_wav_pack(pack_file, manifest)
+        else:
+            convert_args = [(args[i, 4], wav_file_loc[i]) for i in absent]
+            outputs = run_parallel(convert_wav, convert_args, n_workers=n_workers)
+            for i, success in zip(absent, outputs):
+                if success:
+                    manifest[args[i, 0]] = {'cmd': args[i, 4], 'mtime': source_mtime[i]}
+                else:
+                    failed.append(args[i, 0])
+        save_json_file(manifest_file, manifest)
+        print('Converted {} files to wav.'.format(len(absent) - len(failed)))
+        if len(failed) > 0:
+            print('Dropping {} utterances that failed to convert: {}'.format(len(failed), ' '.join(failed[:10]) +
+                                                                             (' ...' if len(failed) > 10 else '')))
+            keep = np.invert(np.isin(args[:, 0], failed))
+            args, wav_file_loc = args[keep], [loc for loc, k in zip(wav_file_loc, keep) if k]
+
+    args = args.astype(object)
+    if packed:
+        read_list = []
+        for utt in args[:, 0]:
+            entry = manifest[utt]
+            read_list.append('tail -c +{} {} | head -c {}'.format(entry['offset'] + 1, pack_file, entry['length']))
+        args[:, 1] = pack_file
+        args[:, 4] = read_list
+    else:
+        args[:, 1] = wav_file_loc
+        args[:, 4] = ['cat {}'.format(l) for l in wav_file_loc]
+    return args.astype(str)
 
 
 def delete_directory(path):
@@ -76,11 +170,7 @@ def delete_directory(path):
 
 
 def get_file_list(location, pattern='*.sph'):
-    file_list = []
-    for path, _, files in os.walk(location):
-        for name in files:
-            if fnmatch(name, pattern):
-                file_list = np.append(file_list, os.path.join(path, name))
+    file_list = np.array([path for _, path in list_files(location, pattern)])
     if len(file_list) == 0:
         raise Warning('No {} files in {}'.format(pattern, location))
     return file_list
@@ -88,13 +178,11 @@ def get_file_list(location, pattern='*.sph'):
 
 def get_file_list_as_dict(location, pattern='*.sph', ext=False):
     file_list = dict()
-    for path, _, files in os.walk(location):
-        for name in files:
-            if fnmatch(name, pattern):
-                key = name
-                if not ext:
-                    key = key[:-len(pattern)+1]
-                file_list[key] = os.path.join(path, name)
+    for name, path in list_files(location, pattern):
+        key = name
+        if not ext:
+            key = key[:-len(pattern)+1]
+        file_list[key] = path
     if len(file_list) == 0:
         raise Warning('No {} files in {}'.format(pattern, location))
     return file_list
@@ -134,14 +222,75 @@ def get_index_array(max_len, shuffle=False):
         return np.linspace(0, max_len - 1, max_len, dtype=int)
 
 
+def get_mtime(file_name):
+    try:
+        return os.path.getmtime(file_name)
+    except OSError:
+        return None
+
+
 def get_time_stamp():
     return time.strftime('%b %d, %Y %l:%M:%S%p')
 
 
+def iterate_parallel(func, args_list, n_workers=10, p_bar=True):
+    # Like run_parallel, but yields results in order as they complete instead of collecting them.
+    pool = mp.Pool(n_workers)
+    out = pool.imap(func, args_list)
+    if p_bar:
+        out = tqdm(out, total=len(args_list))
+    for result in out:
+        yield result
+    pool.close()
+
+
+def join_keys(keys, map_keys, *map_values):
+    # Vectorised dict lookup: a mask of the keys present in map_keys and the matching rows of each map_values.
+    keys = np.asarray(keys, dtype=str)
+    map_keys = np.asarray(map_keys, dtype=str)
+    if len(map_keys) == 0:
+        return np.zeros(len(keys), dtype=bool), [np.zeros((len(keys),) + np.shape(v)[1:], dtype=np.asarray(v).dtype)
+                                                 for v in map_values]
+    order = np.argsort(map_keys, kind='stable')
+    sorted_keys = map_keys[order]
+    # For repeated keys the last one wins, as when building a dict.
+    last = np.append(sorted_keys[1:] != sorted_keys[:-1], True)
+    order, sorted_keys = order[last], sorted_keys[last]
+    pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    found = sorted_keys[pos] == keys
+    return found, [np.asarray(v)[order[pos]] for v in map_values]
+
+
 def load_array(file_name):
     return np.load(file_name)
 
 
+def load_json_file(file_name):
+    with open(file_name, 'r') as f:
+        return load_json(f.read())
+
+
+def load_key_file(file_name, delimiter='[\s]+', skip_rows=0, n_columns=None):
+    # Splits the whole file with two regex passes and one reshape instead of splitting line by line.
+    with open(file_name, 'r') as f:
+        text = f.read()
+    text = re.sub(r'^[^\S\n]+|[^\S\n]+$', '', text, flags=re.M)
+    rows = re.sub(r'\n+', '\n', text).strip('\n').split('\n')[skip_rows:]
+    if len(rows) == 0 or rows == ['']:
+        return [np.array([], dtype=str) for _ in range(n_columns or 0)]
+
+    body = re.sub(delimiter, '\x01', '\x00'.join(rows))
+    rows = np.array(body.split('\x00'))
+    n_fields = np.char.count(rows, '\x01') + 1
+    max_fields = int(np.max(n_fields))
+    if np.all(n_fields == max_fields):
+        fields = np.array(body.replace('\x00', '\x01').split('\x01')).reshape([-1, max_fields])
+    else:
+        fields = np.array([r.split('\x01') + [''] * (max_fields - n) for r, n in zip(rows.tolist(), n_fields)])
+    n_columns = max_fields if n_columns is None else n_columns
+    return [fields[:, i] if i < max_fields else np.full(len(fields), '', dtype=fields.dtype) for i in range(n_columns)]
+
+
 def load_object(file_name):
     with open(file_name, 'rb') as f:
         return pickle.load(f)
@@ -169,6 +318,12 @@ def put_time_stamp(text):
     return time.strftime(' %b %d, %Y %l:%M:%S%p - ') + text
 
 
+def read_wav_bytes(cmd):
+    process = Popen(cmd, stdout=PIPE, stderr=PIPE, shell=True)
+    output, _ = process.communicate()
+    return output if process.returncode == 0 else b''
+
+
 def remove_duplicates(args):
     _, unique_idx = np.unique(args[:, 0], return_index=True)
     return args[unique_idx, :], args.shape[0] - len(unique_idx)
@@ -205,6 +360,13 @@ def save_batch_array(location, args_idx, obj, ext='.npy'):
         save_array(save_loc, obj[i])
 
 
+def save_json_file(file_name, obj):
+    tmp_file = '{}.{}.tmp'.format(file_name, os.getpid())
+    with open(tmp_file, 'w') as f:
+        f.write(dump_json(obj))
+    os.replace(tmp_file, file_name)
+
+
 def save_object(file_name, obj):
     with open(file_name, 'wb') as f:
         pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
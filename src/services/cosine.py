@@ -0,0 +1,27 @@
+import numpy as np
+
+from services.plda import class_statistics, length_normalize, score_pairs
+
+ENROLL_MODES = ['mean', 'score']
+
+
+def combine_sessions(means, enroll_mode='mean'):
+    # Speaker models from the mean of unit session vectors. 'mean' scores against the re-normalised mean embedding;
+    # 'score' keeps the plain average, whose dot product with a unit test vector is the mean of the session scores.
+    if enroll_mode not in ENROLL_MODES:
+        raise ValueError('Unknown enroll mode {}, expected one of {}.'.format(enroll_mode, ENROLL_MODES))
+    return unit_normalize(means) if enroll_mode == 'mean' else means
+
+
+def enroll_sessions(vectors, class_codes, enroll_mode='mean'):
+    counts, means = class_statistics(unit_normalize(vectors), class_codes)[:2]
+    return counts, combine_sessions(means, enroll_mode)
+
+
+def score_cosine_trials(enroll_vectors, test_vectors, enroll_idx, test_idx, block_size=16384):
+    return score_pairs(enroll_vectors, unit_normalize(test_vectors), enroll_idx, test_idx, block_size)
+
+
+def unit_normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float64)
+    return length_normalize(vectors) / np.sqrt(vectors.shape[1])
@@ -0,0 +1,111 @@
+from os.path import exists, join as join_path
+
+import numpy as np
+
+from constants.app_constants import DATA_LIST_COLUMNS_FILE
+from services.common import load_json_file, make_directory, save_json_file
+
+# Column order of the (N, 5) lists built by services.sre_data.
+LIST_COLUMNS = [('index', 'str'), ('location', 'str'), ('channel', 'int'), ('speaker', 'str'), ('read', 'str')]
+
+
+class DataList:
+    def __init__(self, location=None):
+        self.location = location
+        self.n_rows = 0
+        self.columns = []
+        self.types = dict()
+        self.arrays = dict()
+        if location is not None and exists(join_path(location, DATA_LIST_COLUMNS_FILE)):
+            meta = load_json_file(join_path(location, DATA_LIST_COLUMNS_FILE))
+            self.n_rows = meta['n_rows']
+            for name, col_type in meta['columns']:
+                self.columns.append(name)
+                self.types[name] = col_type
+
+    def __len__(self):
+        return self.n_rows
+
+    def add_column(self, name, values, col_type='str'):
+        values = np.asarray(values)
+        if len(self.columns) == 0:
+            self.n_rows = values.shape[0]
+        elif values.shape[0] != self.n_rows:
+            raise ValueError('Column {} has {} rows, list has {}.'.format(name, values.shape[0], self.n_rows))
+
+        if col_type == 'int':
+            arrays = {'values': values.astype(np.int32)}
+        else:
+            # Strings are interned: each distinct value is stored once and rows hold an int32 code.
+            unique_values, codes = np.unique(values.astype(str), return_inverse=True)
+            arrays = {'values': unique_values, 'codes': codes.astype(np.int32)}
+
+        if name not in self.columns:
+            self.columns.append(name)
+        self.types[name] = col_type
+        self.arrays[name] = arrays
+        if self.location is not None:
+            self.save_column(name)
+            self.save_meta()
+
+    def codes(self, name):
+        self.load_column(name)
+        if self.types[name] == 'int':
+            return self.arrays[name]['values']
+        return self.arrays[name]['codes']
+
+    def get(self, name):
+        self.load_column(name)
+        if self.types[name] == 'int':
+            return self.arrays[name]['values']
+        return self.arrays[name]['values'][self.arrays[name]['codes']]
+
+    def load_column(self, name):
+        if name in self.arrays:
+            return
+        if name not in self.types:
+            raise KeyError('No column {} in data list {}.'.format(name, self.location))
+        self.arrays[name] = dict()
+        for part in ['values', 'codes'] if self.types[name] == 'str' else ['values']:
+            self.arrays[name][part] = np.load(join_path(self.location, '{}.{}.npy'.format(name, part)),
+                                              mmap_mode='r')
+
+    def save(self, location):
+        for name in self.columns:
+            # Copy out of the memory maps first; the target files may be the ones being mapped.
+            self.load_column(name)
+            self.arrays[name] = dict([(part, np.array(array)) for part, array in self.arrays[name].items()])
+        self.location = location
+        make_directory(location)
+        for name in self.columns:
+            self.save_column(name)
+        self.save_meta()
+
+    def save_column(self, name):
+        for part, array in self.arrays[name].items():
+            np.save(join_path(self.location, '{}.{}.npy'.format(name, part)), np.asarray(array))
+
+    def save_meta(self):
+        save_json_file(join_path(self.location, DATA_LIST_COLUMNS_FILE),
+                       {'n_rows': self.n_rows, 'columns': [[name, self.types[name]] for name in self.columns]})
+
+    def to_args(self, columns=None):
+        columns = self.columns if columns is None else columns
+        return np.vstack([self.get(name).astype(str) for name in columns]).T
+
+
+def load_data_list(location):
+    if not exists(join_path(location, DATA_LIST_COLUMNS_FILE)):
+        raise IOError('No data list at {}.'.format(location))
+    return DataList(location)
+
+
+def make_data_list(args_list, location=None, columns=LIST_COLUMNS):
+    data_list = DataList()
+    for i, (name, col_type) in enumerate(columns):
+        data_list.add_column(name, args_list[:, i], col_type)
+    for i in range(len(columns), args_list.shape[1]):
+        data_list.add_column('column_{}'.format(i), args_list[:, i])
+    if location is not None:
+        data_list.save(location)
+    return data_list
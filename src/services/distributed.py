@@ -160,7 +160,7 @@ def submit_jobs(jobs_list):
 
 
 def submit_extract_worker_job(model_tag, iteration, worker_id, feats_scp, max_chunk_size, save_loc,
-                              compute=None):
+                              compute=None, embedding_store=False, ark_file=None, scp_file=None):
     model_path = get_model_path(iteration, model_tag, save_loc)
 
     host_name, gpu = compute if compute is not None else ('*', -1)
@@ -168,6 +168,10 @@ def submit_extract_worker_job(model_tag, iteration, worker_id, feats_scp, max_ch
     log_path = get_log_path(iteration, model_tag, save_loc, worker_id, operation='extract')
     cmd = '{} --feats-scp {} --gpu {} --max-chunk-size {} --model-path {} --model-tag {} --save {} --worker-id {}' \
         .format(DISTRIBUTED_EXTRACT_CMD, feats_scp, gpu, max_chunk_size, model_path, model_tag, save_loc, worker_id)
+    if embedding_store:
+        cmd = '{} --embedding-store'.format(cmd)
+    if ark_file is not None:
+        cmd = '{} --ark-file {} --scp-file {}'.format(cmd, ark_file, scp_file)
     job = get_gpu_queue_job(host_name, job_name, log_path, cmd)
     return submit_job(job)
 
@@ -0,0 +1,245 @@
+from glob import glob
+from os.path import exists, getsize, join as join_path
+
+import numpy as np
+import os
+
+from services.common import get_mtime, join_keys, load_json_file, make_directory, save_json_file
+from services.identification import top_k_rows
+
+
+class EmbeddingStore:
+    def __init__(self, location):
+        # Embeddings of many utterances in a few files: a compacted matrix with its keys, plus the append-only
+        # shards written since the last compaction. Everything is memory-mapped. When a key appears more than once
+        # the last write wins, with the shards read after the compacted matrix in name order. The store holds
+        # float32, float16 or int8 codes; int8 rows carry a float32 scale each.
+        self.location = location
+        meta = load_json_file(join_path(location, 'meta.json'))
+        self.dim = meta['dim']
+        self.dtype = np.dtype(meta['dtype'])
+        self.parts = []
+        if exists(join_path(location, 'keys.npy')):
+            scales_file = join_path(location, 'scales.npy')
+            self.parts.append((np.load(join_path(location, 'keys.npy')),
+                               np.load(join_path(location, 'vectors.npy'), mmap_mode='r'),
+                               np.load(scales_file, mmap_mode='r') if self.dtype == np.int8 else None))
+        for keys_file in sorted(glob(join_path(location, 'shard.*.keys'))):
+            self.parts.append(read_shard(keys_file, self.dim, self.dtype))
+
+        sizes = [len(part[0]) for part in self.parts]
+        part_idx = np.repeat(np.arange(len(sizes), dtype=np.int32), sizes)
+        row_idx = np.concatenate([np.arange(size) for size in sizes] + [np.zeros(0, dtype=np.int64)])
+        all_keys = np.concatenate([part[0].astype(str) for part in self.parts] + [np.zeros(0, dtype=str)])
+        self.keys, last = np.unique(all_keys[::-1], return_index=True)
+        last = len(all_keys) - 1 - last
+        self.part_idx, self.row_idx = part_idx[last], row_idx[last]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def compact(self, block_size=65536, dtype=None):
+        # Merges the compacted matrix and every shard into one sorted matrix and drops the shards, converting the
+        # store to dtype if one is given. Run it while no worker is writing.
+        self.save(self.location, dtype, block_size)
+        for keys_file in glob(join_path(self.location, 'shard.*.keys')):
+            for shard_file in glob('{}.*'.format(keys_file[:-len('.keys')])):
+                os.remove(shard_file)
+        self.__init__(self.location)
+        return self
+
+    def dot_rows(self, idx, queries):
+        # Inner products of the rows at positions idx with the queries, computed from the stored codes: an int8
+        # row is scaled after its product instead of being dequantised first.
+        codes, scales = self.read_codes(idx)
+        scores = codes.astype(np.promote_types(self.dtype, np.float32)).dot(np.asarray(queries).T)
+        if scales is not None:
+            scores *= scales[:, None]
+        return scores
+
+    def get_vectors(self, keys):
+        # A mask of the keys present in the store and their vectors, in the order of keys.
+        found, (idx,) = join_keys(keys, self.keys, np.arange(len(self.keys)))
+        vectors = np.zeros((len(found), self.dim), dtype=np.promote_types(self.dtype, np.float32))
+        vectors[found] = self.read_rows(idx[found])
+        return found, vectors
+
+    def read_codes(self, idx):
+        # Stored codes of the store's keys at positions idx, gathered part by part, and their scales for int8.
+        codes = np.zeros((len(idx), self.dim), dtype=self.dtype)
+        scales = np.zeros(len(idx), dtype=np.float32) if self.dtype == np.int8 else None
+        part_idx, row_idx = self.part_idx[idx], self.row_idx[idx]
+        for i, (_, part_codes, part_scales) in enumerate(self.parts):
+            rows = np.flatnonzero(part_idx == i)
+            if len(rows) > 0:
+                codes[rows] = part_codes[row_idx[rows]]
+                if scales is not None:
+                    scales[rows] = part_scales[row_idx[rows]]
+        return codes, scales
+
+    def read_rows(self, idx):
+        return dequantize_rows(*self.read_codes(idx))
+
+    def save(self, location, dtype=None, block_size=65536):
+        # Writes every vector as one compacted store at location, which may be this store's own. Requantising a
+        # float32 store to float16 or int8 gives a copy whose EER can be compared with the original.
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        make_directory(location)
+        tmp_files = dict([(name, join_path(location, '{}.{}.tmp.npy'.format(name, os.getpid())))
+                          for name in ['vectors', 'scales', 'keys']])
+        vectors = np.lib.format.open_memmap(tmp_files['vectors'], mode='w+', dtype=dtype, shape=(len(self), self.dim))
+        scales = np.zeros(len(self), dtype=np.float32)
+        for start in range(0, len(self), block_size):
+            idx = np.arange(start, min(start + block_size, len(self)))
+            if dtype == self.dtype:
+                vectors[idx], block_scales = self.read_codes(idx)
+            else:
+                vectors[idx], block_scales = quantize_rows(self.read_rows(idx), dtype)
+            if block_scales is not None:
+                scales[idx] = block_scales
+        vectors.flush()
+        del vectors
+        np.save(tmp_files['keys'], self.keys)
+        if dtype == np.int8:
+            np.save(tmp_files['scales'], scales)
+        for name, tmp_file in tmp_files.items():
+            if exists(tmp_file):
+                os.replace(tmp_file, join_path(location, '{}.npy'.format(name)))
+            elif exists(join_path(location, '{}.npy'.format(name))):
+                os.remove(join_path(location, '{}.npy'.format(name)))
+        save_json_file(join_path(location, 'meta.json'), {'dim': self.dim, 'dtype': dtype.name})
+        return location
+
+    def search(self, queries, top_k=10, block_size=65536):
+        # Keys and inner products of the top_k rows for each query, best first, streamed block by block over the
+        # stored codes. Missing results have the key '' and score -inf.
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        rows = np.full((queries.shape[0], top_k), -1, dtype=np.int64)
+        scores = np.full((queries.shape[0], top_k), -np.inf)
+        for start in range(0, len(self), block_size):
+            idx = np.arange(start, min(start + block_size, len(self)))
+            block_rows, block_scores = top_k_rows(self.dot_rows(idx, queries).T, top_k)
+            best, scores = top_k_rows(np.hstack([scores, block_scores]), top_k)
+            rows = np.take_along_axis(np.hstack([rows, idx[block_rows]]), best, axis=1)
+        return np.append(self.keys, '')[rows], scores
+
+
+class EmbeddingWriter:
+    def __init__(self, location, shard, dtype=None):
+        # Appends to one shard of the store; parallel workers write to different shards. A vector (and its int8
+        # scale) is written before its key, so a shard cut short by a crash still reads back consistently. Without
+        # a dtype, an existing store keeps its own and a new one holds float32.
+        self.location = location
+        meta_file = join_path(location, 'meta.json')
+        if dtype is None:
+            dtype = load_json_file(meta_file)['dtype'] if exists(meta_file) else np.float32
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        make_directory(location)
+        keys_file = join_path(location, 'shard.{}.keys'.format(shard))
+        vectors_file = join_path(location, 'shard.{}.bin'.format(shard))
+        scales_file = join_path(location, 'shard.{}.scale'.format(shard))
+        if exists(meta_file) and exists(keys_file):
+            # A torn last row from an earlier run is cut off before appending.
+            meta = load_json_file(meta_file)
+            n_rows = len(read_shard(keys_file, meta['dim'], np.dtype(meta['dtype']))[0])
+            with open(keys_file) as f:
+                lines = f.read().split('\n')[:n_rows]
+            with open(keys_file, 'w') as f:
+                f.write(''.join(['{}\n'.format(line) for line in lines]))
+            os.truncate(vectors_file, n_rows * meta['dim'] * np.dtype(meta['dtype']).itemsize)
+            if exists(scales_file):
+                os.truncate(scales_file, n_rows * np.dtype(np.float32).itemsize)
+        self.vectors_file = open(vectors_file, 'ab')
+        self.scales_file = open(scales_file, 'ab') if self.dtype == np.int8 else None
+        self.keys_file = open(keys_file, 'a')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.vectors_file.close()
+        if self.scales_file is not None:
+            self.scales_file.close()
+        self.keys_file.close()
+
+    def set_dim(self, dim):
+        meta_file = join_path(self.location, 'meta.json')
+        meta = {'dim': dim, 'dtype': self.dtype.name}
+        if exists(meta_file) and load_json_file(meta_file) != meta:
+            raise ValueError('Store {} holds {}, cannot write {}.'.format(self.location, load_json_file(meta_file),
+                                                                          meta))
+        if not exists(meta_file):
+            save_json_file(meta_file, meta)
+        self.dim = dim
+
+    def write(self, key, vector):
+        self.write_batch([key], np.reshape(vector, (1, -1)))
+
+    def write_batch(self, keys, vectors):
+        vectors = np.asarray(vectors)
+        if self.dim is None:
+            self.set_dim(vectors.shape[1])
+        if vectors.shape[1] != self.dim:
+            raise ValueError('Expected vectors of dimension {}, got {}.'.format(self.dim, vectors.shape[1]))
+        codes, scales = quantize_rows(vectors, self.dtype)
+        self.vectors_file.write(codes.tobytes())
+        self.vectors_file.flush()
+        if scales is not None:
+            self.scales_file.write(scales.tobytes())
+            self.scales_file.flush()
+        self.keys_file.write(''.join(['{}\n'.format(key) for key in keys]))
+        self.keys_file.flush()
+
+
+def dequantize_rows(codes, scales=None):
+    # float16 and int8 codes are widened to float32 and int8 rows multiplied by their scale.
+    vectors = np.asarray(codes, dtype=np.promote_types(codes.dtype, np.float32))
+    if scales is not None:
+        vectors *= scales[:, None]
+    return vectors
+
+
+def is_store_current(location, npy_files):
+    # Whether the store can stand in for the per-utterance .npy files: it exists and none of them was written after
+    # it, as a later --output npy run would have.
+    if not exists(join_path(location, 'meta.json')):
+        return False
+    store_mtime = max([get_mtime(f) or 0 for f in glob(join_path(location, '*'))])
+    newer = [f for f in npy_files if (get_mtime(f) or 0) > store_mtime]
+    if len(newer) > 0:
+        print('Embedding store {} is older than {} of the .npy embeddings (e.g. {}); using the .npy files.'
+              .format(location, len(newer), newer[0]))
+    return len(newer) == 0
+
+
+def quantize_rows(vectors, dtype):
+    # Codes of the rows in dtype, and for int8 one float32 scale per row: symmetric quantisation that maps the
+    # largest magnitude of each row to 127.
+    dtype = np.dtype(dtype)
+    vectors = np.asarray(vectors).reshape(len(vectors), -1)
+    if dtype != np.int8:
+        return vectors.astype(dtype), None
+    scales = (np.max(np.abs(vectors), axis=1) / 127.0).astype(np.float32)
+    codes = np.round(vectors / np.where(scales > 0, scales, 1.0)[:, None])
+    return np.clip(codes, -127, 127).astype(np.int8), scales
+
+
+def read_shard(keys_file, dim, dtype):
+    prefix = keys_file[:-len('.keys')]
+    vectors_file = '{}.bin'.format(prefix)
+    scales_file = '{}.scale'.format(prefix)
+    with open(keys_file) as f:
+        lines = f.read().split('\n')
+    # Only rows with a complete key line, a complete vector and, for int8, a complete scale count.
+    n_rows = min(len(lines) - 1, getsize(vectors_file) // (dim * dtype.itemsize))
+    if dtype == np.int8:
+        n_rows = min(n_rows, getsize(scales_file) // np.dtype(np.float32).itemsize)
+    keys = np.array(lines[:n_rows], dtype=str)
+    if n_rows == 0:
+        return keys, np.zeros((0, dim), dtype=dtype), np.zeros(0, dtype=np.float32) if dtype == np.int8 else None
+    return keys, np.memmap(vectors_file, dtype=dtype, mode='r', shape=(n_rows, dim)), \
+        np.memmap(scales_file, dtype=np.float32, mode='r', shape=(n_rows,)) if dtype == np.int8 else None
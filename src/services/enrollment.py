@@ -0,0 +1,122 @@
+from os.path import join as join_path
+
+import numpy as np
+
+from services.common import make_directory
+
+
+class EnrollmentStore:
+    def __init__(self, dim):
+        # Per-speaker sufficient statistics (sum and count of the session vectors). The session vectors are kept
+        # so that removing a session subtracts it again; adding or removing a session costs O(dim).
+        self.dim = dim
+        self.speakers = []
+        self.speaker_rows = dict()
+        self.sums = np.zeros((0, dim))
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.sessions = []
+        self.session_rows = dict()
+        self.session_speakers = []
+        self.session_sources = []
+        self.session_vectors = np.zeros((0, dim))
+
+    def add(self, session_keys, speakers, vectors, sources=None):
+        # A session that is already enrolled is replaced. Returns the speakers whose statistics changed.
+        session_keys = [str(key) for key in session_keys]
+        speakers = [str(speaker) for speaker in speakers]
+        sources = [''] * len(session_keys) if sources is None else [str(source) for source in sources]
+        vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, self.dim)
+        changed = set(self.remove([key for key in set(session_keys) if key in self.session_rows]))
+
+        self.session_vectors = grow_rows(self.session_vectors, len(self.sessions) + len(session_keys))
+        self.sums = grow_rows(self.sums, len(self.speakers) + len(set(speakers)))
+        self.counts = grow_rows(self.counts, self.sums.shape[0])
+        for key, speaker, source, vector in zip(session_keys, speakers, sources, vectors):
+            if key in self.session_rows:
+                # Repeated within this call: the last vector wins.
+                changed.update(self.remove([key]))
+            try:
+                speaker_row = self.speaker_rows[speaker]
+            except KeyError:
+                speaker_row = self.speaker_rows[speaker] = len(self.speakers)
+                self.speakers.append(speaker)
+                self.sums[speaker_row] = 0.0
+                self.counts[speaker_row] = 0
+            self.session_rows[key] = len(self.sessions)
+            self.session_vectors[len(self.sessions)] = vector
+            self.sessions.append(key)
+            self.session_speakers.append(speaker)
+            self.session_sources.append(source)
+            self.sums[speaker_row] += vector
+            self.counts[speaker_row] += 1
+            changed.add(speaker)
+        return sorted(changed)
+
+    def get_statistics(self, speakers=None):
+        # Keys, counts and mean session vectors, in sorted key order when no speakers are given.
+        speakers = np.array(sorted(self.speakers) if speakers is None else speakers, dtype=str)
+        rows = np.array([self.speaker_rows[speaker] for speaker in speakers.tolist()], dtype=np.int64)
+        counts = self.counts[rows]
+        return speakers, counts, self.sums[rows] / counts[:, None]
+
+    def remove(self, session_keys):
+        # Speakers left without sessions are dropped. Returns the speakers whose statistics changed.
+        changed = set()
+        for key in session_keys:
+            row = self.session_rows.pop(key)
+            speaker = self.session_speakers[row]
+            speaker_row = self.speaker_rows[speaker]
+            self.sums[speaker_row] -= self.session_vectors[row]
+            self.counts[speaker_row] -= 1
+            if self.counts[speaker_row] == 0:
+                self.remove_speaker(speaker)
+            changed.add(speaker)
+
+            # The last session moves into the freed slot.
+            last = len(self.sessions) - 1
+            if row != last:
+                self.sessions[row] = self.sessions[last]
+                self.session_speakers[row] = self.session_speakers[last]
+                self.session_sources[row] = self.session_sources[last]
+                self.session_vectors[row] = self.session_vectors[last]
+                self.session_rows[self.sessions[row]] = row
+            self.sessions.pop()
+            self.session_speakers.pop()
+            self.session_sources.pop()
+        return sorted(changed)
+
+    def remove_speaker(self, speaker):
+        row = self.speaker_rows.pop(speaker)
+        last = len(self.speakers) - 1
+        if row != last:
+            self.speakers[row] = self.speakers[last]
+            self.sums[row] = self.sums[last]
+            self.counts[row] = self.counts[last]
+            self.speaker_rows[self.speakers[row]] = row
+        self.speakers.pop()
+
+    def save(self, location):
+        make_directory(location)
+        np.save(join_path(location, 'sessions.npy'), np.array(self.sessions, dtype=str))
+        np.save(join_path(location, 'session_speakers.npy'), np.array(self.session_speakers, dtype=str))
+        np.save(join_path(location, 'session_sources.npy'), np.array(self.session_sources, dtype=str))
+        np.save(join_path(location, 'session_vectors.npy'), self.session_vectors[:len(self.sessions)])
+        return location
+
+
+def grow_rows(array, size):
+    # Capacity doubles, so appending one row at a time stays amortised O(dim).
+    if size <= array.shape[0]:
+        return array
+    grown = np.zeros((max(size, 2 * array.shape[0]),) + array.shape[1:], dtype=array.dtype)
+    grown[:array.shape[0]] = array
+    return grown
+
+
+def load_enrollment_store(location):
+    # The speaker statistics are summed again from the stored sessions, which also clears any rounding drift.
+    vectors = np.load(join_path(location, 'session_vectors.npy'))
+    store = EnrollmentStore(vectors.shape[1])
+    store.add(np.load(join_path(location, 'sessions.npy')), np.load(join_path(location, 'session_speakers.npy')),
+              vectors, np.load(join_path(location, 'session_sources.npy')))
+    return store
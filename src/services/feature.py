@@ -1,23 +1,38 @@
 import re
-from os.path import exists, join as join_path
+from glob import glob
+from os.path import abspath, exists, getsize, join as join_path
 
 import numpy as np
+import time
 
 from constants.app_constants import DATA_SCP_FILE, MFCC_DIR, VAD_DIR, FEATS_SCP_FILE, UTT2NUM_FRAMES_FILE, TMP_DIR, \
-    VAD_SCP_FILE
-from services.common import load_array, run_parallel, run_command
-from services.kaldi import Kaldi, spaced_file_to_dict
+    VAD_SCP_FILE, KALDI_QUEUE_FILE, KALDI_LOCAL_RUN_FILE, FEATS_REPORT_FILE
+from kaldi.split_scp import balanced_split, get_line_groups, get_line_weights
+from services.audio import open_audio, source_file
+from services.common import load_array, make_directory, run_parallel, run_command, save_json_file
+from services.data_list import DataList
+from services.kaldi import Kaldi, spaced_file_to_dict, write_kaldi_matrix_header
+
+FLOAT_EPSILON = np.finfo(np.float32).eps
+FRAME_BLOCK = 512
+FRAME_SHIFT_SECONDS = 0.01
 
 
 class MFCC:
-    def __init__(self, fs=8000, fl=100, fh=4000, frame_len_ms=25, n_jobs=20, n_ceps=20, save_loc='../save'):
+    def __init__(self, fs=8000, fl=100, fh=4000, frame_len_ms=25, n_jobs=20, n_ceps=20, local=False, sub_splits=1,
+                 native_audio=False, save_loc='../save'):
         mfcc_loc = join_path(save_loc, MFCC_DIR)
         params_file = join_path(mfcc_loc, 'mfcc.params')
         config_file = join_path(mfcc_loc, 'mfcc.conf')
+        n_splits = n_jobs * sub_splits if local else n_jobs
+        queue_cmd = get_queue_cmd(n_jobs, local)
 
         with open(params_file, 'w') as f:
-            f.write('nj={}\n'.format(n_jobs))
+            f.write('cmd="{}"\n'.format(queue_cmd))
+            f.write('nj={}\n'.format(n_splits))
             f.write('compress={}\n'.format('true'))
+            f.write('native_audio={}\n'.format('true' if native_audio else 'false'))
+            f.write('sample_rate={}\n'.format(fs))
             f.write('mfcc_loc={}\n'.format(mfcc_loc))
             f.write('mfcc_config={}\n'.format(config_file))
 
@@ -32,12 +47,72 @@ class MFCC:
         self.mfcc_loc = mfcc_loc
         self.save_loc = save_loc
         self.params_file = params_file
+        self.front_end_params = {'fs': fs, 'fl': fl, 'fh': fh, 'frame_len_ms': frame_len_ms, 'n_ceps': n_ceps}
         self.n_ceps = n_ceps
         self.n_jobs = n_jobs
+        self.n_splits = n_splits
+        self.local = local
+        self.sub_splits = sub_splits
+        self.queue_cmd = queue_cmd
 
     def extract(self, data_loc, split):
         return Kaldi().run_command('sh ./kaldi/make_mfcc.sh {} {} {}'.format(data_loc, split, self.params_file), print_error=True)
 
+    def extract_in_process(self, data_loc, split, threshold=5.5, mean_scale=0.5, cmvn_window=300, var_norm=False,
+                           chunk_frames=None):
+        tmp_loc = join_path(self.save_loc, TMP_DIR)
+        wav_scp = join_path(data_loc, 'wav.scp')
+
+        make_directory(join_path(self.mfcc_loc, 'log'))
+        make_directory(tmp_loc)
+
+        with open(wav_scp) as f:
+            lines = np.array(f.readlines())
+        splits = balanced_split(get_line_weights(lines, weight_by_size=True), self.n_splits, get_line_groups(lines))
+
+        args_list = []
+        for i in range(self.n_splits):
+            split_wav_scp = join_path(tmp_loc, 'wav.{}.{}.scp'.format(split, i + 1))
+            with open(split_wav_scp, 'w') as f:
+                f.writelines(lines[splits[i]])
+            args_list.append({'wav_scp': split_wav_scp,
+                              'ark': join_path(self.mfcc_loc, 'voiced_feats.{}.{}.ark'.format(split, i + 1)),
+                              'scp': join_path(self.mfcc_loc, 'voiced_feats.{}.{}.scp'.format(split, i + 1)),
+                              'utt2num_frames': join_path(self.mfcc_loc, 'log/utt2num_frames.{}.{}'.format(split, i + 1)),
+                              'front_end': self.front_end_params, 'threshold': threshold, 'mean_scale': mean_scale,
+                              'cmvn_window': cmvn_window, 'var_norm': var_norm, 'chunk_frames': chunk_frames})
+
+        print('MFCC: Extracting voiced, normalized features in-process...')
+        start = time.time()
+        job_stats = run_parallel(extract_features_job, args_list, n_workers=self.n_jobs, p_bar=False)
+        wall_seconds = time.time() - start
+
+        run_command('for n in $(seq {nj}); do \n'
+                    '   cat {mfcc_loc}/voiced_feats.{name}.$n.scp || exit 1;\n'
+                    'done | LC_ALL=C sort -k1,1 > {data_loc}/voiced_feats.scp || exit 1'
+                    .format(mfcc_loc=self.mfcc_loc, data_loc=data_loc, nj=self.n_splits, name=split))
+
+        run_command('for n in $(seq {nj}); do \n'
+                    '   cat {mfcc_loc}/log/utt2num_frames.{name}.$n || exit 1;\n'
+                    'done | LC_ALL=C sort -k1,1 > {data_loc}/utt2num_frames || exit 1'
+                    .format(mfcc_loc=self.mfcc_loc, data_loc=data_loc, nj=self.n_splits, name=split))
+
+        # Stage times are summed over jobs, so their fractions show where the CPU time goes.
+        stage_seconds = dict()
+        for stats in job_stats:
+            for stage, seconds in stats['stages'].items():
+                stage_seconds[stage] = stage_seconds.get(stage, 0) + seconds
+        report = make_throughput_report(split, wall_seconds, stage_seconds,
+                                        sum([stats['utterances'] for stats in job_stats]),
+                                        sum([stats['audio_seconds'] for stats in job_stats]),
+                                        sum([stats['bytes_written'] for stats in job_stats]),
+                                        {'extract': [stats['seconds'] for stats in job_stats]},
+                                        np.concatenate([stats['utterance_seconds'] for stats in job_stats]))
+        report['failed'] = sum([stats['failed'] for stats in job_stats], [])
+        report['unvoiced'] = sum([stats['unvoiced'] for stats in job_stats], [])
+        save_json_file(join_path(data_loc, FEATS_REPORT_FILE), report)
+        print_throughput_report(report)
+
     def extract_with_vad_and_normalization(self, data_loc, split, threshold=5.5, mean_scale=0.5, cmvn_window=300,
                                            var_norm=False):
         vad_loc = join_path(self.save_loc, VAD_DIR)
@@ -45,20 +120,33 @@ class MFCC:
 
         feats_scp = join_path(data_loc, FEATS_SCP_FILE)
         vad_scp = join_path(data_loc, VAD_SCP_FILE)
+        utt2num_frames = join_path(data_loc, UTT2NUM_FRAMES_FILE)
 
+        stage_seconds = dict()
+        start = time.time()
         print('MFCC: Extracting features...')
         self.extract(data_loc, split)
+        start = add_time(stage_seconds, 'mfcc', start)
+        audio_seconds = sum([int(n) for n in spaced_file_to_dict(utt2num_frames).values()]) * FRAME_SHIFT_SECONDS \
+            if exists(utt2num_frames) else 0
 
         print('MFCC: Computing VAD...')
-        vad = VAD(threshold, mean_scale, n_jobs=self.n_jobs, save_loc=self.save_loc)
+        vad = VAD(threshold, mean_scale, n_jobs=self.n_jobs, local=self.local, sub_splits=self.sub_splits,
+                  save_loc=self.save_loc)
         vad.compute(data_loc, split)
+        start = add_time(stage_seconds, 'vad', start)
 
         print('MFCC: Normalizing features and selecting voiced frames..')
         feats_scp_dict = spaced_file_to_dict(feats_scp)
         vad_scp_dict = spaced_file_to_dict(vad_scp)
 
-        splits = np.array_split(list(feats_scp_dict.keys()), self.n_jobs)
-        for i in range(self.n_jobs):
+        keys = np.array(list(feats_scp_dict.keys()))
+        if exists(utt2num_frames):
+            frames_dict = spaced_file_to_dict(utt2num_frames)
+            splits = [keys[idx] for idx in balanced_split([int(frames_dict.get(k, 0)) for k in keys], self.n_splits)]
+        else:
+            splits = np.array_split(keys, self.n_splits)
+        for i in range(self.n_splits):
             split_feat_scp = open(join_path(tmp_loc, 'feats.{}.scp'.format(i + 1)), 'w')
             split_vad_scp = open(join_path(tmp_loc, 'vad.{}.scp'.format(i + 1)), 'w')
             for key in splits[i]:
@@ -74,27 +162,116 @@ class MFCC:
                       'ark,scp:{mfcc_loc}/voiced_feats.{name}.JOB.ark,{mfcc_loc}/voiced_feats.{name}.JOB.scp || exit 1;'
                       .format(mfcc_loc=self.mfcc_loc, tmp_loc=tmp_loc, vad_loc=vad_loc,
                               var_norm='true' if var_norm else 'false',
-                              nj=self.n_jobs, window=cmvn_window, name=split))
+                              nj=self.n_splits, window=cmvn_window, name=split), queue_loc=self.queue_cmd)
+        start = add_time(stage_seconds, 'cmvn_select_write', start)
 
         run_command('for n in $(seq {nj}); do \n'
                     '   cat {mfcc_loc}/voiced_feats.{name}.$n.scp || exit 1;\n'
-                    'done > {data_loc}/voiced_feats.scp || exit 1'.format(mfcc_loc=self.mfcc_loc, data_loc=data_loc,
-                                                                          nj=self.n_jobs, name=split))
+                    'done | LC_ALL=C sort -k1,1 > {data_loc}/voiced_feats.scp || exit 1'
+                    .format(mfcc_loc=self.mfcc_loc, data_loc=data_loc, nj=self.n_splits, name=split))
 
         run_command('for n in $(seq {nj}); do \n'
                     '   cat {mfcc_loc}/log/utt2num_frames.{name}.$n || exit 1;\n'
-                    'done > {data_loc}/utt2num_frames || exit 1'.format(mfcc_loc=self.mfcc_loc, data_loc=data_loc,
-                                                                        nj=self.n_jobs, name=split))
+                    'done | LC_ALL=C sort -k1,1 > {data_loc}/utt2num_frames || exit 1'
+                    .format(mfcc_loc=self.mfcc_loc, data_loc=data_loc, nj=self.n_splits, name=split))
+        add_time(stage_seconds, 'merge', start)
+
+        # Kaldi binaries do not time single utterances; per-job times come from the runner's accounting lines.
+        ark_files = glob(join_path(self.mfcc_loc, 'mfcc.{}.*.ark'.format(split))) + \
+            glob(join_path(vad_loc, 'vad.{}.*.ark'.format(split))) + \
+            glob(join_path(self.mfcc_loc, 'voiced_feats.{}.*.ark'.format(split)))
+        job_seconds = {
+            'mfcc': get_job_seconds(join_path(self.mfcc_loc, 'log/mfcc.{}.{{}}.log'.format(split)), self.n_splits),
+            'vad': get_job_seconds(join_path(vad_loc, 'log/vad.{}.{{}}.log'.format(split)), self.n_splits),
+            'cmvn_select_write': get_job_seconds(join_path(self.mfcc_loc, 'log/voiced_feats.{}.log'), self.n_splits)
+        }
+        report = make_throughput_report(split, sum(stage_seconds.values()), stage_seconds, len(keys), audio_seconds,
+                                        sum([getsize(f) for f in ark_files]), job_seconds)
+        save_json_file(join_path(data_loc, FEATS_REPORT_FILE), report)
+        print_throughput_report(report)
+
+
+class MfccFrontEnd:
+    def __init__(self, fs=8000, fl=20, fh=3700, frame_len_ms=25, frame_shift_ms=10, n_ceps=23, n_mel=23,
+                 preemphasis=0.97, lifter=22):
+        self.frame_length = int(fs * frame_len_ms / 1000)
+        self.frame_shift = int(fs * frame_shift_ms / 1000)
+        self.n_fft = 1 << (self.frame_length - 1).bit_length()
+        self.preemphasis = preemphasis
+        self.n_ceps = n_ceps
+        self.window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(self.frame_length) / (self.frame_length - 1))) ** 0.85
+
+        fh = fh if fh > 0 else fs / 2.0 + fh
+        mel_low, mel_high = mel_scale(fl), mel_scale(fh)
+        mel_delta = (mel_high - mel_low) / (n_mel + 1)
+        fft_mel = mel_scale(np.arange(self.n_fft // 2) * fs / float(self.n_fft))
+        self.mel_banks = np.zeros([n_mel, self.n_fft // 2])
+        for b in range(n_mel):
+            left, center, right = mel_low + b * mel_delta, mel_low + (b + 1) * mel_delta, mel_low + (b + 2) * mel_delta
+            rising = (fft_mel > left) & (fft_mel <= center)
+            falling = (fft_mel > center) & (fft_mel < right)
+            self.mel_banks[b, rising] = (fft_mel[rising] - left) / (center - left)
+            self.mel_banks[b, falling] = (right - fft_mel[falling]) / (right - center)
+
+        k = np.arange(n_mel)
+        dct = np.sqrt(2.0 / n_mel) * np.cos(np.pi / n_mel * np.outer(k, k + 0.5))
+        dct[0, :] = np.sqrt(1.0 / n_mel)
+        lifter_coeffs = 1.0 + 0.5 * lifter * np.sin(np.pi * np.arange(n_ceps) / lifter)
+        self.dct = (dct[:n_ceps, :] * lifter_coeffs.reshape([-1, 1])).T
+
+    def compute(self, samples, start_frame, n_frames):
+        feats = np.zeros([n_frames, self.n_ceps], dtype=np.float32)
+        for block_start in range(start_frame, start_frame + n_frames, FRAME_BLOCK):
+            block, _ = self.compute_block(samples, block_start)
+            n = min(FRAME_BLOCK, start_frame + n_frames - block_start)
+            feats[block_start - start_frame:block_start - start_frame + n] = block[:n]
+        return feats
+
+    def compute_block(self, samples, start_frame, energy_only=False):
+        # Every block has FRAME_BLOCK rows, so chunked and whole-file runs perform identical floating point ops.
+        n_samples = len(samples)
+        idx = (start_frame + np.arange(FRAME_BLOCK)).reshape([-1, 1]) * self.frame_shift \
+            + (self.frame_shift // 2 - self.frame_length // 2) + np.arange(self.frame_length).reshape([1, -1])
+        idx = np.mod(idx, 2 * n_samples)
+        idx = np.where(idx >= n_samples, 2 * n_samples - 1 - idx, idx)
+        # Only the sample range this block covers is read and converted; samples may be a SampleReader.
+        low = int(np.min(idx))
+        frames = np.asarray(samples[low:int(np.max(idx)) + 1], dtype=np.float64)[idx - low]
+        frames = frames - np.mean(frames, axis=1, keepdims=True)
+        log_energy = np.log(np.maximum(np.sum(frames ** 2, axis=1), FLOAT_EPSILON))
+        if energy_only:
+            return None, log_energy
+
+        frames[:, 1:] -= self.preemphasis * frames[:, :-1]
+        frames[:, 0] -= self.preemphasis * frames[:, 0]
+        frames *= self.window
+        spectrum = np.abs(np.fft.rfft(frames, n=self.n_fft, axis=1)[:, :self.n_fft // 2]) ** 2
+        mel_energies = np.log(np.maximum(np.dot(spectrum, self.mel_banks.T), FLOAT_EPSILON))
+        feats = np.dot(mel_energies, self.dct)
+        feats[:, 0] = log_energy
+        return feats.astype(np.float32), log_energy
+
+    def log_energy(self, samples, n_frames):
+        energy = np.zeros(n_frames, dtype=np.float32)
+        for block_start in range(0, n_frames, FRAME_BLOCK):
+            _, block = self.compute_block(samples, block_start, energy_only=True)
+            n = min(FRAME_BLOCK, n_frames - block_start)
+            energy[block_start:block_start + n] = block[:n]
+        return energy
+
+    def num_frames(self, n_samples):
+        return (n_samples + self.frame_shift // 2) // self.frame_shift
 
 
 class VAD:
-    def __init__(self, threshold=5.5, mean_scale=0.5, n_jobs=20, save_loc='../save'):
+    def __init__(self, threshold=5.5, mean_scale=0.5, n_jobs=20, local=False, sub_splits=1, save_loc='../save'):
         vad_loc = join_path(save_loc, VAD_DIR)
         params_file = join_path(vad_loc, 'vad.params')
         config_file = join_path(vad_loc, 'vad.conf')
 
         with open(params_file, 'w') as f:
-            f.write('nj={}\n'.format(n_jobs))
+            f.write('cmd="{}"\n'.format(get_queue_cmd(n_jobs, local)))
+            f.write('nj={}\n'.format(n_jobs * sub_splits if local else n_jobs))
             f.write('vad_loc={}\n'.format(vad_loc))
             f.write('vad_config={}\n'.format(config_file))
 
@@ -109,12 +286,156 @@ class VAD:
 
 
 def add_frames_to_args(args_list, frame_dict):
+    if isinstance(args_list, DataList):
+        args_list.add_column('frames', [frame_dict[key] for key in args_list.get('index')], 'int')
+        return args_list
     frames = []
     for key in args_list[:, 0]:
         frames.append(frame_dict[key])
     return np.vstack([args_list.T, frames]).T
 
 
+def add_time(timings, stage, start):
+    now = time.time()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0) + now - start
+    return now
+
+
+def apply_sliding_cmvn(feats, window=300, var_norm=False):
+    n_frames = feats.shape[0]
+    cum_sum, cum_sq_sum = sliding_cmvn_sums(feats, None, var_norm)
+    return sliding_cmvn_rows(feats, cum_sum, cum_sq_sum, 0, 0, n_frames, n_frames, window, var_norm)
+
+
+def compute_vad(log_energy, threshold=5.5, mean_scale=0.5, context=0, proportion=0.6):
+    n_frames = len(log_energy)
+    if n_frames == 0:
+        return np.zeros(0, dtype=bool)
+    energy_threshold = threshold + mean_scale * np.sum(log_energy.astype(np.float64)) / n_frames
+    above = np.concatenate([[0], np.cumsum(log_energy > energy_threshold)])
+    t = np.arange(n_frames)
+    start, end = np.maximum(t - context, 0), np.minimum(t + context + 1, n_frames)
+    return (above[end] - above[start]) >= (end - start) * proportion
+
+
+def extract_features_job(args):
+    job_start = time.time()
+    front_end = MfccFrontEnd(**args['front_end'])
+    fs = args['front_end']['fs']
+    timings = dict()
+    utterance_seconds = []
+    audio_seconds = 0
+    lines = []
+    with open(args['wav_scp']) as f:
+        for line in f.readlines():
+            tokens = line.strip().split(None, 1)
+            if len(tokens) == 2:
+                lines.append(tokens)
+    # Channels and segments of one recording run back to back so they share a single decode.
+    lines.sort(key=lambda tokens: source_file(tokens[1]))
+
+    failed = []
+    unvoiced = []
+    with open(args['ark'], 'wb') as ark, open(args['scp'], 'w') as scp, open(args['utt2num_frames'], 'w') as frames:
+        for utt, cmd in lines:
+            utt_start = start = time.time()
+            ark_pos = ark.tell()
+            try:
+                samples, _ = open_audio(cmd, fs)
+                audio_seconds += len(samples) / float(fs)
+                add_time(timings, 'decode', start)
+                offset = None
+                n_rows = 0
+                for i, chunk in enumerate(extract_voiced_features(samples, front_end, args['threshold'],
+                                                                  args['mean_scale'], args['cmvn_window'],
+                                                                  args['var_norm'], args['chunk_frames'], timings)):
+                    start = time.time()
+                    if i == 0:
+                        n_rows = chunk
+                        if n_rows == 0:
+                            break
+                        offset = write_kaldi_matrix_header(ark, utt, n_rows, front_end.n_ceps)
+                    else:
+                        ark.write(np.asarray(chunk, dtype='<f4').tobytes())
+                    add_time(timings, 'write', start)
+            except Exception as e:
+                # Like compute-mfcc-feats, a recording that cannot be read is skipped; its partial matrix is cut off.
+                print('MFCC: Skipping {}: {!r}'.format(utt, e))
+                ark.seek(ark_pos)
+                ark.truncate()
+                failed.append(utt)
+                continue
+            if n_rows == 0:
+                # select-voiced-frames also drops utterances without voiced frames.
+                print('MFCC: Skipping {}: no voiced frames.'.format(utt))
+                unvoiced.append(utt)
+                continue
+            scp.write('{} {}:{}\n'.format(utt, abspath(args['ark']), offset))
+            frames.write('{} {}\n'.format(utt, n_rows))
+            utterance_seconds.append(time.time() - utt_start)
+
+    return {'seconds': time.time() - job_start, 'stages': timings, 'utterances': len(lines),
+            'audio_seconds': audio_seconds, 'bytes_written': getsize(args['ark']),
+            'utterance_seconds': np.array(utterance_seconds), 'failed': failed, 'unvoiced': unvoiced}
+
+
+def extract_voiced_features(samples, front_end, threshold=5.5, mean_scale=0.5, cmvn_window=300, var_norm=False,
+                            chunk_frames=None, timings=None):
+    # Generator: yields the number of voiced frames first, then the voiced, normalized feature rows in order.
+    n_frames = front_end.num_frames(len(samples))
+    start = time.time()
+    if chunk_frames is None:
+        feats = front_end.compute(samples, 0, n_frames)
+        start = add_time(timings, 'mfcc', start)
+        voiced = compute_vad(feats[:, 0], threshold, mean_scale)
+        add_time(timings, 'vad', start)
+        yield int(np.sum(voiced))
+        start = time.time()
+        feats = apply_sliding_cmvn(feats, cmvn_window, var_norm)[voiced]
+        add_time(timings, 'cmvn', start)
+        yield feats
+        return
+
+    voiced = compute_vad(front_end.log_energy(samples, n_frames), threshold, mean_scale)
+    add_time(timings, 'vad', start)
+    yield int(np.sum(voiced))
+
+    # Stream frames in chunks; keep only the rows and prefix sums the sliding CMVN window still needs.
+    chunk_frames = max(1, int(np.ceil(chunk_frames / float(FRAME_BLOCK)))) * FRAME_BLOCK
+    buffer = np.zeros([0, front_end.n_ceps], dtype=np.float32)
+    cum_sum, cum_sq_sum = None, None
+    buffer_start = 0
+    next_frame = 0
+    for chunk_start in range(0, n_frames, chunk_frames):
+        start = time.time()
+        chunk = front_end.compute(samples, chunk_start, min(chunk_frames, n_frames - chunk_start))
+        start = add_time(timings, 'mfcc', start)
+        cum_sum, cum_sq_sum = sliding_cmvn_sums(chunk, (cum_sum, cum_sq_sum), var_norm)
+        buffer = np.vstack([buffer, chunk])
+        available = chunk_start + chunk.shape[0]
+
+        t = np.arange(next_frame, available)
+        _, window_end = sliding_cmvn_window(t, n_frames, cmvn_window)
+        ready = t[window_end <= available]
+        if len(ready) > 0:
+            last = ready[-1] + 1
+            rows = sliding_cmvn_rows(buffer, cum_sum, cum_sq_sum, buffer_start, next_frame, last, n_frames,
+                                     cmvn_window, var_norm)[voiced[next_frame:last]]
+            add_time(timings, 'cmvn', start)
+            yield rows
+            next_frame = last
+
+        keep_from = min(sliding_cmvn_window(np.array([next_frame]), n_frames, cmvn_window)[0][0], next_frame) \
+            if next_frame < n_frames else available
+        drop = keep_from - buffer_start
+        if drop > 0:
+            buffer = buffer[drop:]
+            cum_sum = cum_sum[drop:]
+            cum_sq_sum = cum_sq_sum[drop:] if var_norm else None
+            buffer_start = keep_from
+
+
 def generate_data_scp(save_loc, args_list, append=False):
     data_scp_file = join_path(save_loc, DATA_SCP_FILE)
     with open(data_scp_file, 'a' if append else 'w') as f:
@@ -126,6 +447,19 @@ def get_frame(file_loc):
     return load_array(file_loc).shape[1]
 
 
+def get_job_seconds(log_file_format, n_jobs):
+    # run.pl, queue.pl and local_run.py all end a job log with "# Accounting: time=<seconds> threads=<n>".
+    job_seconds = []
+    for i in range(n_jobs):
+        try:
+            with open(log_file_format.format(i + 1)) as f:
+                match = re.findall(r'# Accounting: time=(\d+)', f.read())
+            job_seconds.append(int(match[-1]) if len(match) > 0 else None)
+        except IOError:
+            job_seconds.append(None)
+    return job_seconds
+
+
 def get_mfcc_frames(save_loc, args):
     utt2num_frames = join_path(save_loc, UTT2NUM_FRAMES_FILE)
     utt2num_frames_dict = spaced_file_to_dict(utt2num_frames)
@@ -141,10 +475,66 @@ def get_mfcc_frames(save_loc, args):
     return np.array(frames).reshape([-1, 1])
 
 
+def get_queue_cmd(n_jobs, local=False):
+    if local:
+        return 'python {} --max-jobs-run {}'.format(abspath(KALDI_LOCAL_RUN_FILE), n_jobs)
+    return 'perl {}'.format(abspath(KALDI_QUEUE_FILE))
+
+
 def load_feature(file_name):
     return load_array(file_name)
 
 
+def make_throughput_report(split, wall_seconds, stage_seconds, n_utterances, audio_seconds, bytes_written,
+                           job_seconds, utterance_seconds=None):
+    wall_seconds = max(wall_seconds, 1e-6)
+    total_stage_seconds = max(sum(stage_seconds.values()), 1e-6)
+    report = {
+        'split': split,
+        'wall_seconds': wall_seconds,
+        'utterances': n_utterances,
+        'audio_seconds': audio_seconds,
+        'bytes_written': bytes_written,
+        'utterances_per_second': n_utterances / wall_seconds,
+        'audio_seconds_per_second': audio_seconds / wall_seconds,
+        'stages': dict([(stage, {'seconds': seconds, 'fraction': seconds / total_stage_seconds})
+                        for stage, seconds in stage_seconds.items()]),
+        'jobs': dict()
+    }
+    for stage, seconds in job_seconds.items():
+        known = [(s, i + 1) for i, s in enumerate(seconds) if s is not None]
+        report['jobs'][stage] = {'seconds': seconds}
+        if len(known) > 0:
+            report['jobs'][stage].update(summarize_seconds([s for s, _ in known]))
+            report['jobs'][stage]['straggler'] = max(known)[1]
+    if utterance_seconds is not None and len(utterance_seconds) > 0:
+        report['utterance_seconds'] = summarize_seconds(utterance_seconds)
+    return report
+
+
+def mel_scale(freq):
+    return 1127.0 * np.log(1.0 + np.asarray(freq, dtype=np.float64) / 700.0)
+
+
+def print_throughput_report(report):
+    print('MFCC: {} utterances, {:.1f}h of audio in {:.1f}s ({:.1f} utt/s, {:.1f}x real time), {:.1f} MB written'
+          .format(report['utterances'], report['audio_seconds'] / 3600, report['wall_seconds'],
+                  report['utterances_per_second'], report['audio_seconds_per_second'],
+                  report['bytes_written'] / 1e6))
+    for stage, stats in sorted(report['stages'].items(), key=lambda x: -x[1]['seconds']):
+        print('MFCC:   {:<18} {:>10.1f}s {:>6.1%}'.format(stage, stats['seconds'], stats['fraction']))
+    for stage, stats in report['jobs'].items():
+        if 'straggler' in stats:
+            print('MFCC:   {} jobs: p50 {:.1f}s, p95 {:.1f}s, slowest job {} ({:.1f}s)'
+                  .format(stage, stats['p50'], stats['p95'], stats['straggler'], stats['max']))
+    if len(report.get('failed', [])) + len(report.get('unvoiced', [])) > 0:
+        print('MFCC:   skipped {} utterances that failed to decode and {} without voiced frames'
+              .format(len(report.get('failed', [])), len(report.get('unvoiced', []))))
+    if 'utterance_seconds' in report:
+        print('MFCC:   per utterance: p50 {:.3f}s, p95 {:.3f}s'
+              .format(report['utterance_seconds']['p50'], report['utterance_seconds']['p95']))
+
+
 def remove_bad_files(args_list, save_loc='../save'):
     feats_scp = join_path(save_loc, FEATS_SCP_FILE)
     feats_scp_dict = spaced_file_to_dict(feats_scp)
@@ -175,3 +565,49 @@ def remove_present_from_scp(save_loc, n_jobs=10):
     with open(data_scp_file, 'w') as f:
         f.writelines(scp_list)
     return sum(absent)
+
+
+def sliding_cmvn_rows(feats, cum_sum, cum_sq_sum, offset, start, end, n_frames, window, var_norm=False):
+    # cum_sum[i] holds the sum of all feature rows before frame offset + i; feats[0] is frame offset.
+    t = np.arange(start, end)
+    window_start, window_end = sliding_cmvn_window(t, n_frames, window)
+    count = (window_end - window_start).reshape([-1, 1]).astype(np.float64)
+    mean = (cum_sum[window_end - offset] - cum_sum[window_start - offset]) / count
+    rows = feats[start - offset:end - offset].astype(np.float64) - mean
+    if var_norm:
+        variance = (cum_sq_sum[window_end - offset] - cum_sq_sum[window_start - offset]) / count - mean ** 2
+        rows = rows / np.sqrt(np.maximum(variance, 1e-20))
+    return rows.astype(np.float32)
+
+
+def sliding_cmvn_sums(feats, previous=None, var_norm=False):
+    feats = feats.astype(np.float64)
+    if previous is None or previous[0] is None:
+        last_sum = np.zeros([1, feats.shape[1]])
+        last_sq_sum = np.zeros([1, feats.shape[1]])
+        cum_sum = np.cumsum(np.vstack([last_sum, feats]), axis=0)
+        cum_sq_sum = np.cumsum(np.vstack([last_sq_sum, feats ** 2]), axis=0) if var_norm else None
+        return cum_sum, cum_sq_sum
+
+    cum_sum = np.vstack([previous[0], np.cumsum(np.vstack([previous[0][-1:], feats]), axis=0)[1:]])
+    cum_sq_sum = None
+    if var_norm:
+        cum_sq_sum = np.vstack([previous[1], np.cumsum(np.vstack([previous[1][-1:], feats ** 2]), axis=0)[1:]])
+    return cum_sum, cum_sq_sum
+
+
+def sliding_cmvn_window(t, n_frames, window):
+    # Same window placement as Kaldi's apply-cmvn-sliding --center=true.
+    window_start = t - window // 2
+    window_end = window_start + window
+    shift = np.minimum(window_start, 0)
+    window_start, window_end = window_start - shift, window_end - shift
+    overflow = np.maximum(window_end - n_frames, 0)
+    window_start, window_end = np.maximum(window_start - overflow, 0), window_end - overflow
+    return window_start, window_end
+
+
+def summarize_seconds(seconds):
+    seconds = np.array(seconds, dtype=float)
+    return {'mean': float(np.mean(seconds)), 'p50': float(np.percentile(seconds, 50)),
+            'p95': float(np.percentile(seconds, 95)), 'max': float(np.max(seconds))}
@@ -0,0 +1,135 @@
+from fnmatch import fnmatch
+from multiprocessing.pool import ThreadPool
+from os.path import abspath, exists, splitext
+
+import os
+import pickle
+
+from constants.app_constants import NUM_CPU_WORKERS
+
+
+class FileIndex:
+    def __init__(self, cache_file=None, n_workers=NUM_CPU_WORKERS):
+        self.cache_file = None
+        self.n_workers = n_workers
+        self.roots = dict()
+        if cache_file is not None:
+            self.set_cache_file(cache_file)
+
+    def get_extensions(self, location):
+        return list(self.get_root_index(location)[1]['files'].keys())
+
+    def get_files(self, location, ext='.sph'):
+        location, root_index = self.get_root_index(location)
+        files = root_index['files'].get(ext, [])
+        if location is None:
+            return files
+        prefix = location.rstrip(os.sep) + os.sep
+        return [(name, path) for name, path in files if path.startswith(prefix)]
+
+    def get_root_index(self, location):
+        # A location inside an indexed root is served from that root's index; the root is re-validated once.
+        location = abspath(location)
+        root = location
+        for indexed_root in self.roots.keys():
+            if location.startswith(indexed_root.rstrip(os.sep) + os.sep):
+                root = indexed_root
+                break
+        if not self.roots.get(root, dict()).get('checked', False):
+            self.index([root])
+        return None if root == location else location, self.roots[root]
+
+    def index(self, locations):
+        locations = sorted(set([abspath(location) for location in locations]))
+        pool = ThreadPool(max(1, min(self.n_workers, len(locations))))
+        indices = pool.map(refresh_root, [(location, self.roots.get(location)) for location in locations])
+        pool.close()
+        n_scanned = 0
+        for location, (root_index, scanned) in zip(locations, indices):
+            root_index['checked'] = True
+            self.roots[location] = root_index
+            n_scanned += 1 if scanned else 0
+        if n_scanned > 0:
+            self.save()
+        return n_scanned
+
+    def save(self):
+        if self.cache_file is None:
+            return
+        roots = dict([(root, {'dirs': index['dirs'], 'files': index['files']}) for root, index in self.roots.items()])
+        tmp_file = '{}.{}.tmp'.format(self.cache_file, os.getpid())
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(roots, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.cache_file)
+
+    def set_cache_file(self, cache_file):
+        self.cache_file = abspath(cache_file)
+        if exists(self.cache_file):
+            with open(self.cache_file, 'rb') as f:
+                self.roots = pickle.load(f)
+
+
+FILE_INDEX = FileIndex()
+
+
+def index_locations(locations, cache_file=None):
+    if cache_file is not None:
+        FILE_INDEX.set_cache_file(cache_file)
+    locations = [location for location in locations if exists(location)]
+    n_scanned = FILE_INDEX.index(locations)
+    print('Indexed {} corpus roots, {} re-scanned.'.format(len(locations), n_scanned))
+
+
+def is_stale(root_index):
+    # Adding, removing or renaming a file changes the mtime of its directory.
+    for path, mtime in root_index['dirs'].items():
+        try:
+            if os.stat(path).st_mtime != mtime:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def list_files(location, pattern='*.sph'):
+    # Only '*.<ext>' patterns are served from the extension buckets; anything else is a plain fnmatch over them.
+    if pattern.startswith('*.') and not any(c in pattern[2:] for c in '*?['):
+        return FILE_INDEX.get_files(location, pattern[1:])
+    files = []
+    for ext in FILE_INDEX.get_extensions(location):
+        files += [(name, path) for name, path in FILE_INDEX.get_files(location, ext) if fnmatch(name, pattern)]
+    return files
+
+
+def refresh_root(args):
+    location, root_index = args
+    if root_index is not None and not is_stale(root_index):
+        return root_index, False
+    return scan_root(location), True
+
+
+def scan_root(location):
+    dirs = dict()
+    files = dict()
+    stack = [location]
+    while len(stack) > 0:
+        path = stack.pop()
+        try:
+            dirs[path] = os.stat(path).st_mtime
+            entries = os.scandir(path)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                # Like os.walk, do not descend into symlinked directories, so link loops cannot recurse forever.
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    ext = splitext(entry.name)[1]
+                    try:
+                        files[ext].append((entry.name, entry.path))
+                    except KeyError:
+                        files[ext] = [(entry.name, entry.path)]
+    for ext in files.keys():
+        files[ext].sort()
+    return {'dirs': dirs, 'files': files}
@@ -0,0 +1,229 @@
+from os.path import exists, join as join_path
+
+import numpy as np
+
+from services.common import load_json_file, make_directory, save_json_file
+
+
+class SpeakerIndex:
+    def __init__(self, dim, dtype=np.float32, terms='cosine'):
+        # Enrolled speakers searched by the dot product of their vectors with the queries: unit vectors give cosine
+        # scores (terms='cosine'), PLDA enroll and test terms give PLDA scores (terms='plda'). Rows are kept packed
+        # so add and remove cost O(dim).
+        self.dim = dim
+        self.dtype = dtype
+        self.terms = terms
+        self.weights = None
+        self.size = 0
+        self.keys = []
+        self.rows = dict()
+        self.vectors = np.zeros((0, dim), dtype=dtype)
+        self.centroids = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.lists = None
+
+    def add(self, keys, vectors):
+        # A key that is already enrolled has its vector replaced.
+        vectors = np.asarray(vectors, dtype=self.dtype).reshape(-1, self.dim)
+        new_keys = [key for key in dict.fromkeys(keys) if key not in self.rows]
+        if self.size + len(new_keys) > self.vectors.shape[0]:
+            self.reserve(max(2 * self.vectors.shape[0], self.size + len(new_keys)))
+        for key in new_keys:
+            self.rows[key] = self.size
+            self.keys.append(key)
+            self.size += 1
+        rows = np.array([self.rows[key] for key in keys], dtype=np.int64)
+        self.vectors[rows] = vectors
+        if self.centroids is not None:
+            self.assignments[rows] = self.assign(vectors)
+        self.lists = None
+        return self
+
+    def assign(self, vectors, block_size=65536):
+        assignments = np.zeros(vectors.shape[0], dtype=np.int32)
+        for start in range(0, vectors.shape[0], block_size):
+            block = self.coarse_rows(vectors[start:start + block_size]).astype(self.dtype)
+            assignments[start:start + block_size] = nearest_rows(block, self.centroids, 1)[:, 0]
+        return assignments
+
+    def coarse_rows(self, vectors, queries=False):
+        # Points of the coarse quantiser space, where Euclidean distance follows the score ranking. Unit vectors are
+        # used as they are. A PLDA enroll row is [c, -0.5 * q, l] with q >= 0, so its score of a test x is
+        # constant - 0.5 * sum(q * (x - l / q) ** 2): speakers are placed at l / q and queries at x (the last test
+        # terms), both scaled by the mean q of the enrolled speakers. Candidates found this way are still scored
+        # with the full terms.
+        vectors = np.asarray(vectors, dtype=np.float64)
+        if self.terms != 'plda':
+            return unit_rows(vectors)
+        d = (self.dim - 1) // 2
+        if queries:
+            return vectors[:, 1 + d:] * np.sqrt(self.weights)
+        curvature = -2.0 * vectors[:, 1:1 + d]
+        centres = vectors[:, 1 + d:] / np.maximum(curvature, np.finfo(np.float32).tiny)
+        return np.where(curvature > np.finfo(np.float32).eps, centres, 0.0) * np.sqrt(self.weights)
+
+    def get_lists(self):
+        # Rows grouped by coarse cell, rebuilt lazily after the index changes.
+        if self.lists is None:
+            order = np.argsort(self.assignments[:self.size], kind='stable')
+            starts = np.searchsorted(self.assignments[:self.size][order], np.arange(self.centroids.shape[0] + 1))
+            self.lists = order, starts
+        return self.lists
+
+    def measure_recall(self, queries, top_k=10, n_probe=8):
+        # Fraction of the exact top-k speakers that the approximate search also returns.
+        exact = self.search_rows(queries, top_k)[0]
+        approximate = self.search_rows(queries, top_k, n_probe)[0]
+        hits = [len(np.intersect1d(e[e >= 0], a[a >= 0])) for e, a in zip(exact, approximate)]
+        return float(np.sum(hits)) / max(np.sum(exact >= 0), 1)
+
+    def remove(self, keys):
+        # The last row moves into the freed slot.
+        for key in keys:
+            row = self.rows.pop(key)
+            last = self.size - 1
+            if row != last:
+                self.keys[row] = self.keys[last]
+                self.rows[self.keys[row]] = row
+                self.vectors[row] = self.vectors[last]
+                self.assignments[row] = self.assignments[last]
+            self.keys.pop()
+            self.size -= 1
+        self.lists = None
+        return self
+
+    def reserve(self, capacity):
+        vectors = np.zeros((capacity, self.dim), dtype=self.dtype)
+        vectors[:self.size] = self.vectors[:self.size]
+        assignments = np.zeros(capacity, dtype=np.int32)
+        assignments[:self.size] = self.assignments[:self.size]
+        self.vectors, self.assignments = vectors, assignments
+
+    def save(self, location, source=None):
+        make_directory(location)
+        np.save(join_path(location, 'keys.npy'), np.asarray(self.keys, dtype=str))
+        np.save(join_path(location, 'vectors.npy'), self.vectors[:self.size])
+        if self.centroids is not None:
+            np.save(join_path(location, 'centroids.npy'), self.centroids)
+            np.save(join_path(location, 'assignments.npy'), self.assignments[:self.size])
+        if self.weights is not None:
+            np.save(join_path(location, 'weights.npy'), self.weights)
+        # source describes what the index was built from, so callers can tell when it is stale.
+        save_json_file(join_path(location, 'meta.json'), {'dim': self.dim, 'dtype': np.dtype(self.dtype).name,
+                                                          'size': self.size, 'ivf': self.centroids is not None,
+                                                          'terms': self.terms, 'source': source})
+        return location
+
+    def search(self, queries, top_k=10, n_probe=None, block_size=1024):
+        # Top-k speaker keys and scores per query, best first. Without n_probe every speaker is scored; with it only
+        # the speakers in the n_probe closest coarse cells are. Missing results have the key '' and score -inf.
+        rows, scores = self.search_rows(queries, top_k, n_probe, block_size)
+        keys = np.append(np.asarray(self.keys, dtype=str), '')
+        return keys[rows], scores
+
+    def search_rows(self, queries, top_k=10, n_probe=None, block_size=1024):
+        queries = np.asarray(queries, dtype=self.dtype).reshape(-1, self.dim)
+        rows = np.full((queries.shape[0], top_k), -1, dtype=np.int64)
+        scores = np.full((queries.shape[0], top_k), -np.inf)
+        vectors = self.vectors[:self.size]
+        for start in range(0, queries.shape[0], block_size):
+            block = queries[start:start + block_size]
+            if n_probe is None or self.centroids is None:
+                block_rows, block_scores = top_k_rows(block.dot(vectors.T), top_k)
+            else:
+                block_rows, block_scores = self.search_lists(block, top_k, n_probe)
+            rows[start:start + block_size, :block_rows.shape[1]] = block_rows
+            scores[start:start + block_size, :block_rows.shape[1]] = block_scores
+        return rows, scores
+
+    def search_lists(self, queries, top_k, n_probe):
+        # Every probed cell is scored against all the queries that probe it in one product; the per-cell top-k
+        # candidates of each query are merged at the end.
+        order, starts = self.get_lists()
+        n_probe = min(n_probe, self.centroids.shape[0])
+        probes = nearest_rows(self.coarse_rows(queries, queries=True), self.centroids, n_probe)
+        candidate_rows = np.full((queries.shape[0], n_probe * top_k), -1, dtype=np.int64)
+        candidate_scores = np.full((queries.shape[0], n_probe * top_k), -np.inf)
+        for cell in np.unique(probes):
+            members = order[starts[cell]:starts[cell + 1]]
+            if len(members) == 0:
+                continue
+            query_idx, slot = np.nonzero(probes == cell)
+            cell_rows, cell_scores = top_k_rows(queries[query_idx].dot(self.vectors[members].T), top_k)
+            columns = slot[:, None] * top_k + np.arange(cell_rows.shape[1])
+            candidate_rows[query_idx[:, None], columns] = members[cell_rows]
+            candidate_scores[query_idx[:, None], columns] = cell_scores
+        best, scores = top_k_rows(candidate_scores, top_k)
+        return np.take_along_axis(candidate_rows, best, axis=1), scores
+
+    def train(self, n_lists=None, n_iters=10, sample_size=None, seed=0):
+        # k-means coarse quantiser for the approximate search, trained on (a sample of) the enrolled speakers in
+        # the space of coarse_rows. Speakers added later are assigned to the nearest cell without retraining.
+        n_lists = n_lists or max(1, int(4 * np.sqrt(self.size)))
+        rng = np.random.RandomState(seed)
+        sample_size = min(self.size, sample_size or 64 * n_lists)
+        sample = self.vectors[rng.choice(self.size, sample_size, replace=False)]
+        if self.terms == 'plda':
+            d = (self.dim - 1) // 2
+            self.weights = np.maximum(-2.0 * sample[:, 1:1 + d].astype(np.float64).mean(axis=0), 0.0)
+        sample = self.coarse_rows(sample).astype(self.dtype)
+        centroids = sample[rng.choice(sample_size, min(n_lists, sample_size), replace=False)]
+        for _ in range(n_iters):
+            assignments = nearest_rows(sample, centroids, 1)[:, 0]
+            counts = np.bincount(assignments, minlength=len(centroids))
+            order = np.argsort(assignments, kind='stable')
+            cells, starts = np.unique(assignments[order], return_index=True)
+            sums = np.zeros(centroids.shape)
+            sums[cells] = np.add.reduceat(sample[order], starts, axis=0)
+            empty = counts == 0
+            # Empty cells restart from random sample vectors.
+            sums[empty] = sample[rng.choice(sample_size, np.sum(empty))]
+            centroids = sums / np.maximum(counts, 1)[:, None]
+        self.centroids = centroids.astype(self.dtype)
+        self.assignments[:self.size] = self.assign(self.vectors[:self.size])
+        self.lists = None
+        return self
+
+
+def load_speaker_index(location):
+    meta = load_json_file(join_path(location, 'meta.json'))
+    index = SpeakerIndex(meta['dim'], np.dtype(meta['dtype']), meta.get('terms', 'cosine'))
+    index.add(np.load(join_path(location, 'keys.npy')).tolist(), np.load(join_path(location, 'vectors.npy')))
+    if meta['ivf'] and exists(join_path(location, 'centroids.npy')):
+        if exists(join_path(location, 'weights.npy')):
+            index.weights = np.load(join_path(location, 'weights.npy'))
+        index.centroids = np.load(join_path(location, 'centroids.npy'))
+        index.assignments[:index.size] = np.load(join_path(location, 'assignments.npy'))
+    return index
+
+
+def get_index_source(location):
+    meta_file = join_path(location, 'meta.json')
+    return load_json_file(meta_file).get('source') if exists(meta_file) else None
+
+
+def nearest_rows(points, centroids, n_nearest, block_size=65536):
+    # Columns of the n_nearest centroids of each point by Euclidean distance, nearest first.
+    rows = np.zeros((points.shape[0], min(n_nearest, centroids.shape[0])), dtype=np.int64)
+    centroids = np.asarray(centroids, dtype=points.dtype)
+    half_norms = 0.5 * np.sum(centroids ** 2, axis=1)
+    for start in range(0, points.shape[0], block_size):
+        rows[start:start + block_size] = top_k_rows(points[start:start + block_size].dot(centroids.T) - half_norms,
+                                                    n_nearest)[0]
+    return rows
+
+
+def top_k_rows(scores, top_k):
+    # Columns of the k highest scores of each row, best first, from a partial selection instead of a full sort.
+    top_k = min(top_k, scores.shape[1])
+    if top_k == 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64), np.zeros((scores.shape[0], 0))
+    columns = np.argpartition(scores, scores.shape[1] - top_k, axis=1)[:, scores.shape[1] - top_k:]
+    top_scores = np.take_along_axis(scores, columns, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(columns, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def unit_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, np.finfo(np.float32).tiny)
@@ -1,15 +1,28 @@
-from collections import Counter
+from hashlib import md5
 from random import shuffle
 from subprocess import Popen, PIPE
-from os.path import abspath, join as join_path
+from os.path import abspath, exists, getmtime, getsize, join as join_path
 
 import numpy as np
 import re
+import struct
 
 from constants.app_constants import KALDI_QUEUE_FILE, KALDI_PATH_FILE, DATA_DIR, EMB_DIR, LOGS_DIR, PLDA_DIR, \
     EMB_SCP_FILE, SPK_UTT_FILE, UTT_SPK_FILE, TRAIN_SPLIT, ENROLL_SPLIT, TEST_SPLIT, NUM_UTT_FILE, SCORES_FILE, \
-    TRIALS_FILE, UNLABELLED_SPLIT, EER_INPUT_FILE, EGS_DIR
-from services.common import run_parallel, load_array, run_command, make_directory, sort_by_index
+    TRIALS_FILE, UNLABELLED_SPLIT, METRICS_FILE, EGS_DIR, COHORT_STATS_DIR, PREPROCESSED_DIR, \
+    SCORE_NORM_TOP_K, INDEX_DIR, IDENTIFICATION_FILE, ENROLLMENT_DIR, EMB_STORE_DIR
+from services.common import run_parallel, join_keys, load_array, load_json_file, load_key_file, run_command, \
+    make_directory, save_json_file, sort_by_index
+from services.cosine import combine_sessions, enroll_sessions, score_cosine_trials, unit_normalize
+from services.embedding_store import EmbeddingStore, is_store_current
+from services.enrollment import EnrollmentStore, load_enrollment_store
+from services.identification import SpeakerIndex, get_index_source, load_speaker_index
+from services.metrics import compute_metrics, print_metrics
+from services.plda import PldaAdaptor, PldaModel, apply_transform, class_statistics, compute_lda, fit_plda, \
+    length_normalize, preprocess_vectors, score_trials
+from services.score_norm import ScoreNormalizer
+from services.scoring_server import ScoringBackend
+from services.trials import get_trial_list
 
 
 class Kaldi:
@@ -33,9 +46,15 @@ class Kaldi:
 
 
 class PLDA:
-    def __init__(self, model_tag, total_covariance_factor=0.0, save_loc='../save'):
+    def __init__(self, model_tag, total_covariance_factor=0.0, backend='kaldi', cosine_lda=True,
+                 cosine_enroll_mode='mean', save_loc='../save'):
+        # backend is 'kaldi', 'numpy' or 'cosine'; the cosine backend trains the same mean and LDA in-process and
+        # scores length-normalised (optionally LDA-projected) embeddings by cosine similarity.
         self.model_tag = model_tag
         self.tcf = total_covariance_factor
+        self.backend = backend
+        self.cosine_lda = cosine_lda
+        self.cosine_enroll_mode = cosine_enroll_mode
         self.save_loc = save_loc
         self.data_loc = join_path(save_loc, DATA_DIR)
         self.logs_loc = join_path(save_loc, LOGS_DIR)
@@ -45,19 +64,61 @@ class PLDA:
         self.centering_mean = '{}/mean_{}.vec'.format(self.plda_loc, self.model_tag)
         self.transform_matrix = '{}/transform_{}.mat'.format(self.plda_loc, model_tag)
         self.plda_model = '{}/plda_{}'.format(self.plda_loc, model_tag)
+        self.adapted_plda_model = '{}/plda_adapt_{}'.format(self.plda_loc, model_tag)
+        self.adaptors = dict()
         self.scores_file = '{}/{}_{}'.format(self.plda_loc, model_tag, SCORES_FILE)
-        self.eer_file = '{}/{}_{}'.format(self.plda_loc, model_tag, EER_INPUT_FILE)
+        self.metrics_file = '{}/{}_{}'.format(self.plda_loc, model_tag, METRICS_FILE)
         self.trials_file = join_path(save_loc, TRIALS_FILE)
+        self.vectors_loc = join_path(self.plda_loc, '{}_{}'.format(model_tag, PREPROCESSED_DIR))
+        self.index_loc = join_path(self.plda_loc, '{}_{}_{}'.format(
+            model_tag, 'cosine' if backend == 'cosine' else 'plda', INDEX_DIR))
+        self.identification_file = '{}/{}_{}'.format(self.plda_loc, model_tag, IDENTIFICATION_FILE)
+
+    def adapt(self, adapt_split=UNLABELLED_SPLIT, within_covar_scale=0.75, between_covar_scale=0.25):
+        # In-process ivector-adapt-plda. The in-domain statistics are gathered once per split, so repeated calls
+        # with other scales only redo the small eigen-decompositions.
+        try:
+            adaptor = self.adaptors[adapt_split]
+        except KeyError:
+            adapt_embedding_scp = join_path(self.save_loc,
+                                            get_embedding_scp(EMB_SCP_FILE, self.model_tag, adapt_split))
+            adaptor = get_plda_adaptor(self.transform_matrix, adapt_embedding_scp)
+            self.adaptors[adapt_split] = adaptor
+        print('PLDA: Adapting PLDA model...')
+        model = adaptor.adapt(read_kaldi_plda(self.plda_model), within_covar_scale, between_covar_scale)
+        write_kaldi_plda(self.adapted_plda_model, model)
+        return model
+
+    def build_index(self, enroll_index_list, enroll_speaker_list, enroll_split=ENROLL_SPLIT, approximate=False,
+                    n_lists=None, adapted=False):
+        # 1:N identification index over the speaker models the backend scores trials with. Speakers can be added
+        # to or removed from the saved index later without rebuilding it. With approximate=True an IVF quantiser
+        # is trained as well; check its recall with identify(n_probe=...) before relying on it.
+        speaker_ids, enroll_terms = self.get_scoring_terms(enroll_split, enroll_index_list, enroll_speaker_list,
+                                                           adapted)
+        print('PLDA: Indexing {} enrolled speakers...'.format(len(speaker_ids)))
+        index = SpeakerIndex(enroll_terms.shape[1], terms='cosine' if self.backend == 'cosine' else 'plda')
+        index.add(speaker_ids.tolist(), enroll_terms)
+        if approximate:
+            index.train(n_lists)
+        index.save(self.index_loc, self.get_index_source(enroll_index_list, enroll_speaker_list, enroll_split, adapted))
+        return index
 
     def fit(self, index_list, speaker_list, lda_dim=150, split=TRAIN_SPLIT, centering_split=UNLABELLED_SPLIT):
+        self.adaptors = dict()
         spk_utt_file = join_path(self.save_loc, '{}_{}'.format(SPK_UTT_FILE, split))
         utt_spk_file = join_path(self.save_loc, '{}_{}'.format(UTT_SPK_FILE, split))
-        make_spk_to_utt(index_list, speaker_list, spk_utt_file)
-        make_utt_to_spk(index_list, speaker_list, utt_spk_file)
+        write_speaker_files(index_list, speaker_list, spk_utt_file, utt_spk_file)
 
         embedding_scp = join_path(self.save_loc, get_embedding_scp(EMB_SCP_FILE, self.model_tag, split))
         centering_embedding_scp = join_path(self.save_loc, get_embedding_scp(EMB_SCP_FILE, self.model_tag, centering_split))
 
+        if self.backend in ['numpy', 'cosine']:
+            make_directory(self.plda_loc)
+            train_plda(embedding_scp, centering_embedding_scp, index_list, speaker_list, self.centering_mean,
+                       self.transform_matrix, self.plda_model, lda_dim, self.tcf)
+            return
+
         print("PLDA: Computing mean...")  # SRE MAJOR
         Kaldi().queue('{}/compute_mean.log ivector-mean scp:{} {} || exit 1;'
                       .format(self.logs_loc, centering_embedding_scp, self.centering_mean), print_error=True)
@@ -72,17 +133,109 @@ class PLDA:
                       'transform-vec {} ark:- ark:- | ivector-normalize-length ark:- ark:- |" {} || exit 1;'
                       .format(self.logs_loc, spk_utt_file, embedding_scp, self.transform_matrix, self.plda_model), print_error=True)
 
-    def score(self, enroll_index_list, enroll_speaker_list, enroll_split=ENROLL_SPLIT, test_split=TEST_SPLIT):
+    def get_index_source(self, enroll_index_list, enroll_speaker_list, enroll_split=ENROLL_SPLIT, adapted=False):
+        # The model files, the enrollment embeddings and sessions an index is built from; a saved index whose
+        # source differs holds terms the backend would no longer produce.
+        embedding_scp = join_path(self.save_loc, get_embedding_scp(EMB_SCP_FILE, self.model_tag, enroll_split))
+        plda_file = None if self.backend == 'cosine' else self.adapted_plda_model if adapted else self.plda_model
+        transform_file = self.transform_matrix if self.backend != 'cosine' or self.cosine_lda else None
+        sessions = '\n'.join(np.char.add(np.char.add(np.asarray(enroll_index_list).astype(str), ' '),
+                                          np.asarray(enroll_speaker_list).astype(str)).tolist())
+        return dict(get_file_signature(plda=plda_file, mean=self.centering_mean, transform=transform_file,
+                                       embeddings=embedding_scp), backend=self.backend, adapted=adapted,
+                    enroll_mode=self.cosine_enroll_mode if self.backend == 'cosine' else None,
+                    enroll_split=enroll_split, sessions=md5(sessions.encode('utf-8')).hexdigest())
+
+    def get_scoring_backend(self, adapted=False, enroll_split=ENROLL_SPLIT):
+        # The mean, transform, model and index saved by fit and build_index, loaded once for the scoring server,
+        # with the enrollment store of enroll_split when there is one.
+        transform_file = self.transform_matrix if self.backend != 'cosine' or self.cosine_lda else None
+        model = None if self.backend == 'cosine' else \
+            read_kaldi_plda(self.adapted_plda_model if adapted else self.plda_model)
+        embedding_scp = join_path(self.save_loc, get_embedding_scp(EMB_SCP_FILE, self.model_tag, enroll_split))
+        if self.backend == 'cosine':
+            store = get_saved_enrollment_store(get_enrollment_loc(self.vectors_loc, embedding_scp, 'cosine'),
+                                               get_file_signature(mean=self.centering_mean, transform=transform_file))
+        else:
+            store = get_saved_enrollment_store(get_enrollment_loc(self.vectors_loc, embedding_scp))
+        return ScoringBackend(load_speaker_index(self.index_loc), read_kaldi_file(self.centering_mean),
+                              read_kaldi_file(transform_file) if transform_file is not None else None, model, store,
+                              self.cosine_enroll_mode)
+
+    def get_scoring_terms(self, split, index_list=None, speaker_list=None, adapted=False):
+        # Enroll-side terms per speaker with speaker lists, test-side terms per embedding without; the dot product
+        # of the two is the backend score.
+        embedding_scp = join_path(self.save_loc, get_embedding_scp(EMB_SCP_FILE, self.model_tag, split))
+        if self.backend == 'cosine':
+            return get_cosine_terms(self.centering_mean, self.transform_matrix if self.cosine_lda else None,
+                                    embedding_scp, index_list, speaker_list, self.cosine_enroll_mode, self.vectors_loc)
+        return get_plda_terms(self.adapted_plda_model if adapted else self.plda_model, self.centering_mean,
+                              self.transform_matrix, embedding_scp, index_list, speaker_list, self.vectors_loc)
+
+    def index_is_current(self, enroll_index_list, enroll_speaker_list, enroll_split=ENROLL_SPLIT, adapted=False):
+        try:
+            source = self.get_index_source(enroll_index_list, enroll_speaker_list, enroll_split, adapted)
+        except OSError:
+            return False
+        return exists(self.index_loc) and get_index_source(self.index_loc) == source
+
+    def identify(self, test_split=TEST_SPLIT, top_k=10, n_probe=None, recall_queries=1000, adapted=False):
+        # Top-k enrolled speakers of every test embedding from the index saved by build_index, written as
+        # 'speaker test score' lines, best first. With n_probe the approximate search is used and its recall
+        # against the exact search is measured on the first recall_queries tests.
+        index = load_speaker_index(self.index_loc)
+        test_keys, test_terms = self.get_scoring_terms(test_split, adapted=adapted)
+        print('PLDA: Searching {} speakers for {} test embeddings...'.format(index.size, len(test_keys)))
+        speakers, scores = index.search(test_terms, top_k, n_probe)
+        found = np.isfinite(scores)
+        write_scores_file(self.identification_file, speakers[found], np.repeat(test_keys, top_k)[found.ravel()],
+                          scores[found])
+        if n_probe is not None and recall_queries:
+            recall = index.measure_recall(test_terms[:recall_queries], top_k, n_probe)
+            print('PLDA: Recall@{} with {} probes: {:.2%}'.format(top_k, n_probe, recall))
+        return self.identification_file
+
+    def score(self, enroll_index_list, enroll_speaker_list, enroll_split=ENROLL_SPLIT, test_split=TEST_SPLIT,
+              cohort_split=None, top_k=SCORE_NORM_TOP_K, adapted=False):
+        plda_model = self.adapted_plda_model if adapted else self.plda_model
         num_utterances_file = join_path(self.save_loc, '{}_{}'.format(NUM_UTT_FILE, enroll_split))
         enroll_spk_utt_file = join_path(self.save_loc, '{}_{}'.format(SPK_UTT_FILE, enroll_split))
         enroll_utt_spk_file = join_path(self.save_loc, '{}_{}'.format(UTT_SPK_FILE, enroll_split))
-        write_num_utterance(enroll_speaker_list, num_utterances_file)
-        make_spk_to_utt(enroll_index_list, enroll_speaker_list, enroll_spk_utt_file)
-        make_utt_to_spk(enroll_index_list, enroll_speaker_list, enroll_utt_spk_file)
+        write_speaker_files(enroll_index_list, enroll_speaker_list, enroll_spk_utt_file, enroll_utt_spk_file,
+                            num_utterances_file)
 
         enroll_embedding_scp = join_path(self.save_loc, get_embedding_scp(EMB_SCP_FILE, self.model_tag, enroll_split))
         test_embedding_scp = join_path(self.save_loc, get_embedding_scp(EMB_SCP_FILE, self.model_tag, test_split))
 
+        cosine_transform = self.transform_matrix if self.cosine_lda else None
+        if self.backend == 'cosine':
+            score_cosine(self.centering_mean, cosine_transform, enroll_embedding_scp, enroll_index_list,
+                         enroll_speaker_list, test_embedding_scp, self.trials_file, self.scores_file,
+                         self.cosine_enroll_mode, self.vectors_loc)
+        elif self.backend == 'numpy':
+            score_plda(plda_model, self.centering_mean, self.transform_matrix, enroll_embedding_scp,
+                       enroll_index_list, enroll_speaker_list, test_embedding_scp, self.trials_file, self.scores_file,
+                       self.vectors_loc)
+        else:
+            self.score_with_kaldi(plda_model, num_utterances_file, enroll_spk_utt_file, enroll_embedding_scp,
+                                  test_embedding_scp)
+
+        if cohort_split is not None:
+            cohort_embedding_scp = join_path(self.save_loc,
+                                             get_embedding_scp(EMB_SCP_FILE, self.model_tag, cohort_split))
+            cache_loc = join_path(self.plda_loc, '{}_{}_{}_{}'.format(
+                self.model_tag, 'cosine' if self.backend == 'cosine' else 'plda', COHORT_STATS_DIR, cohort_split))
+            if self.backend == 'cosine':
+                normalize_cosine_scores(self.centering_mean, cosine_transform, enroll_embedding_scp, enroll_index_list,
+                                        enroll_speaker_list, test_embedding_scp, cohort_embedding_scp,
+                                        self.scores_file, self.cosine_enroll_mode, top_k, cache_loc, self.vectors_loc)
+            else:
+                normalize_plda_scores(plda_model, self.centering_mean, self.transform_matrix, enroll_embedding_scp,
+                                      enroll_index_list, enroll_speaker_list, test_embedding_scp,
+                                      cohort_embedding_scp, self.scores_file, top_k, cache_loc, self.vectors_loc)
+        return self.scores_file
+
+    def score_with_kaldi(self, plda_model, num_utterances_file, enroll_spk_utt_file, enroll_embedding_scp, test_embedding_scp):
         print('PLDA: Computing scores...')
         Kaldi().queue('{}/sre16_eval_scoring.log ivector-plda-scoring --normalize-length=true --num-utts=ark:{} '
                       '"ivector-copy-plda --smoothing=0.0 {} - |" "ark:ivector-mean ark:{} scp:{} ark:- | '
@@ -90,34 +243,25 @@ class PLDA:
                       'ivector-normalize-length ark:- ark:- |" "ark:ivector-subtract-global-mean {} scp:{} ark:- | '
                       'transform-vec {} ark:- ark:- | ivector-normalize-length ark:- ark:- |" '
                       '"cat {} | cut -d\  --fields=1,2 |" {} || exit 1;'
-                      .format(self.logs_loc, num_utterances_file, self.plda_model, enroll_spk_utt_file,
+                      .format(self.logs_loc, num_utterances_file, plda_model, enroll_spk_utt_file,
                               enroll_embedding_scp, self.centering_mean, self.transform_matrix,
                               self.centering_mean, test_embedding_scp, self.transform_matrix,
                               self.trials_file, self.scores_file), print_error=True)
-        return self.scores_file
-
-    def compute_eer(self, enroll_index_list, enroll_speaker_list, enroll_split=ENROLL_SPLIT, test_split=TEST_SPLIT):
-        self.score(enroll_index_list, enroll_speaker_list, enroll_split, test_split)
-        print('PLDA: Making score file...')
-        scores = []
-        with open(self.scores_file) as f:
-            for line in f.readlines():
-                score = re.split('[\s]+', line.strip())[2]
-                scores.append(score)
-
-        target_list = []
-        with open(self.trials_file) as f:
-            for line in f.readlines():
-                t = re.split('[\s]+', line.strip())[2]
-                target_list.append(t)
-
-        with open(self.eer_file, 'w') as f:
-            for s, t in zip(scores, target_list):
-                f.write('{} {}\n'.format(s, t))
 
+    def compute_eer(self, enroll_index_list, enroll_speaker_list, enroll_split=ENROLL_SPLIT, test_split=TEST_SPLIT,
+                    groups=None, cohort_split=None, top_k=SCORE_NORM_TOP_K, adapted=False):
+        # groups maps a breakdown name (language, source, gender, ...) to one label per line of the trials file.
+        self.score(enroll_index_list, enroll_speaker_list, enroll_split, test_split, cohort_split, top_k, adapted)
         print('PLDA: Computing EER...')
-        output = Kaldi().run_command('cat ' + self.eer_file + ' | compute-eer -')
-        return output
+        enroll_keys, test_keys, scores = load_key_file(self.scores_file, n_columns=3)
+        trial_list = get_trial_list(self.trials_file)
+        found, idx = get_trial_rows(trial_list, enroll_keys, test_keys)
+        idx = idx[found]
+        groups = dict([(name, np.asarray(labels)[idx]) for name, labels in (groups or dict()).items()])
+        metrics = compute_metrics(scores[found].astype(np.float64), trial_list.target[idx], groups)
+        print_metrics(metrics)
+        save_json_file(self.metrics_file, metrics)
+        return metrics
 
 
 def append_label_to_idx_scp(scp_file, index_list, label_list):
@@ -150,12 +294,16 @@ def append_vector(arr, utt_id, ark_file, offset=None):
 def convert_embeddings(index_list, model_tag, split=TRAIN_SPLIT, save_loc='../save', n_jobs=10):
     embedding_loc = join_path(save_loc, join_path(EMB_DIR, model_tag))
     embedding_scp = join_path(save_loc, get_embedding_scp(EMB_SCP_FILE, model_tag, split))
-
+    store_loc = join_path(embedding_loc, EMB_STORE_DIR)
     npy_list = []
     ark_list = []
     for key in index_list:
         npy_list.append(join_path(embedding_loc, '{}.npy'.format(key)))
         ark_list.append(join_path(embedding_loc, '{}.ark'.format(key)))
+    if is_store_current(store_loc, npy_list):
+        # One ark for the whole split from the embedding store instead of one per utterance.
+        return export_embedding_store(EmbeddingStore(store_loc), join_path(embedding_loc, '{}.ark'.format(split)),
+                                      embedding_scp, index_list)
 
     args_list = np.vstack([index_list, npy_list, ark_list]).T
 
@@ -166,22 +314,220 @@ def convert_embeddings(index_list, model_tag, split=TRAIN_SPLIT, save_loc='../sa
     return embedding_scp
 
 
+def export_embedding_store(store, ark_file, scp_file, keys=None, block_size=65536):
+    # A single binary ark with its scp, in the order of keys (default: every key of the store).
+    keys = store.keys if keys is None else np.asarray(keys).astype(str)
+    found, (idx,) = join_keys(keys, store.keys, np.arange(len(store)))
+    if not np.all(found):
+        print('Skipping {} keys missing from the embedding store.'.format(np.sum(~found)))
+    keys, idx = keys[found], idx[found]
+    ark_file = abspath(ark_file)
+    with open(ark_file, 'wb') as ark, open(scp_file, 'w') as scp:
+        for start in range(0, len(keys), block_size):
+            lines = []
+            for key, vector in zip(keys[start:start + block_size], store.read_rows(idx[start:start + block_size])):
+                lines.append('{} {}:{}\n'.format(key, ark_file, write_kaldi_vector(ark, key, vector)))
+            scp.write(''.join(lines))
+    return scp_file
+
+
+def get_cosine_terms(mean_file, transform_file, embedding_scp, index_list=None, speaker_list=None, enroll_mode='mean',
+                     vectors_loc=None):
+    # Unit vectors of an scp; with speaker lists the sessions are preprocessed one by one and then combined per
+    # speaker. transform_file=None skips the LDA.
+    if speaker_list is not None and vectors_loc is not None:
+        mean, transform = read_kaldi_file(mean_file), read_kaldi_file(transform_file) if transform_file else None
+        store = update_enrollment_store(
+            embedding_scp, index_list, speaker_list, get_enrollment_loc(vectors_loc, embedding_scp, 'cosine'),
+            lambda vectors: unit_normalize(preprocess_vectors(vectors, mean, transform)),
+            get_file_signature(mean=mean_file, transform=transform_file))
+        speaker_ids, _, means = store.get_statistics()
+        return speaker_ids, combine_sessions(means, enroll_mode)
+
+    keys, _, vectors = get_preprocessed_vectors(embedding_scp, mean_file, transform_file, vectors_loc)
+    if speaker_list is None:
+        return keys, unit_normalize(vectors)
+    speaker_ids, found, speaker_codes = get_speaker_codes(keys, index_list, speaker_list)
+    return speaker_ids, enroll_sessions(vectors[found], speaker_codes, enroll_mode)[1]
+
+
 def get_embedding_scp(embedding_scp, model_tag, split):
     return '{}_{}_{}'.format(embedding_scp, model_tag, split)
 
 
+def get_enrollment_loc(vectors_loc, embedding_scp, session_type='plda'):
+    source = '{} {}'.format(abspath(embedding_scp), session_type)
+    return join_path(vectors_loc, '{}_{}'.format(ENROLLMENT_DIR, md5(source.encode('utf-8')).hexdigest()))
+
+
+def get_file_signature(**files):
+    return dict([(name, [abspath(file_name), getmtime(file_name)] if file_name is not None else None)
+                 for name, file_name in files.items()])
+
+
 def get_kaldi_ark(args):
     vector = load_array(args[1])
     return write_vector(vector, args[0], args[2])
 
 
+def get_plda_terms(plda_file, mean_file, transform_file, embedding_scp, index_list=None, speaker_list=None,
+                   vectors_loc=None):
+    # PLDA enroll terms of the speaker means with speaker lists, test terms of every embedding without.
+    model = read_kaldi_plda(plda_file)
+    keys, counts, vectors = get_preprocessed_vectors(embedding_scp, mean_file, transform_file, vectors_loc, index_list,
+                                                     speaker_list)
+    if speaker_list is None:
+        return keys, model.test_terms(model.transform_vectors(vectors))
+    return keys, -0.5 * model.enroll_terms(model.transform_vectors(vectors, counts), counts)
+
+
+def get_plda_adaptor(transform_file, adapt_embedding_scp, block_size=65536):
+    # Same input as ivector-adapt-plda in plda.sh: centred on its own mean, projected and length-normalised. The
+    # scp is read in blocks, once for the mean and once for the statistics, so the set is never in memory whole.
+    _, locations = load_key_file(adapt_embedding_scp, n_columns=2)
+    total = 0
+    for start in range(0, len(locations), block_size):
+        total = total + read_vector_locations(locations[start:start + block_size]).sum(axis=0)
+    mean = total / max(len(locations), 1)
+
+    transform = read_kaldi_file(transform_file)
+    adaptor = PldaAdaptor()
+    for start in range(0, len(locations), block_size):
+        adaptor.add_vectors(preprocess_vectors(read_vector_locations(locations[start:start + block_size]), mean,
+                                               transform))
+    return adaptor
+
+
+def get_preprocessed_vectors(embedding_scp, mean_file, transform_file, vectors_loc=None, index_list=None,
+                             speaker_list=None):
+    # Keys, counts and preprocessed vectors of an scp; with speaker lists, per-speaker means are taken first as
+    # ivector-mean does. With vectors_loc the result is kept on disk and reused while the scp, the mean and the
+    # transform are unchanged, and speaker means come from an enrollment store updated session by session.
+    mean = read_kaldi_file(mean_file)
+    transform = read_kaldi_file(transform_file) if transform_file is not None else None
+    if speaker_list is not None and vectors_loc is not None:
+        store = update_enrollment_store(embedding_scp, index_list, speaker_list,
+                                        get_enrollment_loc(vectors_loc, embedding_scp))
+        speaker_ids, counts, means = store.get_statistics()
+        return speaker_ids, counts, preprocess_vectors(means, mean, transform)
+
+    signature = get_file_signature(embeddings=embedding_scp, mean=mean_file, transform=transform_file)
+    if vectors_loc is not None:
+        # One entry per embedding source; a newer mean or transform overwrites it.
+        location = join_path(vectors_loc, md5(signature['embeddings'][0].encode('utf-8')).hexdigest())
+        meta_file = join_path(location, 'meta.json')
+        if exists(meta_file) and load_json_file(meta_file) == signature:
+            return tuple(np.load(join_path(location, '{}.npy'.format(name)), mmap_mode='r')
+                         for name in ['keys', 'counts', 'vectors'])
+
+    keys, vectors = read_vector_scp(embedding_scp)
+    counts = np.ones(len(keys), dtype=np.int32)
+    if speaker_list is not None:
+        keys, found, speaker_codes = get_speaker_codes(keys, index_list, speaker_list)
+        counts, vectors = class_statistics(vectors[found], speaker_codes)[:2]
+    vectors = preprocess_vectors(vectors, mean, transform)
+
+    if vectors_loc is not None:
+        make_directory(location)
+        for name, array in [('keys', keys), ('counts', counts), ('vectors', vectors)]:
+            np.save(join_path(location, '{}.npy'.format(name)), array)
+        save_json_file(meta_file, signature)
+    return keys, counts, vectors
+
+
+def get_saved_enrollment_store(store_loc, signature=None):
+    meta_file = join_path(store_loc, 'meta.json')
+    if exists(meta_file) and load_json_file(meta_file) == (signature or dict()):
+        return load_enrollment_store(store_loc)
+    return None
+
+
+def get_session_keys(speaker_ids, index_list, speaker_list):
+    # A speaker id with a digest of its sessions, so cached per-speaker results go stale when sessions move.
+    index_list = np.asarray(index_list).astype(str)
+    speaker_list = np.asarray(speaker_list).astype(str)
+    order = np.lexsort([index_list, speaker_list])
+    sessions = dict()
+    for speaker, utt in zip(speaker_list[order], index_list[order]):
+        sessions.setdefault(speaker, []).append(utt)
+    return np.array(['{} {}'.format(speaker, md5(' '.join(sessions.get(speaker, [])).encode('utf-8')).hexdigest())
+                     for speaker in np.asarray(speaker_ids).astype(str)])
+
+
+def get_session_sources(locations):
+    # 'ark:offset mtime size' per location: re-extraction rewrites the same arks at the same offsets, so the
+    # location alone does not tell that the vector changed.
+    locations = np.asarray(locations).astype(str)
+    ark_files = np.array([location.rsplit(':', 1)[0] for location in locations.tolist()] + [''])[:-1]
+    stats = dict()
+    for ark_file in np.unique(ark_files).tolist():
+        try:
+            stats[ark_file] = ' {} {}'.format(getmtime(ark_file), getsize(ark_file))
+        except OSError:
+            stats[ark_file] = ''
+    return np.char.add(locations, np.array([stats[ark_file] for ark_file in ark_files.tolist()] + [''])[:-1])
+
+
+def get_speaker_codes(keys, index_list, speaker_list):
+    found, (speakers,) = join_keys(keys, index_list, np.asarray(speaker_list).astype(str))
+    if not np.all(found):
+        print('PLDA: Skipping {} embeddings without a speaker.'.format(np.sum(~found)))
+    speaker_ids, speaker_codes = np.unique(speakers[found], return_inverse=True)
+    return speaker_ids, found, speaker_codes
+
+
+def get_trial_rows(trial_list, enroll_keys, test_keys):
+    # Rows of the trial list for scored (enroll, test) pairs, matched on integer pair codes of the trial list's
+    # vocabularies instead of one joined key string per trial.
+    enroll_found, (enroll_code,) = join_keys(enroll_keys, trial_list.enroll_ids, np.arange(len(trial_list.enroll_ids)))
+    test_found, (test_code,) = join_keys(test_keys, trial_list.test_ids, np.arange(len(trial_list.test_ids)))
+    n_test = len(trial_list.test_ids)
+    pairs = enroll_code.astype(np.int64) * n_test + test_code
+    trial_pairs = np.asarray(trial_list.enroll_idx, dtype=np.int64) * n_test + trial_list.test_idx
+    if len(trial_pairs) == 0:
+        return np.zeros(len(pairs), dtype=bool), np.zeros(len(pairs), dtype=np.int64)
+    order = np.argsort(trial_pairs, kind='stable')
+    pos = np.minimum(np.searchsorted(trial_pairs[order], pairs), len(order) - 1)
+    return enroll_found & test_found & (trial_pairs[order[pos]] == pairs), order[pos]
+
+
+def get_trial_indices(trials_file, enroll_ids, test_keys):
+    # Rows of the enrollment and test matrices for every trial that can be scored.
+    trial_list = get_trial_list(trials_file)
+    enroll_found, (enroll_idx,) = join_keys(trial_list.enroll_ids, enroll_ids, np.arange(len(enroll_ids)))
+    test_found, (test_idx,) = join_keys(trial_list.test_ids, test_keys, np.arange(len(test_keys)))
+    # Like ivector-plda-scoring, trials without an enrollment or test embedding are left out of the score file.
+    scored = enroll_found[trial_list.enroll_idx] & test_found[trial_list.test_idx]
+    if not np.all(scored):
+        print('PLDA: Skipping {} trials without embeddings.'.format(np.sum(~scored)))
+    return trial_list, scored, enroll_idx[trial_list.enroll_idx[scored]], test_idx[trial_list.test_idx[scored]]
+
+
+def load_cosine_vectors(mean_file, transform_file, enroll_embedding_scp, enroll_index_list, enroll_speaker_list,
+                        test_embedding_scp, enroll_mode='mean', vectors_loc=None):
+    speaker_ids, enroll_vectors = get_cosine_terms(mean_file, transform_file, enroll_embedding_scp, enroll_index_list,
+                                                   enroll_speaker_list, enroll_mode, vectors_loc)
+    test_keys, test_vectors = get_cosine_terms(mean_file, transform_file, test_embedding_scp, vectors_loc=vectors_loc)
+    return speaker_ids, enroll_vectors, test_keys, test_vectors
+
+
+def load_scoring_vectors(mean_file, transform_file, enroll_embedding_scp, enroll_index_list, enroll_speaker_list,
+                         test_embedding_scp, vectors_loc=None):
+    # Speaker means of the enrollment embeddings and the test embeddings, both centred, projected and
+    # length-normalised with the files written by PLDA.fit.
+    speaker_ids, counts, enroll_vectors = get_preprocessed_vectors(enroll_embedding_scp, mean_file, transform_file,
+                                                                   vectors_loc, enroll_index_list, enroll_speaker_list)
+    test_keys, _, test_vectors = get_preprocessed_vectors(test_embedding_scp, mean_file, transform_file, vectors_loc)
+    return speaker_ids, counts, enroll_vectors, test_keys, test_vectors
+
+
 def make_kaldi_data_dir(args_list, data_loc):
     make_directory(data_loc)
     # run_command('cd {} && mv * .backup/'.format(data_loc))
     args_list = sort_by_index(args_list)
     make_wav_scp(args_list[:, 0], args_list[:, 4], join_path(data_loc, 'wav.scp'))
-    make_spk_to_utt(args_list[:, 0], args_list[:, 3], join_path(data_loc, 'spk2utt'))
-    make_utt_to_spk(args_list[:, 0], args_list[:, 3], join_path(data_loc, 'utt2spk'))
+    write_speaker_files(args_list[:, 0], args_list[:, 3], join_path(data_loc, 'spk2utt'),
+                        join_path(data_loc, 'utt2spk'))
 
 
 def make_labels_to_index_dict(index_list, label_list):
@@ -202,30 +548,11 @@ def make_labels_to_index_dict(index_list, label_list):
 
 
 def make_spk_to_utt(index_list, speaker_list, spk_utt_file):
-    idx = np.argsort(speaker_list)
-    index_list = index_list[idx]
-    speaker_list = speaker_list[idx]
-    spk_to_utt_dict = dict()
-    for u, s in zip(index_list, speaker_list):
-        try:
-            utt = spk_to_utt_dict[s]
-            utt = '{} {}'.format(utt, u)
-        except KeyError:
-            utt = u
-        spk_to_utt_dict[s] = utt
-
-    with open(spk_utt_file, 'w') as f:
-        for s, u in spk_to_utt_dict.items():
-            f.write('{} {}\n'.format(s, u))
+    write_speaker_files(index_list, speaker_list, spk_utt_file=spk_utt_file)
 
 
 def make_utt_to_spk(index_list, speaker_list, utt_spk_file):
-    idx = np.argsort(index_list)
-    index_list = index_list[idx]
-    speaker_list = speaker_list[idx]
-    with open(utt_spk_file, 'w') as f:
-        for u, s in zip(index_list, speaker_list):
-            f.write('{} {}\n'.format(u, s))
+    write_speaker_files(index_list, speaker_list, utt_spk_file=utt_spk_file)
 
 
 def make_wav_scp(index_list, read_list, wav_scp):
@@ -234,6 +561,76 @@ def make_wav_scp(index_list, read_list, wav_scp):
             f.write('{} {} |\n'.format(i, r))
 
 
+def merge_scp_files(scp_files, scp_file):
+    # Worker scps combined into one, sorted by key as Kaldi tools expect.
+    lines = []
+    for worker_scp in scp_files:
+        with open(worker_scp) as f:
+            lines.extend([line for line in f.read().split('\n') if line.strip() != ''])
+    lines.sort(key=lambda line: line.split(' ', 1)[0])
+    with open(scp_file, 'w') as f:
+        f.write(''.join([line + '\n' for line in lines]))
+    return scp_file
+
+
+def normalize_cosine_scores(mean_file, transform_file, enroll_embedding_scp, enroll_index_list, enroll_speaker_list,
+                            test_embedding_scp, cohort_embedding_scp, scores_file, enroll_mode='mean',
+                            top_k=SCORE_NORM_TOP_K, cache_loc=None, vectors_loc=None):
+    # AS-norm of a cosine score file; the cohort is scored as unit vectors on both sides.
+    speaker_ids, enroll_vectors, test_keys, test_vectors = load_cosine_vectors(
+        mean_file, transform_file, enroll_embedding_scp, enroll_index_list, enroll_speaker_list, test_embedding_scp,
+        enroll_mode, vectors_loc)
+    cohort_vectors = unit_normalize(
+        get_preprocessed_vectors(cohort_embedding_scp, mean_file, transform_file, vectors_loc)[2])
+
+    print('PLDA: Normalizing scores...')
+    signature = dict(get_file_signature(mean=mean_file, transform=transform_file, cohort=cohort_embedding_scp),
+                     enroll_mode=enroll_mode)
+    normalizer = ScoreNormalizer(cohort_vectors, cohort_vectors, top_k, cache_loc, signature)
+    enroll_stats = normalizer.enroll_statistics(get_session_keys(speaker_ids, enroll_index_list, enroll_speaker_list),
+                                                enroll_vectors, get_file_signature(embeddings=enroll_embedding_scp))
+    test_stats = normalizer.test_statistics(test_keys, test_vectors, get_file_signature(embeddings=test_embedding_scp))
+    return normalize_score_file(scores_file, normalizer, speaker_ids, enroll_stats, test_keys, test_stats)
+
+
+def normalize_plda_scores(plda_file, mean_file, transform_file, enroll_embedding_scp, enroll_index_list,
+                          enroll_speaker_list, test_embedding_scp, cohort_embedding_scp, scores_file,
+                          top_k=SCORE_NORM_TOP_K, cache_loc=None, vectors_loc=None):
+    # AS-norm (S-norm when top_k is None) of a score file from either backend, rewritten in place. Cohort
+    # statistics are cached per enrollment speaker and session set and per test utterance, and are reused until
+    # the model, the cohort or the embeddings change.
+    model = read_kaldi_plda(plda_file)
+    speaker_ids, counts, enroll_vectors, test_keys, test_vectors = load_scoring_vectors(
+        mean_file, transform_file, enroll_embedding_scp, enroll_index_list, enroll_speaker_list, test_embedding_scp,
+        vectors_loc)
+    cohort_vectors = model.transform_vectors(
+        get_preprocessed_vectors(cohort_embedding_scp, mean_file, transform_file, vectors_loc)[2])
+
+    print('PLDA: Normalizing scores...')
+    signature = get_file_signature(plda=plda_file, mean=mean_file, transform=transform_file,
+                                   cohort=cohort_embedding_scp)
+    normalizer = ScoreNormalizer(-0.5 * model.enroll_terms(cohort_vectors, np.ones(cohort_vectors.shape[0])),
+                                 model.test_terms(cohort_vectors), top_k, cache_loc, signature)
+    session_keys = get_session_keys(speaker_ids, enroll_index_list, enroll_speaker_list)
+    enroll_terms = -0.5 * model.enroll_terms(model.transform_vectors(enroll_vectors, counts), counts)
+    enroll_stats = normalizer.enroll_statistics(session_keys, enroll_terms,
+                                                get_file_signature(embeddings=enroll_embedding_scp))
+    test_stats = normalizer.test_statistics(test_keys, model.test_terms(model.transform_vectors(test_vectors)),
+                                            get_file_signature(embeddings=test_embedding_scp))
+    return normalize_score_file(scores_file, normalizer, speaker_ids, enroll_stats, test_keys, test_stats)
+
+
+def normalize_score_file(scores_file, normalizer, speaker_ids, enroll_stats, test_keys, test_stats):
+    enroll_keys, trial_test_keys, scores = load_key_file(scores_file, n_columns=3)
+    enroll_found, (enroll_idx,) = join_keys(enroll_keys, speaker_ids, np.arange(len(speaker_ids)))
+    test_found, (test_idx,) = join_keys(trial_test_keys, test_keys, np.arange(len(test_keys)))
+    found = enroll_found & test_found
+    scores = normalizer.normalize(scores[found].astype(np.float64), enroll_stats, test_stats, enroll_idx[found],
+                                  test_idx[found])
+    write_scores_file(scores_file, enroll_keys[found], trial_test_keys[found], scores)
+    return scores_file
+
+
 def parse_egs_scp(egs_file, shuffle_egs=False):
     data = []
     with open(egs_file) as f:
@@ -305,6 +702,52 @@ def read_feats(scp_file, n_features, print_error=False):
     return utt_list, feature_list
 
 
+def read_kaldi_array(f):
+    # A binary vector ('FV', 'DV') or matrix ('FM', 'DM') starting at the current position, without the '\0B' header.
+    token = read_kaldi_token(f)
+    dtype = {'F': '<f4', 'D': '<f8'}.get(token[0])
+    if dtype is None or token[1:] not in ['V', 'M']:
+        raise ValueError('Unsupported Kaldi object {} in {}.'.format(token, f.name))
+    shape = [read_kaldi_int(f) for _ in range(1 if token[1] == 'V' else 2)]
+    size = int(np.prod(shape))
+    return np.frombuffer(f.read(size * np.dtype(dtype).itemsize), dtype=dtype).reshape(shape)
+
+
+def read_kaldi_file(file_name):
+    with open(file_name, 'rb') as f:
+        read_kaldi_header(f)
+        return read_kaldi_array(f)
+
+
+def read_kaldi_header(f):
+    if f.read(2) != b'\0B':
+        raise ValueError('{} is not a binary Kaldi object.'.format(f.name))
+
+
+def read_kaldi_int(f):
+    if f.read(1) != b'\x04':
+        raise ValueError('Expected an int32 in {}.'.format(f.name))
+    return struct.unpack('<i', f.read(4))[0]
+
+
+def read_kaldi_plda(file_name):
+    with open(file_name, 'rb') as f:
+        read_kaldi_header(f)
+        if read_kaldi_token(f) != '<Plda>':
+            raise ValueError('{} is not a Kaldi PLDA model.'.format(file_name))
+        mean, transform, psi = read_kaldi_array(f), read_kaldi_array(f), read_kaldi_array(f)
+    return PldaModel(mean, transform, psi)
+
+
+def read_kaldi_token(f):
+    token = b''
+    c = f.read(1)
+    while c not in [b' ', b'']:
+        token += c
+        c = f.read(1)
+    return token.decode('utf-8')
+
+
 def read_vector(scp_file, dtype=np.float, print_error=False):
     vector = Kaldi().run_command('copy-vector scp:{} ark,t:'.format(scp_file), print_error=print_error)
     vector = re.split('\[', vector)
@@ -327,6 +770,56 @@ def read_vectors(scp_file, dtype=np.float, print_error=False):
     return (utt_list, vector_list) if len(vector_list) > 1 else (utt_list[0], vector_list[0])
 
 
+def read_vector_locations(locations):
+    # Binary vectors at 'ark:offset' locations as one (N, D) matrix; each ark file is opened once.
+    ark_files, offsets = np.array([location.rsplit(':', 1) for location in locations]).T
+    vectors = [None] * len(locations)
+    for ark_file in np.unique(ark_files):
+        with open(ark_file, 'rb') as f:
+            for i in np.flatnonzero(ark_files == ark_file):
+                f.seek(int(offsets[i]))
+                read_kaldi_header(f)
+                vectors[i] = read_kaldi_array(f)
+    return np.vstack(vectors).astype(np.float64)
+
+
+def read_vector_scp(scp_file):
+    # Reads every binary vector of an scp into one (N, D) matrix.
+    keys, locations = load_key_file(scp_file, n_columns=2)
+    return keys, read_vector_locations(locations)
+
+
+def score_cosine(mean_file, transform_file, enroll_embedding_scp, enroll_index_list, enroll_speaker_list,
+                 test_embedding_scp, trials_file, scores_file, enroll_mode='mean', vectors_loc=None):
+    # Cosine scores of the trial list in the format of the PLDA score file.
+    print('PLDA: Computing cosine scores...')
+    speaker_ids, enroll_vectors, test_keys, test_vectors = load_cosine_vectors(
+        mean_file, transform_file, enroll_embedding_scp, enroll_index_list, enroll_speaker_list, test_embedding_scp,
+        enroll_mode, vectors_loc)
+    trial_list, scored, enroll_idx, test_idx = get_trial_indices(trials_file, speaker_ids, test_keys)
+    scores = score_cosine_trials(enroll_vectors, test_vectors, enroll_idx, test_idx)
+    write_scores_file(scores_file, trial_list.enroll_ids, trial_list.test_ids, scores,
+                      trial_list.enroll_idx[scored], trial_list.test_idx[scored])
+    return scores_file
+
+
+def score_plda(plda_file, mean_file, transform_file, enroll_embedding_scp, enroll_index_list, enroll_speaker_list,
+               test_embedding_scp, trials_file, scores_file, vectors_loc=None):
+    # In-process equivalent of the ivector-plda-scoring pipeline: speaker means are centred, projected and
+    # length-normalised with the same files, and the trials are scored in one batched pass.
+    model = read_kaldi_plda(plda_file)
+    print('PLDA: Computing scores...')
+    speaker_ids, counts, enroll_vectors, test_keys, test_vectors = load_scoring_vectors(
+        mean_file, transform_file, enroll_embedding_scp, enroll_index_list, enroll_speaker_list, test_embedding_scp,
+        vectors_loc)
+
+    trial_list, scored, enroll_idx, test_idx = get_trial_indices(trials_file, speaker_ids, test_keys)
+    scores = score_trials(model, enroll_vectors, counts, test_vectors, enroll_idx, test_idx)
+    write_scores_file(scores_file, trial_list.enroll_ids, trial_list.test_ids, scores,
+                      trial_list.enroll_idx[scored], trial_list.test_idx[scored])
+    return scores_file
+
+
 def spaced_file_to_dict(scp_file):
     file_dict = dict()
     with open(scp_file, 'r') as f:
@@ -336,11 +829,160 @@ def spaced_file_to_dict(scp_file):
     return file_dict
 
 
+def train_plda(embedding_scp, centering_embedding_scp, index_list, speaker_list, mean_file, transform_file, plda_file,
+               lda_dim=150, total_covariance_factor=0.0):
+    # In-process equivalent of ivector-mean, ivector-compute-lda and ivector-compute-plda.
+    print('PLDA: Computing mean...')
+    write_kaldi_file(mean_file, read_vector_scp(centering_embedding_scp)[1].mean(axis=0))
+
+    keys, vectors = read_vector_scp(embedding_scp)
+    found, speaker_codes = get_speaker_codes(keys, index_list, speaker_list)[1:]
+    vectors = vectors[found] - vectors[found].mean(axis=0)
+
+    print('PLDA: Computing LDA...')
+    transform = compute_lda(vectors, speaker_codes, lda_dim, total_covariance_factor)
+    write_kaldi_file(transform_file, transform)
+
+    print('PLDA: Fitting PLDA model...')
+    model = fit_plda(length_normalize(apply_transform(vectors, transform)), speaker_codes)
+    write_kaldi_plda(plda_file, model)
+    return model
+
+
+def update_enrollment_store(embedding_scp, index_list, speaker_list, store_loc, session_transform=None,
+                            signature=None):
+    # Brings the enrollment store at store_loc in line with the scp and the speaker lists. Only sessions that are
+    # new, moved to another speaker or whose source (scp entry and the mtime and size of its ark) changed are read;
+    # dropped ones are subtracted. The store is rebuilt when its signature (the session preprocessing) changes.
+    keys, locations = load_key_file(embedding_scp, n_columns=2)
+    found, (speakers,) = join_keys(keys, index_list, np.asarray(speaker_list).astype(str))
+    if not np.all(found):
+        print('PLDA: Skipping {} embeddings without a speaker.'.format(np.sum(~found)))
+    keys, locations, speakers = keys[found], locations[found], speakers[found]
+    sources = get_session_sources(locations)
+
+    store = get_saved_enrollment_store(store_loc, signature)
+    current = np.zeros(len(keys), dtype=bool)
+    stale = []
+    if store is not None:
+        stored, (stored_speakers, stored_sources) = join_keys(keys, store.sessions, store.session_speakers,
+                                                              store.session_sources)
+        current = stored & (stored_speakers == speakers) & (stored_sources == sources)
+        stale = sorted(set(store.sessions) - set(keys[current].tolist()))
+    if store is not None and np.all(current) and len(stale) == 0:
+        return store
+
+    print('PLDA: Updating enrollment store: reading {} sessions, dropping {}.'.format(np.sum(~current), len(stale)))
+    vectors = read_vector_locations(locations[~current]) if np.any(~current) else np.zeros((0, 0))
+    if session_transform is not None and len(vectors) > 0:
+        vectors = session_transform(vectors)
+    if store is None:
+        store = EnrollmentStore(vectors.shape[1])
+    store.remove(stale)
+    store.add(keys[~current], speakers[~current], vectors, sources[~current])
+    store.save(store_loc)
+    save_json_file(join_path(store_loc, 'meta.json'), signature or dict())
+    return store
+
+
+def write_kaldi_array(f, array, double=False):
+    array = np.asarray(array, dtype='<f8' if double else '<f4')
+    f.write('{}{} '.format('D' if double else 'F', 'V' if array.ndim == 1 else 'M').encode('utf-8'))
+    for size in array.shape:
+        f.write(b'\x04' + struct.pack('<i', size))
+    f.write(array.tobytes())
+
+
+def write_kaldi_file(file_name, array, double=False):
+    with open(file_name, 'wb') as f:
+        f.write(b'\0B')
+        write_kaldi_array(f, array, double)
+
+
+def write_kaldi_matrix(f, utt_id, mat):
+    mat = np.asarray(mat, dtype='<f4')
+    offset = write_kaldi_matrix_header(f, utt_id, mat.shape[0], mat.shape[1])
+    f.write(mat.tobytes())
+    return offset
+
+
+def write_kaldi_matrix_header(f, utt_id, n_rows, n_cols):
+    f.write('{} '.format(utt_id).encode('utf-8'))
+    offset = f.tell()
+    f.write(b'\0BFM \x04' + struct.pack('<i', n_rows) + b'\x04' + struct.pack('<i', n_cols))
+    return offset
+
+
+def write_kaldi_plda(file_name, model):
+    # Same layout as Kaldi's Plda::Write, so ivector-plda-scoring and ivector-adapt-plda can read it.
+    with open(file_name, 'wb') as f:
+        f.write(b'\0B<Plda> ')
+        write_kaldi_array(f, model.mean, double=True)
+        write_kaldi_array(f, model.transform, double=True)
+        write_kaldi_array(f, model.psi, double=True)
+        f.write(b'</Plda> ')
+
+
+def write_kaldi_vector(f, utt_id, vector):
+    # One binary float vector entry of an ark; returns the offset its scp line points to.
+    f.write('{} '.format(utt_id).encode('utf-8'))
+    offset = f.tell()
+    f.write(b'\0B')
+    write_kaldi_array(f, vector)
+    return offset
+
+
 def write_num_utterance(speaker_list, num_utt_file):
-    speaker_counter = Counter(speaker_list)
-    with open(num_utt_file, 'w') as f:
-        for speaker in speaker_counter.keys():
-            f.write('{} {}\n'.format(speaker, speaker_counter[speaker]))
+    write_speaker_files(speaker_list, speaker_list, num_utt_file=num_utt_file)
+
+
+def write_scores_file(scores_file, enroll_keys, test_keys, scores, enroll_idx=None, test_idx=None, block_size=1000000):
+    # Formatted in blocks, so tens of millions of trials never hold all lines in memory at once. With enroll_idx
+    # and test_idx the keys are vocabularies and each block gathers its own keys.
+    with open(scores_file, 'w') as f:
+        for start in range(0, len(scores), block_size):
+            end = start + block_size
+            block_enroll_keys = enroll_keys[start:end] if enroll_idx is None else enroll_keys[enroll_idx[start:end]]
+            block_test_keys = test_keys[start:end] if test_idx is None else test_keys[test_idx[start:end]]
+            lines = np.char.add(np.char.add(np.asarray(block_enroll_keys), ' '), np.asarray(block_test_keys))
+            lines = np.char.add(np.char.add(lines, ' '), np.char.mod('%g', scores[start:end]))
+            f.write(''.join([line + '\n' for line in lines.tolist()]))
+
+
+def write_speaker_files(index_list, speaker_list, spk_utt_file=None, utt_spk_file=None, num_utt_file=None):
+    index_list = np.asarray(index_list).astype(str)
+    speaker_list = np.asarray(speaker_list).astype(str)
+    out_files = [spk_utt_file, utt_spk_file, num_utt_file]
+
+    # The files are skipped when they were last written from the same utterances and speakers.
+    digest = md5(repr([f is not None for f in out_files]).encode('utf-8'))
+    digest.update('\n'.join(index_list).encode('utf-8'))
+    digest.update('\n'.join(speaker_list).encode('utf-8'))
+    digest = digest.hexdigest()
+    out_files = [f for f in out_files if f is not None]
+    digest_file = '{}.md5'.format(out_files[0])
+    if all([exists(f) for f in out_files + [digest_file]]):
+        with open(digest_file) as f:
+            if f.read().strip() == digest:
+                return False
+
+    speakers, codes = np.unique(speaker_list, return_inverse=True)
+    counts = np.bincount(codes, minlength=len(speakers))
+    groups = np.split(index_list[np.lexsort((index_list, codes))], np.cumsum(counts)[:-1])
+    if spk_utt_file is not None:
+        with open(spk_utt_file, 'w') as f:
+            f.writelines(['{} {}\n'.format(s, ' '.join(g)) for s, g in zip(speakers, groups)])
+    if num_utt_file is not None:
+        with open(num_utt_file, 'w') as f:
+            f.writelines(['{} {}\n'.format(s, c) for s, c in zip(speakers, counts)])
+    if utt_spk_file is not None:
+        idx = np.argsort(index_list, kind='stable')
+        with open(utt_spk_file, 'w') as f:
+            f.writelines(['{} {}\n'.format(u, s) for u, s in zip(index_list[idx], speaker_list[idx])])
+
+    with open(digest_file, 'w') as f:
+        f.write('{}\n'.format(digest))
+    return True
 
 
 def write_vector(arr, utt_id, ark_file, print_error=False):
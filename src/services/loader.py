@@ -7,7 +7,7 @@ from constants.app_constants import FEATS_SCP_FILE, TMP_SCP_FILE, SPK_EMB_SCP_FI
     ENROLL_SPK_EMB_SCP_FILE
 from services.common import get_index_array, split_dict, make_dict
 from services.kaldi import spaced_file_to_dict, read_feats, make_labels_to_index_dict, read_vector
-from services.sre_data import split_trials_file
+from services.trials import get_trial_list
 
 
 class BatchLoader:
@@ -279,9 +279,10 @@ class LabelBatchLoader:
 
 class LabelExtractLoader:
     def __init__(self, trials_file, test_list, n_features, max_batch_size, model_tag, multiple=1, save_loc='../save'):
-        index_list, label_list, target_list = split_trials_file(trials_file)
+        trial_list = get_trial_list(trials_file)
+        index_list, label_list = trial_list.test_keys(), trial_list.enroll_keys()
         self.index_list = np.array(index_list)
-        self.target_labels = np.array([1 if t == 'target' else 0 for t in target_list])
+        self.target_labels = (np.array(trial_list.target) == 1).astype(int)
         self.n_features = n_features
         self.batch_size = max_batch_size
         self.multiple = multiple
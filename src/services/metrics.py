@@ -0,0 +1,94 @@
+import numpy as np
+
+from constants.app_constants import DCF_P_TARGETS
+
+
+def compute_det(sorted_targets):
+    # Miss and false alarm rates for every threshold between two sorted scores: the first i trials are rejected.
+    n_targets = np.sum(sorted_targets)
+    n_nontargets = len(sorted_targets) - n_targets
+    misses = np.concatenate([[0], np.cumsum(sorted_targets)])
+    false_alarms = n_nontargets - np.concatenate([[0], np.cumsum(~sorted_targets)])
+    return misses / max(n_targets, 1), false_alarms / max(n_nontargets, 1)
+
+
+def compute_eer(miss_rates, fa_rates):
+    # Linear interpolation at the point where the miss rate crosses the false alarm rate.
+    i = int(np.argmax(miss_rates >= fa_rates))
+    if i == 0:
+        return float(fa_rates[0])
+    gap_0 = fa_rates[i - 1] - miss_rates[i - 1]
+    gap_1 = fa_rates[i] - miss_rates[i]
+    alpha = gap_0 / (gap_0 - gap_1)
+    return float(miss_rates[i - 1] + alpha * (miss_rates[i] - miss_rates[i - 1]))
+
+
+def compute_metrics(scores, targets, groups=None, p_targets=DCF_P_TARGETS, c_miss=1.0, c_fa=1.0, det_points=None):
+    # One sort of the scores serves the pooled metrics and every group; a group is a stable subset of the
+    # sorted trials, so its DET curve needs only cumulative sums. Trials with target < 0 (no key) are ignored.
+    scores = np.asarray(scores, dtype=np.float64)
+    targets = np.asarray(targets)
+    keyed = targets >= 0
+    order = np.flatnonzero(keyed)[np.argsort(scores[keyed], kind='mergesort')]
+    sorted_scores = scores[order]
+    sorted_targets = targets[order] > 0
+
+    # Only thresholds between two different scores are operating points.
+    boundaries = np.concatenate([[True], sorted_scores[1:] != sorted_scores[:-1], [True]])
+    thresholds = np.append(sorted_scores, np.inf)
+
+    metrics = get_operating_metrics(sorted_targets, boundaries, thresholds, p_targets, c_miss, c_fa, det_points)
+    metrics['groups'] = dict()
+    for name, labels in (groups or dict()).items():
+        sorted_labels = np.asarray(labels).astype(str)[order]
+        metrics['groups'][name] = dict()
+        for label in np.unique(sorted_labels):
+            mask = sorted_labels == label
+            # A boundary of the subset sits after its last trial at or below each pooled boundary.
+            positions = np.concatenate([[0], np.cumsum(mask)])
+            subset_boundaries = np.zeros(np.sum(mask) + 1, dtype=bool)
+            subset_boundaries[positions[boundaries]] = True
+            subset_thresholds = np.append(sorted_scores[mask], np.inf)
+            metrics['groups'][name][label] = get_operating_metrics(
+                sorted_targets[mask], subset_boundaries, subset_thresholds, p_targets, c_miss, c_fa)
+    return metrics
+
+
+def compute_min_dcf(miss_rates, fa_rates, p_target, c_miss=1.0, c_fa=1.0):
+    # Normalized detection cost, minimised over the thresholds.
+    costs = c_miss * p_target * miss_rates + c_fa * (1 - p_target) * fa_rates
+    i = int(np.argmin(costs))
+    return float(costs[i] / min(c_miss * p_target, c_fa * (1 - p_target))), i
+
+
+def get_operating_metrics(sorted_targets, boundaries, thresholds, p_targets, c_miss, c_fa, det_points=None):
+    miss_rates, fa_rates = compute_det(sorted_targets)
+    miss_rates, fa_rates, thresholds = miss_rates[boundaries], fa_rates[boundaries], thresholds[boundaries]
+    metrics = {
+        'trials': len(sorted_targets),
+        'targets': int(np.sum(sorted_targets)),
+        'eer': compute_eer(miss_rates, fa_rates),
+        'min_dcf': dict()
+    }
+    for p_target in p_targets:
+        min_dcf, i = compute_min_dcf(miss_rates, fa_rates, p_target, c_miss, c_fa)
+        metrics['min_dcf'][p_target] = {'min_dcf': min_dcf, 'threshold': float(thresholds[i])}
+    if det_points is not None:
+        idx = np.unique(np.linspace(0, len(miss_rates) - 1, min(det_points, len(miss_rates))).astype(int))
+        metrics['det'] = {'miss_rates': miss_rates[idx].tolist(), 'fa_rates': fa_rates[idx].tolist(),
+                          'thresholds': thresholds[idx].tolist()}
+    return metrics
+
+
+def print_metrics(metrics, prefix='PLDA'):
+    print('{}: EER {:.2%}, {} trials ({} targets)'.format(prefix, metrics['eer'], metrics['trials'], metrics['targets']))
+    for p_target, stats in sorted(metrics['min_dcf'].items(), reverse=True):
+        print('{}:   minDCF(p_target={}) {:.4f} at threshold {:.3f}'
+              .format(prefix, p_target, stats['min_dcf'], stats['threshold']))
+    for name, group in metrics.get('groups', dict()).items():
+        for label, stats in sorted(group.items()):
+            print('{}:   {} {:<12} EER {:.2%}, minDCF {}, {} trials'
+                  .format(prefix, name, label, stats['eer'],
+                          ' / '.join(['{:.4f}'.format(stats['min_dcf'][p]['min_dcf'])
+                                      for p in sorted(stats['min_dcf'].keys(), reverse=True)]),
+                          stats['trials']))
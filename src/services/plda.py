@@ -0,0 +1,199 @@
+import numpy as np
+
+
+class PldaAdaptor:
+    def __init__(self):
+        self.count = 0
+        self.sum = None
+        self.scatter = None
+
+    def adapt(self, model, within_covar_scale=0.3, between_covar_scale=0.7, mean_diff_scale=1.0):
+        # Kaldi's PldaUnsupervisedAdaptor: where the in-domain covariance exceeds the model's total covariance,
+        # the excess is split between the within- and between-class covariances. The statistics are kept, so
+        # different scales can be tried without another pass over the data.
+        mean = self.sum / self.count
+        variance = self.scatter / self.count - np.outer(mean, mean)
+        mean_diff = mean - model.mean
+        variance += mean_diff_scale * np.outer(mean_diff, mean_diff)
+
+        transform_mod = model.transform / np.sqrt(1.0 + model.psi)[:, None]
+        s, p = sorted_eigh(transform_mod.dot(variance).dot(transform_mod.T))
+        within = p.T.dot(np.diag(1.0 / (1.0 + model.psi))).dot(p)
+        between = p.T.dot(np.diag(model.psi / (1.0 + model.psi))).dot(p)
+        excess = np.maximum(s - 1.0, 0.0)
+        within[np.diag_indices_from(within)] += excess * within_covar_scale
+        between[np.diag_indices_from(between)] += excess * between_covar_scale
+
+        combined_inv = np.linalg.inv(p.T.dot(transform_mod))
+        within = combined_inv.dot(within).dot(combined_inv.T)
+        between = combined_inv.dot(between).dot(combined_inv.T)
+        normalizing_transform = eig_normalizing_transform(within)
+        psi, q = sorted_eigh(normalizing_transform.dot(between).dot(normalizing_transform.T))
+        return PldaModel(mean, q.T.dot(normalizing_transform), psi)
+
+    def add_vectors(self, vectors, block_size=65536):
+        # One streaming pass; vectors may be a memory map larger than RAM.
+        for start in range(0, vectors.shape[0], block_size):
+            block = np.asarray(vectors[start:start + block_size], dtype=np.float64)
+            if self.sum is None:
+                self.sum = np.zeros(block.shape[1])
+                self.scatter = np.zeros((block.shape[1], block.shape[1]))
+            self.count += block.shape[0]
+            self.sum += block.sum(axis=0)
+            self.scatter += block.T.dot(block)
+        return self
+
+
+class PldaModel:
+    def __init__(self, mean, transform, psi):
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.transform = np.asarray(transform, dtype=np.float64)
+        self.psi = np.asarray(psi, dtype=np.float64)
+        self.offset = -self.transform.dot(self.mean)
+
+    def dim(self):
+        return self.mean.shape[0]
+
+    def enroll_terms(self, transformed, num_examples):
+        # Expands Plda::LogLikelihoodRatio so that a trial score is -0.5 * enroll_terms[e] . test_terms[t].
+        num_examples = np.asarray(num_examples, dtype=np.float64).reshape(-1, 1)
+        scale = num_examples * self.psi / (num_examples * self.psi + 1.0)
+        variance = 1.0 + self.psi / (num_examples * self.psi + 1.0)
+        constant = np.sum((scale * transformed) ** 2 / variance + np.log(variance), axis=1) - \
+            np.sum(np.log(1.0 + self.psi))
+        return np.hstack([constant[:, None], 1.0 / variance - 1.0 / (1.0 + self.psi),
+                          -2.0 * scale * transformed / variance])
+
+    def test_terms(self, transformed):
+        return np.hstack([np.ones((transformed.shape[0], 1)), transformed ** 2, transformed])
+
+    def transform_vectors(self, vectors, num_examples=1, normalize_length=True):
+        # Plda::TransformIvector: project, then scale each row by the normalization factor for its count.
+        transformed = np.asarray(vectors, dtype=np.float64).dot(self.transform.T) + self.offset
+        if normalize_length:
+            num_examples = np.asarray(num_examples, dtype=np.float64).reshape(-1, 1)
+            inv_covariance = 1.0 / (self.psi + 1.0 / num_examples)
+            transformed *= np.sqrt(self.dim() / np.sum(inv_covariance * transformed ** 2, axis=1, keepdims=True))
+        return transformed
+
+
+def apply_transform(vectors, transform):
+    # Same as transform-vec: a (dim, D + 1) matrix carries an offset in its last column.
+    vectors = np.asarray(vectors, dtype=np.float64)
+    if transform.shape[1] == vectors.shape[1] + 1:
+        return vectors.dot(transform[:, :-1].T) + transform[:, -1]
+    return vectors.dot(transform.T)
+
+
+def class_statistics(vectors, class_codes):
+    # Per-class counts and means plus the pooled within-class scatter, from one sort of the codes.
+    order = np.argsort(class_codes, kind='stable')
+    codes = np.asarray(class_codes)[order]
+    starts = np.flatnonzero(np.concatenate([[True], codes[1:] != codes[:-1]]))
+    counts = np.diff(np.append(starts, len(codes)))
+    means = np.add.reduceat(vectors[order], starts, axis=0) / counts[:, None]
+    within_scatter = vectors.T.dot(vectors) - (means * counts[:, None]).T.dot(means)
+    return counts, means, within_scatter
+
+
+def compute_lda(vectors, class_codes, lda_dim, total_covariance_factor=0.0, covariance_floor=1e-6):
+    # Follows ivector-compute-lda: whiten the interpolated within/total covariance, then keep the top
+    # directions of the whitened between-class covariance. The offset removes the mean of the input.
+    vectors = np.asarray(vectors, dtype=np.float64)
+    mean = vectors.mean(axis=0)
+    vectors = vectors - mean
+    counts, means, within_scatter = class_statistics(vectors, class_codes)
+    total_covariance = vectors.T.dot(vectors) / vectors.shape[0]
+    within_covariance = within_scatter / vectors.shape[0]
+    between_covariance = total_covariance - within_covariance
+
+    normalizing_transform = eig_normalizing_transform(
+        total_covariance_factor * total_covariance + (1.0 - total_covariance_factor) * within_covariance,
+        covariance_floor)
+    s, u = sorted_eigh(normalizing_transform.dot(between_covariance).dot(normalizing_transform.T))
+    linear_part = u[:, :lda_dim].T.dot(normalizing_transform)
+    return np.hstack([linear_part, -linear_part.dot(mean)[:, None]])
+
+
+def eig_normalizing_transform(covariance, floor=0.0):
+    s, u = sorted_eigh(covariance)
+    s = np.maximum(s, floor * s[0])
+    return (u / np.sqrt(s)).T
+
+
+def fit_plda(vectors, class_codes, n_iters=10):
+    # Two-covariance model trained with EM as in Kaldi's PldaEstimator, with every class weighted 1.
+    # Classes with the same number of examples share the posterior covariance, so each EM step is a
+    # handful of matrix products per distinct class size.
+    vectors = np.asarray(vectors, dtype=np.float64)
+    dim = vectors.shape[1]
+    counts, means, within_scatter = class_statistics(vectors, class_codes)
+    n_classes = counts.shape[0]
+    mean = means.mean(axis=0)
+    centered_means = means - mean
+    sizes, size_codes = np.unique(counts, return_inverse=True)
+    groups = [centered_means[size_codes == i] for i in range(len(sizes))]
+
+    within_var = np.eye(dim)
+    between_var = np.eye(dim)
+    for _ in range(n_iters):
+        within_inv = np.linalg.inv(within_var)
+        between_inv = np.linalg.inv(between_var)
+        within_stats = within_scatter.copy()
+        between_stats = np.zeros((dim, dim))
+        for n, group in zip(sizes, groups):
+            mixed_var = np.linalg.inv(between_inv + n * within_inv)
+            w = (n * group.dot(within_inv)).dot(mixed_var)
+            m_w = group - w
+            between_stats += group.shape[0] * mixed_var + w.T.dot(w)
+            within_stats += n * (group.shape[0] * mixed_var + m_w.T.dot(m_w))
+        # The within-class count is N - C from the scatter plus C from the class means.
+        within_var = within_stats / counts.sum()
+        between_var = between_stats / n_classes
+
+    # Any whitening of the within-class covariance gives the same model up to the sign of each direction.
+    transform_1 = eig_normalizing_transform(within_var)
+    psi, u = sorted_eigh(transform_1.dot(between_var).dot(transform_1.T))
+    return PldaModel(mean, u.T.dot(transform_1), np.maximum(psi, 0.0))
+
+
+def length_normalize(vectors):
+    # Same as ivector-normalize-length: every row is scaled to a norm of sqrt(dim).
+    vectors = np.asarray(vectors, dtype=np.float64)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors * (np.sqrt(vectors.shape[1]) / np.maximum(norms, np.finfo(np.float64).tiny))
+
+
+def preprocess_vectors(vectors, mean, transform=None):
+    # ivector-subtract-global-mean, transform-vec and ivector-normalize-length in one step.
+    vectors = np.asarray(vectors, dtype=np.float64) - mean
+    return length_normalize(vectors if transform is None else apply_transform(vectors, transform))
+
+
+def score_pairs(a, b, enroll_idx, test_idx, block_size=16384):
+    # Dot products a[enroll_idx] . b[test_idx], in blocks in enrollment order. A block that is close to a full
+    # cross product of its enrollments and tests is one matrix product; sparse blocks are scored row by row.
+    enroll_idx = np.asarray(enroll_idx)
+    test_idx = np.asarray(test_idx)
+    order = np.argsort(enroll_idx, kind='stable')
+    scores = np.empty(len(order))
+    for start in range(0, len(order), block_size):
+        block = order[start:start + block_size]
+        enrolls, enroll_block_idx = np.unique(enroll_idx[block], return_inverse=True)
+        tests, test_block_idx = np.unique(test_idx[block], return_inverse=True)
+        if len(enrolls) * len(tests) <= 4 * len(block):
+            scores[block] = a[enrolls].dot(b[tests].T)[enroll_block_idx, test_block_idx]
+        else:
+            scores[block] = np.einsum('ij,ij->i', a[enroll_idx[block]], b[test_idx[block]])
+    return scores
+
+
+def score_trials(model, enroll_vectors, num_examples, test_vectors, enroll_idx, test_idx, block_size=16384):
+    a = model.enroll_terms(model.transform_vectors(enroll_vectors, num_examples), num_examples)
+    b = model.test_terms(model.transform_vectors(test_vectors))
+    return -0.5 * score_pairs(a, b, enroll_idx, test_idx, block_size)
+
+
+def sorted_eigh(matrix):
+    s, u = np.linalg.eigh((matrix + matrix.T) / 2)
+    return s[::-1], u[:, ::-1]
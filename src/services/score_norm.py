@@ -0,0 +1,72 @@
+from os.path import exists, join as join_path
+
+import numpy as np
+
+from services.common import join_keys, load_json_file, make_directory, save_json_file
+
+
+class ScoreNormalizer:
+    def __init__(self, cohort_enroll_terms, cohort_test_terms, top_k=None, cache_loc=None, signature=None):
+        # Scores are dot products of enroll-side and test-side terms, so the same engine serves PLDA and cosine
+        # scoring. Enrollments are scored against the cohort on its test side and tests against its enroll side.
+        self.cohort_enroll_terms = cohort_enroll_terms
+        self.cohort_test_terms = cohort_test_terms
+        self.top_k = top_k
+        self.cache_loc = cache_loc
+        self.signature = dict(signature or dict(), top_k=top_k, cohort_size=cohort_enroll_terms.shape[0])
+
+    def enroll_statistics(self, keys, enroll_terms, signature=None):
+        return self.get_statistics('enroll', keys, enroll_terms, self.cohort_test_terms, signature)
+
+    def get_statistics(self, side, keys, terms, cohort_terms, signature=None):
+        # Cohort mean and std per key; with a cache location only keys not seen before are scored.
+        keys = np.asarray(keys).astype(str)
+        if self.cache_loc is None:
+            return cohort_statistics(terms, cohort_terms, self.top_k)
+
+        location = join_path(self.cache_loc, side)
+        meta_file = join_path(location, 'meta.json')
+        signature = dict(self.signature, **(signature or dict()))
+        cached_keys, cached_stats = np.zeros(0, dtype=str), np.zeros((0, 2))
+        if exists(meta_file) and load_json_file(meta_file) == signature:
+            cached_keys = np.load(join_path(location, 'keys.npy'))
+            cached_stats = np.load(join_path(location, 'stats.npy'))
+
+        found, (stats,) = join_keys(keys, cached_keys, cached_stats)
+        if not np.all(found):
+            print('Score norm: Computing {} cohort statistics for {} {} keys.'
+                  .format('top-{}'.format(self.top_k) if self.top_k else 'full', np.sum(~found), side))
+            stats[~found] = np.vstack(cohort_statistics(terms[~found], cohort_terms, self.top_k)).T
+            make_directory(location)
+            new_keys, first = np.unique(keys[~found], return_index=True)
+            np.save(join_path(location, 'keys.npy'), np.append(cached_keys, new_keys))
+            np.save(join_path(location, 'stats.npy'), np.vstack([cached_stats, stats[~found][first]]))
+            save_json_file(meta_file, signature)
+        return stats[:, 0], stats[:, 1]
+
+    def normalize(self, scores, enroll_stats, test_stats, enroll_idx, test_idx):
+        return as_norm(scores, enroll_stats[0][enroll_idx], enroll_stats[1][enroll_idx],
+                       test_stats[0][test_idx], test_stats[1][test_idx])
+
+    def test_statistics(self, keys, test_terms, signature=None):
+        return self.get_statistics('test', keys, test_terms, self.cohort_enroll_terms, signature)
+
+
+def as_norm(scores, enroll_mean, enroll_std, test_mean, test_std):
+    return 0.5 * ((scores - enroll_mean) / enroll_std + (scores - test_mean) / test_std)
+
+
+def cohort_statistics(terms, cohort_terms, top_k=None, max_block_cells=2 ** 22):
+    # Rows are scored against the whole cohort in blocks of bounded size. With top_k only the k highest cohort
+    # scores of each row are kept (AS-norm), found with a partial selection instead of a sort.
+    n_cohort = cohort_terms.shape[0]
+    block_size = max(1, max_block_cells // max(n_cohort, 1))
+    mean = np.zeros(terms.shape[0])
+    std = np.zeros(terms.shape[0])
+    for start in range(0, terms.shape[0], block_size):
+        scores = terms[start:start + block_size].dot(cohort_terms.T)
+        if top_k is not None and top_k < n_cohort:
+            scores = np.partition(scores, n_cohort - top_k, axis=1)[:, n_cohort - top_k:]
+        mean[start:start + block_size] = scores.mean(axis=1)
+        std[start:start + block_size] = scores.std(axis=1)
+    return mean, np.maximum(std, np.finfo(np.float64).eps)
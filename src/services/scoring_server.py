@@ -0,0 +1,255 @@
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps as dump_json, loads as load_json
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+
+import numpy as np
+import time
+
+from services.cosine import combine_sessions, unit_normalize
+from services.plda import preprocess_vectors
+
+
+class LatencyMetrics:
+    def __init__(self, window=10000):
+        # Latencies of the last window requests and sizes of the last window batches.
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.n_requests = 0
+        self.n_errors = 0
+        self.lock = Lock()
+
+    def add_batch(self, n_embeddings):
+        with self.lock:
+            self.batch_sizes.append(n_embeddings)
+
+    def add_request(self, latency, error=False):
+        with self.lock:
+            self.latencies.append(latency)
+            self.n_requests += 1
+            self.n_errors += int(error)
+
+    def summary(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            batch_sizes = np.array(self.batch_sizes)
+            summary = {'requests': self.n_requests, 'errors': self.n_errors, 'batches': len(batch_sizes)}
+        if len(latencies) > 0:
+            summary['latency_ms'] = dict([('mean', float(latencies.mean()))] + [
+                ('p{}'.format(q), float(np.percentile(latencies, q))) for q in [50, 95, 99]] + [
+                ('max', float(latencies.max()))])
+        if len(batch_sizes) > 0:
+            summary['batch_embeddings'] = {'mean': float(batch_sizes.mean()), 'max': int(batch_sizes.max())}
+        return summary
+
+
+class MicroBatcher:
+    def __init__(self, backend, max_batch=256, max_wait=0.005, metrics=None):
+        # Concurrent requests are queued and served together: a batch closes after max_wait seconds or once it
+        # holds max_batch embeddings, and all of its embeddings are preprocessed in one pass.
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.metrics = metrics or LatencyMetrics()
+        self.queue = Queue()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def get_batch(self):
+        batch = [self.queue.get()]
+        n_embeddings = len(batch[0]['embeddings'])
+        deadline = time.time() + self.max_wait
+        while n_embeddings < self.max_batch:
+            try:
+                request = self.queue.get(timeout=max(deadline - time.time(), 0))
+            except Empty:
+                break
+            batch.append(request)
+            n_embeddings += len(request['embeddings'])
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.get_batch()
+            sizes = [len(request['embeddings']) for request in batch]
+            self.metrics.add_batch(sum(sizes))
+            try:
+                terms = self.backend.test_terms(np.vstack([request['embeddings'] for request in batch]))
+            except Exception as e:
+                terms = None
+                for request in batch:
+                    request['error'] = str(e)
+            for request, start, end in zip(batch, np.cumsum([0] + sizes[:-1]), np.cumsum(sizes)):
+                if terms is not None:
+                    try:
+                        request['result'] = self.backend.serve(request, terms[start:end])
+                    except Exception as e:
+                        # A bad request must not stop the batcher thread.
+                        request['error'] = 'Invalid request: {!r}'.format(e)
+                request['done'].set()
+
+    def submit(self, request):
+        # Blocks until the request's batch has been served; returns the result and an error message or None.
+        start_time = time.time()
+        request = dict(request, embeddings=np.asarray(request['embeddings'], dtype=np.float64).reshape(
+            -1, self.backend.embedding_dim()), done=Event())
+        self.queue.put(request)
+        request['done'].wait()
+        self.metrics.add_request(time.time() - start_time, 'error' in request)
+        return request.get('result'), request.get('error')
+
+
+class ScoringBackend:
+    def __init__(self, index, mean, transform=None, model=None, store=None, enroll_mode='mean'):
+        # Everything scoring needs stays resident: the centering mean, the LDA transform, the PLDA model (None
+        # scores by cosine similarity) and the enrolled speaker models held by a SpeakerIndex. With the
+        # EnrollmentStore the index was built from, sessions can be enrolled and removed while serving.
+        self.index = index
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.transform = transform
+        self.model = model
+        self.store = store
+        self.enroll_mode = enroll_mode
+        self.lock = Lock()
+
+    def embedding_dim(self):
+        return self.mean.shape[0]
+
+    def enroll(self, session_keys, speakers, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float64).reshape(-1, self.embedding_dim())
+        if len(session_keys) != len(embeddings) or len(speakers) != len(embeddings):
+            raise ValueError('expected one session key and speaker per embedding')
+        vectors = self.session_vectors(embeddings)
+        with self.lock:
+            return self.update_speakers(self.get_store().add(session_keys, speakers, vectors))
+
+    def get_store(self):
+        if self.store is None:
+            raise ValueError('enrollment updates need an enrollment store')
+        return self.store
+
+    def identify(self, terms, top_k=10, n_probe=None):
+        with self.lock:
+            speakers, scores = self.index.search(terms, top_k, n_probe)
+        return [[[s, float(v)] for s, v in zip(row_speakers, row_scores) if np.isfinite(v)]
+                for row_speakers, row_scores in zip(speakers.tolist(), scores)]
+
+    def score(self, terms, trials):
+        # trials are (speaker, embedding row) pairs.
+        speakers = [speaker for speaker, _ in trials]
+        rows = np.array([int(i) for _, i in trials], dtype=np.int64)
+        if np.any(rows < 0):
+            raise IndexError('negative embedding index')
+        with self.lock:
+            enroll_terms = self.index.vectors[[self.index.rows[speaker] for speaker in speakers]]
+        return np.einsum('ij,ij->i', enroll_terms.astype(np.float64), terms[rows]).tolist()
+
+    def session_vectors(self, embeddings):
+        # What the store accumulates per session: raw embeddings for PLDA, whose speaker means are preprocessed
+        # as ivector-mean output is, and unit preprocessed vectors for cosine scoring.
+        if self.model is None:
+            return unit_normalize(preprocess_vectors(embeddings, self.mean, self.transform))
+        return embeddings
+
+    def serve(self, request, terms):
+        if request['kind'] == 'identify':
+            return self.identify(terms, int(request.get('top_k', 10)), request.get('n_probe'))
+        trials = request.get('trials')
+        if trials is None:
+            # Without a trial list, the i-th embedding is scored against the i-th speaker.
+            trials = list(zip(request['speakers'], range(len(terms))))
+        return self.score(terms, trials)
+
+    def speaker_terms(self, counts, means):
+        if self.model is None:
+            return combine_sessions(means, self.enroll_mode)
+        vectors = self.model.transform_vectors(preprocess_vectors(means, self.mean, self.transform), counts)
+        return -0.5 * self.model.enroll_terms(vectors, counts)
+
+    def test_terms(self, embeddings):
+        vectors = preprocess_vectors(embeddings, self.mean, self.transform)
+        if self.model is None:
+            return unit_normalize(vectors)
+        return self.model.test_terms(self.model.transform_vectors(vectors))
+
+    def unenroll(self, session_keys):
+        with self.lock:
+            store = self.get_store()
+            # Checked up front so that a bad key leaves the store and the index untouched.
+            missing = [key for key in session_keys if key not in store.session_rows]
+            if len(missing) > 0:
+                raise KeyError(missing[0])
+            return self.update_speakers(store.remove(session_keys))
+
+    def update_speakers(self, speakers):
+        # Only the models of the changed speakers are re-derived; speakers without sessions leave the index.
+        enrolled = [speaker for speaker in speakers if speaker in self.store.speaker_rows]
+        self.index.remove([speaker for speaker in speakers
+                           if speaker not in self.store.speaker_rows and speaker in self.index.rows])
+        if len(enrolled) > 0:
+            keys, counts, means = self.store.get_statistics(enrolled)
+            self.index.add(keys.tolist(), self.speaker_terms(counts, means))
+        return speakers
+
+
+class ScoringServer(ThreadingHTTPServer):
+    # Concurrent clients are the point of micro-batching, so the listen backlog is larger than the default 5.
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok', 'speakers': self.server.batcher.backend.index.size})
+        elif self.path == '/metrics':
+            self.send_json(200, self.server.batcher.metrics.summary())
+        else:
+            self.send_json(404, {'error': 'Unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        kind = self.path.strip('/')
+        if kind not in ['score', 'identify', 'enroll', 'unenroll']:
+            self.send_json(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+        backend = self.server.batcher.backend
+        try:
+            request = load_json(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            # Enrollment updates take the backend lock directly instead of going through the batcher.
+            if kind == 'enroll':
+                result, error = backend.enroll(request['sessions'], request['speakers'], request['embeddings']), None
+            elif kind == 'unenroll':
+                result, error = backend.unenroll(request['sessions']), None
+            else:
+                result, error = self.server.batcher.submit(dict(request, kind=kind))
+        except (KeyError, ValueError, TypeError) as e:
+            result, error = None, 'Invalid request: {!r}'.format(e)
+        if error is not None:
+            self.send_json(400, {'error': error})
+        else:
+            self.send_json(200, {'scores' if kind == 'score' else 'speakers': result})
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, obj):
+        body = dump_json(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(backend, host='127.0.0.1', port=8642, max_batch=256, max_wait=0.005):
+    # Local loopback HTTP server:
+    #   POST /score     {"embeddings": [[...], ...], "speakers": [...]}, or "trials": [[speaker, i], ...] instead
+    #                   of "speakers" to score a batch of trials against the given embeddings
+    #   POST /identify  {"embeddings": [[...], ...], "top_k": 10, "n_probe": null}
+    #   POST /enroll    {"sessions": [...], "speakers": [...], "embeddings": [[...], ...]}
+    #   POST /unenroll  {"sessions": [...]}
+    #   GET  /metrics, /health
+    server = ScoringServer((host, port), ScoringHandler)
+    server.batcher = MicroBatcher(backend, max_batch, max_wait)
+    return server
@@ -4,32 +4,45 @@ from os.path import join as join_path
 import numpy as np
 import re
 
-from services.common import get_file_list_as_dict, remove_duplicates, sort_by_index
+from constants.app_constants import NUM_CPU_WORKERS
+from services.common import get_file_list_as_dict, join_keys, load_key_file, remove_duplicates, run_parallel, \
+    sort_by_index
+from services.trials import get_trial_list, make_trial_list
 
 
-def get_train_data(data_config):
+def get_corpus_locations(data_config):
+    with open(data_config, 'r') as f:
+        sre_data = load_json(f.read())
+    return [join_path(sre_data['ROOT'], data_loc) for data_loc in sre_data['LOCATION'].values()]
+
+
+def get_train_data(data_config, n_workers=NUM_CPU_WORKERS):
     with open(data_config, 'r') as f:
         sre_data = load_json(f.read())
     data_root = sre_data['ROOT']
     data_loc = sre_data['LOCATION']
-    speaker_key = sre_data['SPEAKER_KEY']
-
-    sre04 = make_old_sre_data(data_root, data_loc['SRE04'], 2004, speaker_key)
-    sre05_train = make_old_sre_data(data_root, data_loc['SRE05_TRAIN'], 2005, speaker_key)
-    sre05_test = make_old_sre_data(data_root, data_loc['SRE05_TEST'], 2005, speaker_key)
-    sre06 = make_old_sre_data(data_root, data_loc['SRE06'], 2006, speaker_key)
-    sre08 = make_sre08_data(data_root, data_loc['SRE08_TRAIN'], data_loc['SRE08_TEST'])
-    sre10 = make_sre10_data(data_root, data_loc['SRE10'])
-    sre16 = make_sre16_data(data_root, data_loc['SRE16_EVAL'])
-    swbd_c1 = make_swbd_cellular(data_root, data_loc['SWBD_C1'], 1)
-    swbd_c2 = make_swbd_cellular(data_root, data_loc['SWBD_C2'], 2)
-    swbd_p1 = make_swbd_phase(data_root, data_loc['SWBD_P1'], 1)
-    swbd_p2 = make_swbd_phase(data_root, data_loc['SWBD_P2'], 2)
-    swbd_p3 = make_swbd_phase(data_root, data_loc['SWBD_P3'], 3)
-    mx6_calls = make_mixer6_calls(data_root, data_loc['MX6'])
-    mx6_mic = make_mixer6_mic(data_root, data_loc['MX6'])
-    train_data = np.hstack([sre04, sre05_train, sre05_test, sre06, sre08, sre10, sre16, swbd_c1, swbd_c2, swbd_p1,
-                            swbd_p2, swbd_p3, mx6_calls, mx6_mic]).T
+    speaker_key = load_speaker_key(sre_data['SPEAKER_KEY'])
+
+    # The corpora are independent scans, so they are built concurrently and merged in this fixed order.
+    corpus_list = [
+        (make_old_sre_data, (data_root, data_loc['SRE04'], 2004, speaker_key.get('sre2004'))),
+        (make_old_sre_data, (data_root, data_loc['SRE05_TRAIN'], 2005, speaker_key.get('sre2005'))),
+        (make_old_sre_data, (data_root, data_loc['SRE05_TEST'], 2005, speaker_key.get('sre2005'))),
+        (make_old_sre_data, (data_root, data_loc['SRE06'], 2006, speaker_key.get('sre2006'))),
+        (make_sre08_data, (data_root, data_loc['SRE08_TRAIN'], data_loc['SRE08_TEST'])),
+        (make_sre10_data, (data_root, data_loc['SRE10'])),
+        (make_sre16_data, (data_root, data_loc['SRE16_EVAL'])),
+        (make_swbd_cellular, (data_root, data_loc['SWBD_C1'], 1)),
+        (make_swbd_cellular, (data_root, data_loc['SWBD_C2'], 2)),
+        (make_swbd_phase, (data_root, data_loc['SWBD_P1'], 1)),
+        (make_swbd_phase, (data_root, data_loc['SWBD_P2'], 2)),
+        (make_swbd_phase, (data_root, data_loc['SWBD_P3'], 3)),
+        (make_mixer6_calls, (data_root, data_loc['MX6'])),
+        (make_mixer6_mic, (data_root, data_loc['MX6']))
+    ]
+    corpus_data = run_parallel(make_corpus_data, corpus_list, n_workers=min(n_workers, len(corpus_list)),
+                               p_bar=False)
+    train_data = np.hstack(corpus_data).T
     print('Removing Duplicates...')
     train_data, n_dup = remove_duplicates(train_data)
     print('Removed {} duplicates.'.format(n_dup))
@@ -37,44 +50,71 @@ def get_train_data(data_config):
     return sort_by_index(train_data)
 
 
+def first_occurrence(keys, mask):
+    # Keeps only the first selected row per key, like deleting a file from the dict once it is used.
+    idx = np.where(mask)[0]
+    _, first = np.unique(keys[idx], return_index=True)
+    mask = np.zeros(len(keys), dtype=bool)
+    mask[idx[first]] = True
+    return mask
+
+
+def join_strings(*parts):
+    result = np.asarray(parts[0]).astype(str)
+    for part in parts[1:]:
+        result = np.char.add(result, np.asarray(part).astype(str))
+    return result
+
+
+def load_speaker_key(speaker_key):
+    speaker_ids, _, years, file_names, channels = load_key_file(speaker_key, n_columns=5)
+    channels = np.where(channels == 'A', 1, 2)
+    speaker_dict = dict()
+    for year in np.unique(years):
+        idx = years == year
+        speaker_dict[year] = (speaker_ids[idx], file_names[idx], channels[idx])
+    return speaker_dict
+
+
+def make_args(index_list, location_list, channel_list, speaker_list, read_list):
+    return np.vstack([np.asarray(index_list).astype(str), np.asarray(location_list).astype(str),
+                      np.asarray(channel_list).astype(str), np.asarray(speaker_list).astype(str),
+                      np.asarray(read_list).astype(str)])
+
+
+def make_corpus_data(args):
+    make_data, data_args = args
+    return make_data(*data_args)
+
+
+def make_file_arrays(file_list):
+    return np.array(list(file_list.keys()), dtype=str), np.array(list(file_list.values()), dtype=str)
+
+
 def make_old_sre_data(data_root, data_loc, sre_year, speaker_key):
     print('Making sre{} lists...'.format(sre_year))
     sre_loc = join_path(data_root, data_loc)
     sre_year = 'sre' + str(sre_year)
     bad_audio = ['jagi', 'jaly', 'jbrg', 'jcli', 'jfmx']
-    file_list = get_file_list_as_dict(sre_loc)
-
-    for ba in bad_audio:
-        try:
-            del file_list[ba]
-        except KeyError:
-            pass
-
-    index_list = []
-    location_list = []
-    speaker_list = []
-    channel_list = []
-    read_list = []
-    with open(speaker_key, 'r') as f:
-        for line in f.readlines():
-            tokens = re.split('[\s]+', line.strip())
-            speaker_id = tokens[0]
-            file_name = tokens[3]
-            channel = 1 if tokens[4] == 'A' else 2
-            if sre_year == tokens[2]:
-                try:
-                    file_loc = file_list[file_name]
-                    speaker_id = sre_year + '_' + speaker_id
-                    index_list.append('{}-{}_{}_ch{}'.format(speaker_id, sre_year, file_name, channel))
-                    location_list.append(file_loc)
-                    speaker_list.append(speaker_id)
-                    channel_list.append(channel)
-                    read_list.append('sph2pipe -f wav -p -c {} {}'.format(channel, file_loc))
-                except KeyError:
-                    pass
+    file_names, file_locs = make_file_arrays(get_file_list_as_dict(sre_loc))
+    keep = ~np.isin(file_names, bad_audio)
+    file_names, file_locs = file_names[keep], file_locs[keep]
+
+    if type(speaker_key) is str:
+        speaker_key = load_speaker_key(speaker_key).get(sre_year)
+    if speaker_key is None:
+        speaker_key = (np.array([], dtype=str), np.array([], dtype=str), np.array([], dtype=int))
+    speaker_ids, key_files, channels = speaker_key
+
+    found, (location_list,) = join_keys(key_files, file_names, file_locs)
+    speaker_list = join_strings(sre_year + '_', speaker_ids[found])
+    channel_list = channels[found]
+    location_list = location_list[found]
+    index_list = join_strings(speaker_list, '-{}_'.format(sre_year), key_files[found], '_ch', channel_list)
+    read_list = join_strings('sph2pipe -f wav -p -c ', channel_list, ' ', location_list)
 
     print('Made {:d} files from {}.'.format(len(index_list), sre_year))
-    return np.vstack([index_list, location_list, channel_list, speaker_list, read_list])
+    return make_args(index_list, location_list, channel_list, speaker_list, read_list)
 
 
 def make_sre08_data(data_root, data_train_loc, data_test_loc):
@@ -87,55 +127,30 @@ def make_sre08_data(data_root, data_train_loc, data_test_loc):
 
     train_file_list = get_file_list_as_dict(train_loc)
     test_file_list = get_file_list_as_dict(test_loc)
-    file_list = {**train_file_list, **test_file_list}
-
-    index_list = []
-    location_list = []
-    speaker_list = []
-    channel_list = []
-    read_list = []
-    model_to_speaker = dict()
-    with open(model_key, 'r') as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[,:]+', line.strip())
-            model_id = tokens[0]
-            file_name = tokens[2]
-            channel = 1 if tokens[3] == 'a' else 2
-            speaker_id = tokens[4]
-            model_to_speaker[model_id] = speaker_id
-            try:
-                file_loc = file_list[file_name]
-                speaker_id = 'sre2008_' + speaker_id
-                index_list.append('{}-sre2008_{}_ch{}'.format(speaker_id, file_name, channel))
-                location_list.append(file_loc)
-                channel_list.append(channel)
-                speaker_list.append(speaker_id)
-                read_list.append('sph2pipe -f wav -p -c {} {}'.format(channel, file_loc))
-            except KeyError:
-                pass
-
-    with open(trials_key, 'r') as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[,]+', line.strip())
-            model_id = tokens[0]
-            file_name = tokens[1]
-            channel = 1 if tokens[2] == 'a' else 2
-            target_type = tokens[3]
-            try:
-                file_loc = file_list[file_name]
-                speaker_id = 'sre2008_' + model_to_speaker[model_id]
-                if target_type == 'target':
-                    index_list.append('{}-sre2008_{}_ch{}'.format(speaker_id, file_name, channel))
-                    location_list.append(file_loc)
-                    channel_list.append(channel)
-                    speaker_list.append(speaker_id)
-                    read_list.append('sph2pipe -f wav -p -c {} {}'.format(channel, file_loc))
-                    del file_list[file_name]
-            except KeyError:
-                pass
+    file_names, file_locs = make_file_arrays({**train_file_list, **test_file_list})
+
+    model_ids, _, model_files, model_channels, model_speakers = load_key_file(model_key, '[,:]+', 1, 5)
+    model_channels = np.where(model_channels == 'a', 1, 2)
+    found, (model_locs,) = join_keys(model_files, file_names, file_locs)
+    train_speakers = join_strings('sre2008_', model_speakers[found])
+    train_data = [join_strings(train_speakers, '-sre2008_', model_files[found], '_ch', model_channels[found]),
+                  model_locs[found], model_channels[found], train_speakers]
+
+    trial_models, trial_files, trial_channels, target_types = load_key_file(trials_key, '[,]+', 1, 4)
+    trial_channels = np.where(trial_channels == 'a', 1, 2)
+    found, (trial_locs,) = join_keys(trial_files, file_names, file_locs)
+    model_found, (trial_speakers,) = join_keys(trial_models, model_ids, model_speakers)
+    found = first_occurrence(trial_files, found & model_found & (target_types == 'target'))
+    test_speakers = join_strings('sre2008_', trial_speakers[found])
+    test_data = [join_strings(test_speakers, '-sre2008_', trial_files[found], '_ch', trial_channels[found]),
+                 trial_locs[found], trial_channels[found], test_speakers]
+
+    index_list, location_list, channel_list, speaker_list = \
+        [np.concatenate([a, b]) for a, b in zip(train_data, test_data)]
+    read_list = join_strings('sph2pipe -f wav -p -c ', channel_list, ' ', location_list)
 
     print('Made {:d} files from sre2008.'.format(len(index_list)))
-    return np.vstack([index_list, location_list, channel_list, speaker_list, read_list])
+    return make_args(index_list, location_list, channel_list, speaker_list, read_list)
 
 
 def make_sre10_data(data_root, data_loc):
@@ -146,140 +161,70 @@ def make_sre10_data(data_root, data_loc):
     train_key = join_path(sre_loc, 'train/coreext.trn')
     trials_key = join_path(sre_loc, 'keys/coreext-coreext.trialkey.csv')
 
-    file_list = get_file_list_as_dict(join_path(sre_loc, 'data'))
-
-    index_list = []
-    location_list = []
-    speaker_list = []
-    channel_list = []
-    read_list = []
-    model_to_speaker = dict()
-    with open(model_key, 'r') as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[,]+', line.strip())
-            model_id = tokens[0]
-            speaker_id = tokens[1]
-            if not speaker_id == 'NOT_SCORED':
-                model_to_speaker[model_id] = speaker_id
-
-    with open(train_key, 'r') as f:
-        for line in f.readlines():
-            tokens = re.split('[\s:]+', line.strip())
-            model_id = tokens[0]
-            file_name = tokens[2].split('/')[2].split('.sph')[0]
-            channel = 1 if tokens[3] == 'A' else 2
-            try:
-                file_loc = file_list[file_name]
-                speaker_id = 'sre2010_' + model_to_speaker[model_id]
-                index_list.append('{}-sre2010_{}_ch{}'.format(speaker_id, file_name, channel))
-                location_list.append(file_loc)
-                speaker_list.append(speaker_id)
-                channel_list.append(channel)
-                read_list.append('sph2pipe -f wav -p -c {} {}'.format(channel, file_loc))
-            except KeyError:
-                pass
-
-    with open(trials_key, 'r') as f:
-        for line in f.readlines():
-            tokens = re.split('[,]+', line.strip())
-            model_id = tokens[0]
-            file_name = tokens[1]
-            channel = 1 if tokens[2] == 'A' else 2
-            target_type = tokens[3]
-            try:
-                speaker_id = 'sre2010_' + model_to_speaker[model_id]
-                file_loc = file_list[file_name]
-                if target_type == 'target':
-                    index_list.append('{}-sre2010_{}_ch{}'.format(speaker_id, file_name, channel))
-                    location_list.append(file_loc)
-                    speaker_list.append(speaker_id)
-                    channel_list.append(channel)
-                    read_list.append('sph2pipe -f wav -p -c {} {}'.format(channel, file_loc))
-                    del file_list[file_name]
-            except KeyError:
-                pass
+    file_names, file_locs = make_file_arrays(get_file_list_as_dict(join_path(sre_loc, 'data')))
+
+    model_ids, model_speakers = load_key_file(model_key, '[,]+', 1, 2)
+    scored = model_speakers != 'NOT_SCORED'
+    model_ids, model_speakers = model_ids[scored], model_speakers[scored]
+
+    train_models, _, train_files, train_channels = load_key_file(train_key, '[\s:]+', 0, 4)
+    train_files = np.array([f.split('/')[2].split('.sph')[0] for f in train_files.tolist()], dtype=str)
+    train_channels = np.where(train_channels == 'A', 1, 2)
+    found, (train_locs,) = join_keys(train_files, file_names, file_locs)
+    model_found, (train_speakers,) = join_keys(train_models, model_ids, model_speakers)
+    found = found & model_found
+    train_speakers = join_strings('sre2010_', train_speakers[found])
+    train_data = [join_strings(train_speakers, '-sre2010_', train_files[found], '_ch', train_channels[found]),
+                  train_locs[found], train_channels[found], train_speakers]
+
+    trial_models, trial_files, trial_channels, target_types = load_key_file(trials_key, '[,]+', 0, 4)
+    trial_channels = np.where(trial_channels == 'A', 1, 2)
+    found, (trial_locs,) = join_keys(trial_files, file_names, file_locs)
+    model_found, (trial_speakers,) = join_keys(trial_models, model_ids, model_speakers)
+    found = first_occurrence(trial_files, found & model_found & (target_types == 'target'))
+    test_speakers = join_strings('sre2010_', trial_speakers[found])
+    test_data = [join_strings(test_speakers, '-sre2010_', trial_files[found], '_ch', trial_channels[found]),
+                 trial_locs[found], trial_channels[found], test_speakers]
+
+    index_list, location_list, channel_list, speaker_list = \
+        [np.concatenate([a, b]) for a, b in zip(train_data, test_data)]
+    read_list = join_strings('sph2pipe -f wav -p -c ', channel_list, ' ', location_list)
 
     print('Made {:d} files from sre2010.'.format(len(index_list)))
-    return np.vstack([index_list, location_list, channel_list, speaker_list, read_list])
+    return make_args(index_list, location_list, channel_list, speaker_list, read_list)
 
 
 def make_sre16_data(data_root, data_loc):
     print('Making sre2016 lists...')
     sre_loc = join_path(data_root, data_loc)
-    file_list = get_file_list_as_dict(join_path(sre_loc, 'data/enrollment'))
+    file_names, file_locs = make_file_arrays(get_file_list_as_dict(join_path(sre_loc, 'data/enrollment')))
     meta_key = join_path(sre_loc, 'docs/sre16_eval_enrollment.tsv')
 
-    index_list = []
-    location_list = []
-    speaker_list = []
-    channel_list = []
-    read_list = []
-    with open(meta_key, 'r') as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[\s]+', line.strip())
-            speaker_id = 'sre16_eval_enroll_' + tokens[0]
-            file_name = tokens[1]
-            try:
-                file_loc = file_list[file_name]
-                index_list.append('{}-sre16_eval_enroll_{}'.format(speaker_id, file_name))
-                location_list.append(file_loc)
-                speaker_list.append(speaker_id)
-                channel_list.append(1)
-                read_list.append('sph2pipe -f wav -p -c 1 {}'.format(file_loc))
-                del file_list[file_name]
-            except KeyError:
-                pass
+    model_ids, enroll_files = load_key_file(meta_key, skip_rows=1, n_columns=2)
+    found, (location_list,) = join_keys(enroll_files, file_names, file_locs)
+    found = first_occurrence(enroll_files, found)
+    speaker_list = join_strings('sre16_eval_enroll_', model_ids[found])
+    index_list = join_strings(speaker_list, '-sre16_eval_enroll_', enroll_files[found])
+    location_list = location_list[found]
+    read_list = join_strings('sph2pipe -f wav -p -c 1 ', location_list)
 
     print('Made {:d} enrollment files.'.format(len(index_list)))
-    enrollment_data = np.vstack([index_list, location_list, channel_list, speaker_list, read_list])
-
-    file_list = get_file_list_as_dict(join_path(sre_loc, 'data/test'))
+    enrollment_data = make_args(index_list, location_list, np.ones(len(index_list), dtype=int), speaker_list,
+                                read_list)
 
-    segment_key = join_path(sre_loc, 'docs/sre16_eval_segment_key.tsv')
-    language_key = join_path(sre_loc, 'metadata/calls.tsv')
+    file_names, file_locs = make_file_arrays(get_file_list_as_dict(join_path(sre_loc, 'data/test')))
     trial_key = join_path(sre_loc, 'docs/sre16_eval_trial_key.tsv')
 
-    utt_to_call = dict()
-    with open(segment_key, 'r') as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[\s]+', line.strip())
-            utt_to_call[tokens[0]] = tokens[1]
-
-    call_to_language = dict()
-    with open(language_key, 'r') as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[\s]+', line.strip())
-            call_to_language[tokens[0]] = tokens[1]
-
-    index_list = []
-    location_list = []
-    speaker_list = []
-    channel_list = []
-    read_list = []
-    language_list = []
-    target_list = []
-    with open(trial_key, 'r') as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[\s]+', line.strip())
-            speaker_id = 'sre16_eval_enroll_' + tokens[0]
-            file_name = tokens[1]
-            target_type = tokens[3]
-            call_id = utt_to_call[file_name]
-            try:
-                file_loc = file_list[file_name]
-                index_list.append('{}-sre16_eval_test_{}'.format(speaker_id, file_name))
-                location_list.append(file_loc)
-                speaker_list.append(speaker_id)
-                channel_list.append(1)
-                read_list.append('sph2pipe -f wav -p -c 1 {}'.format(file_loc))
-                language_list.append(call_to_language[call_id])
-                target_list.append(target_type)
-                del file_list[file_name]
-            except KeyError:
-                pass
+    model_ids, test_files = load_key_file(trial_key, skip_rows=1, n_columns=2)
+    found, (location_list,) = join_keys(test_files, file_names, file_locs)
+    found = first_occurrence(test_files, found)
+    speaker_list = join_strings('sre16_eval_enroll_', model_ids[found])
+    index_list = join_strings(speaker_list, '-sre16_eval_test_', test_files[found])
+    location_list = location_list[found]
+    read_list = join_strings('sph2pipe -f wav -p -c 1 ', location_list)
 
     print('Made {:d} test files.'.format(len(index_list)))
-    test_data = np.vstack([index_list, location_list, channel_list, speaker_list, read_list])
+    test_data = make_args(index_list, location_list, np.ones(len(index_list), dtype=int), speaker_list, read_list)
     return np.hstack([enrollment_data, test_data])
 
 
@@ -291,43 +236,26 @@ def make_swbd_cellular(data_root, data_loc, cellular=1):
     stats_key = join_path(swbd_loc, 'doc{}/swb_callstats.tbl'.format('' if cellular == 1 else 's'))
     swbd_type = 'swbd_c{:d}_'.format(cellular)
 
-    file_list = get_file_list_as_dict(swbd_loc)
-
-    for ba in bad_audio:
-        try:
-            del file_list['sw_' + str(ba)]
-        except KeyError:
-            pass
-
-    index_list = []
-    location_list = []
-    channel_list = []
-    speaker_list = []
-    read_list = []
-    with open(stats_key, 'r') as f:
-        for line in f.readlines():
-            tokens = re.split('[,]+', line.strip())
-            file_name = tokens[0]
-            speaker_id1 = 'sw_' + tokens[1]
-            speaker_id2 = 'sw_' + tokens[2]
-            try:
-                file_loc = file_list['sw_' + str(file_name)]
-                index_list.append(speaker_id1 + '-' + swbd_type + file_name + '_ch1')
-                location_list.append(file_loc)
-                channel_list.append(1)
-                speaker_list.append(speaker_id1)
-                read_list.append('sph2pipe -f wav -p -c 1 {}'.format(file_loc))
-                index_list.append(speaker_id2 + '-' + swbd_type + file_name + '_ch2')
-                location_list.append(file_loc)
-                channel_list.append(2)
-                speaker_list.append(speaker_id2)
-                read_list.append('sph2pipe -f wav -p -c 2 {}'.format(file_loc))
-                del file_list['sw_' + str(file_name)]
-            except KeyError:
-                pass
+    file_names, file_locs = make_file_arrays(get_file_list_as_dict(swbd_loc))
+    keep = ~np.isin(file_names, ['sw_' + str(ba) for ba in bad_audio])
+    file_names, file_locs = file_names[keep], file_locs[keep]
+
+    call_files, speakers1, speakers2 = load_key_file(stats_key, '[,]+', 0, 3)
+    found, (call_locs,) = join_keys(join_strings('sw_', call_files), file_names, file_locs)
+    found = first_occurrence(call_files, found)
+    call_files, call_locs = call_files[found], call_locs[found]
+    speakers1, speakers2 = join_strings('sw_', speakers1[found]), join_strings('sw_', speakers2[found])
+
+    # Each call gives two rows, channel 1 then channel 2.
+    n_calls = len(call_files)
+    speaker_list = np.vstack([speakers1, speakers2]).T.reshape(-1)
+    location_list = np.repeat(call_locs, 2)
+    channel_list = np.tile([1, 2], n_calls)
+    index_list = join_strings(speaker_list, '-' + swbd_type, np.repeat(call_files, 2), '_ch', channel_list)
+    read_list = join_strings('sph2pipe -f wav -p -c ', channel_list, ' ', location_list)
 
     print('Made {:d} files swbd cellular {}.'.format(len(index_list), cellular))
-    return np.vstack([index_list, location_list, channel_list, speaker_list, read_list])
+    return make_args(index_list, location_list, channel_list, speaker_list, read_list)
 
 
 def make_swbd_phase(data_root, data_loc, phase=1):
@@ -339,37 +267,22 @@ def make_swbd_phase(data_root, data_loc, phase=1):
     stats_key = join_path(swbd_loc, 'docs/callinfo.tbl')
     swbd_type = 'swbd_p{:d}_'.format(phase)
 
-    file_list = get_file_list_as_dict(swbd_loc)
-
-    for ba in bad_audio:
-        try:
-            del file_list[ba]
-        except KeyError:
-            pass
-
-    index_list = []
-    location_list = []
-    channel_list = []
-    speaker_list = []
-    read_list = []
-    with open(stats_key, 'r') as f:
-        for line in f.readlines():
-            tokens = re.split('[,]+', line.strip())
-            file_name = ('sw_' + tokens[0]) if phase == 3 else ('' + tokens[0].split('.')[0])
-            speaker_id = 'sw_' + str(tokens[2])
-            channel = 1 if tokens[3] == 'A' else 2
-            try:
-                file_loc = file_list[file_name]
-                index_list.append(speaker_id + '-' + swbd_type + file_name + '_ch{:d}'.format(channel))
-                location_list.append(file_loc)
-                channel_list.append(channel)
-                speaker_list.append(speaker_id)
-                read_list.append('sph2pipe -f wav -p -c {} {}'.format(channel, file_loc))
-            except KeyError:
-                pass
+    file_names, file_locs = make_file_arrays(get_file_list_as_dict(swbd_loc))
+    keep = ~np.isin(file_names, bad_audio)
+    file_names, file_locs = file_names[keep], file_locs[keep]
+
+    call_files, _, speakers, channels = load_key_file(stats_key, '[,]+', 0, 4)
+    call_files = join_strings('sw_', call_files) if phase == 3 else np.char.partition(call_files, '.')[:, 0]
+    channels = np.where(channels == 'A', 1, 2)
+    found, (location_list,) = join_keys(call_files, file_names, file_locs)
+    speaker_list = join_strings('sw_', speakers[found])
+    channel_list = channels[found]
+    location_list = location_list[found]
+    index_list = join_strings(speaker_list, '-' + swbd_type, call_files[found], '_ch', channel_list)
+    read_list = join_strings('sph2pipe -f wav -p -c ', channel_list, ' ', location_list)
 
     print('Made {:d} files swbd phase {}.'.format(len(index_list), phase))
-    return np.vstack([index_list, location_list, channel_list, speaker_list, read_list])
+    return make_args(index_list, location_list, channel_list, speaker_list, read_list)
 
 
 def make_mixer6_calls(data_root, data_loc):
@@ -378,41 +291,24 @@ def make_mixer6_calls(data_root, data_loc):
     mx6_calls_loc = join_path(mx6_loc, 'data/ulaw_sphere')
 
     stats_key = join_path(mx6_loc, 'docs/mx6_calls.csv')
-    file_list = get_file_list_as_dict(mx6_calls_loc)
-
-    call_to_file = dict()
-    for key in file_list.keys():
-        call_id = re.split('[_]+', key)[2]
-        call_to_file[call_id] = key
-
-    index_list = []
-    location_list = []
-    channel_list = []
-    speaker_list = []
-    read_list = []
-    with open(stats_key, 'r') as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[,]+', line.strip())
-            call_id = tokens[0]
-            speaker_id1 = 'MX6_' + tokens[4]
-            speaker_id2 = 'MX6_' + tokens[12]
-            try:
-                file_name = call_to_file[call_id]
-                file_loc = file_list[file_name]
-                index_list.append('{}-MX6_CALLS_{}_ch1'.format(speaker_id1, file_name))
-                location_list.append(file_loc)
-                channel_list.append(1)
-                speaker_list.append(speaker_id1)
-                read_list.append('sph2pipe -f wav -p -c 1 {}'.format(file_loc))
-                index_list.append('{}-MX6_CALLS_{}_ch2'.format(speaker_id2, file_name))
-                location_list.append(file_loc)
-                channel_list.append(2)
-                speaker_list.append(speaker_id2)
-                read_list.append('sph2pipe -f wav -p -c 2 {}'.format(file_loc))
-            except KeyError:
-                pass
+    file_names, file_locs = make_file_arrays(get_file_list_as_dict(mx6_calls_loc))
+    file_calls = np.array([re.split('[_]+', name)[2] for name in file_names.tolist()], dtype=str)
+
+    columns = load_key_file(stats_key, '[,]+', 1, 13)
+    call_ids, speakers1, speakers2 = columns[0], columns[4], columns[12]
+    found, (call_files, call_locs) = join_keys(call_ids, file_calls, file_names, file_locs)
+    call_files, call_locs = call_files[found], call_locs[found]
+    speakers1, speakers2 = join_strings('MX6_', speakers1[found]), join_strings('MX6_', speakers2[found])
+
+    n_calls = len(call_files)
+    speaker_list = np.vstack([speakers1, speakers2]).T.reshape(-1)
+    location_list = np.repeat(call_locs, 2)
+    channel_list = np.tile([1, 2], n_calls)
+    index_list = join_strings(speaker_list, '-MX6_CALLS_', np.repeat(call_files, 2), '_ch', channel_list)
+    read_list = join_strings('sph2pipe -f wav -p -c ', channel_list, ' ', location_list)
+
     print('Made {:d} files from mixer6 calls.'.format(len(index_list)))
-    return np.vstack([index_list, location_list, channel_list, speaker_list, read_list])
+    return make_args(index_list, location_list, channel_list, speaker_list, read_list)
 
 
 def make_mixer6_mic(data_root, data_loc):
@@ -429,35 +325,28 @@ def make_mixer6_mic(data_root, data_loc):
         mic_loc = join_path(mx6_mic_loc, 'CH' + idx)
         mic_file_list = get_file_list_as_dict(mic_loc, pattern='*.flac')
         file_list = {**mic_file_list, **file_list}
-
-    index_list = []
-    location_list = []
-    channel_list = []
-    speaker_list = []
-    read_list = []
-    with open(stats_key, 'r') as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[,]+', line.strip())
-            session_id = tokens[0]
-            speaker_id = 'MX6_' + re.split('[_]+', session_id)[3]
-            start_time = tokens[7]
-            end_time = tokens[8]
-            if session_id not in bad_audio:
-                for idx in mic_idx:
-                    file_name = '{}_CH{}'.format(session_id, idx)
-                    try:
-                        file_loc = file_list[file_name]
-                        index_list.append('{}-MX6_MIC_{}'.format(speaker_id, file_name))
-                        location_list.append(file_loc)
-                        channel_list.append(1)
-                        speaker_list.append(speaker_id)
-                        read_list.append('sox -t flac {} -r 8k -t wav -V0 - trim {} {}'
-                                         .format(file_loc, start_time, float(end_time) - float(start_time)))
-                    except KeyError:
-                        pass
+    file_names, file_locs = make_file_arrays(file_list)
+
+    columns = load_key_file(stats_key, '[,]+', 1, 9)
+    keep = ~np.isin(columns[0], bad_audio)
+    session_ids, start_times, end_times = columns[0][keep], columns[7][keep], columns[8][keep]
+    speakers = np.array(['MX6_' + re.split('[_]+', session)[3] for session in session_ids.tolist()], dtype=str)
+    durations = np.array(end_times, dtype=float) - np.array(start_times, dtype=float)
+
+    # Every session is looked up on each microphone, session by session.
+    n_mics = len(mic_idx)
+    mic_files = join_strings(np.repeat(session_ids, n_mics), '_CH', np.tile(mic_idx, len(session_ids)))
+    found, (location_list,) = join_keys(mic_files, file_names, file_locs)
+    location_list = location_list[found]
+    speaker_list = np.repeat(speakers, n_mics)[found]
+    index_list = join_strings(speaker_list, '-MX6_MIC_', mic_files[found])
+    start_list = np.repeat(start_times, n_mics)[found]
+    duration_list = np.repeat(durations, n_mics)[found].tolist()
+    read_list = ['sox -t flac {} -r 8k -t wav -V0 - trim {} {}'.format(l, s, d) for l, s, d in
+                 zip(location_list, start_list, duration_list)]
 
     print('Made {:d} files from mixer6 mic.'.format(len(index_list)))
-    return np.vstack([index_list, location_list, channel_list, speaker_list, read_list])
+    return make_args(index_list, location_list, np.ones(len(index_list), dtype=int), speaker_list, read_list)
 
 
 def make_sre18_dev_data(sre_config):
@@ -468,97 +357,47 @@ def make_sre18_dev_data(sre_config):
     data_loc = sre_data['LOCATION']['SRE18_DEV']
     sre_loc = join_path(data_root, data_loc)
 
-    file_list = get_file_list_as_dict(join_path(sre_loc, 'data/unlabeled'))
+    file_names, file_locs = make_file_arrays(get_file_list_as_dict(join_path(sre_loc, 'data/unlabeled')))
+    index_list = join_strings('sre18_unlabelled_', file_names)
+    sre_unlabeled = make_args(index_list, file_locs, np.ones(len(index_list), dtype=int), index_list,
+                              join_strings('sph2pipe -f wav -p -c 1 ', file_locs)).T
 
-    index_list = []
-    location_list = []
-    speaker_list = []
-    channel_list = []
-    read_list = []
-    for key in file_list.keys():
-        index_list.append('sre18_unlabelled_{}'.format(key))
-        location_list.append(file_list[key])
-        speaker_list.append('sre18_unlabelled_{}'.format(key))
-        channel_list.append(1)
-        read_list.append('sph2pipe -f wav -p -c 1 {}'.format(file_list[key]))
+    sre_dev_enroll = make_sre18_enroll_data(sre_loc, 'dev')
+    sre_dev_test = make_sre18_test_data(sre_loc, 'dev')
+    return sre_dev_enroll, sre_dev_test, sre_unlabeled
 
-    sre_unlabeled = np.vstack([index_list, location_list, channel_list, speaker_list, read_list]).T
 
+def make_sre18_enroll_data(sre_loc, sre_set):
     sph_file_list = get_file_list_as_dict(join_path(sre_loc, 'data/enrollment'), pattern='*.sph', ext=True)
     flac_file_list = get_file_list_as_dict(join_path(sre_loc, 'data/enrollment'), pattern='*.flac', ext=True)
-    diarization_file = join_path(sre_loc, 'docs/sre18_dev_enrollment_diarization.tsv')
-    key_file = join_path(sre_loc, 'docs/sre18_dev_enrollment.tsv')
-
-    diarization_dict = dict()
-    with open(diarization_file) as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[\s]+', line.strip())
-            diarization_dict[tokens[0]] = (float(tokens[2]), float(tokens[3]))
-
-    utt_to_spk = dict()
-    with open(key_file) as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[\s]+', line.strip())
-            utt_to_spk[tokens[1]] = tokens[0]
-
-    index_list = []
-    location_list = []
-    speaker_list = []
-    channel_list = []
-    read_list = []
-    for key in sph_file_list.keys():
-        file_loc = sph_file_list[key]
-        index_list.append('sre18_dev_enroll_{}'.format(key))
-        location_list.append(file_loc)
-        speaker_list.append(utt_to_spk[key])
-        channel_list.append(1)
-        read_list.append('sph2pipe -f wav -p -c 1 {}'.format(file_loc))
-
-    for key in flac_file_list.keys():
-        file_loc = flac_file_list[key]
-        index_list.append('sre18_dev_enroll_{}'.format(key))
-        location_list.append(file_loc)
-        speaker_list.append(utt_to_spk[key])
-        channel_list.append(1)
-        try:
-            start_time, end_time = diarization_dict[key]
-            read_list.append('sox -t flac {} -r 8k -t wav -V0 - trim {} {}'
-                             .format(file_loc, start_time, float(end_time) - float(start_time)))
-        except KeyError:
-            read_list.append('sox -t flac {} -r 8k -t wav -V0 -'.format(file_list[key]))
-
-    sre_dev_enroll = np.vstack([index_list, location_list, channel_list, speaker_list, read_list]).T
-
-    sph_file_list = get_file_list_as_dict(join_path(sre_loc, 'data/test'), pattern='*.sph', ext=True)
-    flac_file_list = get_file_list_as_dict(join_path(sre_loc, 'data/test'), pattern='*.flac', ext=True)
-    file_list = {**sph_file_list, **flac_file_list}
-    trials_key = join_path(sre_loc, 'docs/sre18_dev_trial_key.tsv')
-
-    index_list = []
-    location_list = []
-    speaker_list = []
-    channel_list = []
-    read_list = []
-    with open(trials_key) as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[\s]+', line.strip())
-            try:
-                file_loc = file_list[tokens[1]]
-                if tokens[3] == 'target':
-                    index_list.append(tokens[1])
-                    location_list.append(file_loc)
-                    speaker_list.append(tokens[1])
-                    channel_list.append(1)
-                    if tokens[1][-3:] == 'sph':
-                        read_list.append('sph2pipe -f wav -p -c 1 {}'.format(file_loc))
-                    else:
-                        read_list.append('sox -t flac {} -r 8k -t wav -V0 -'.format(file_loc))
-                    del file_list[tokens[1]]
-            except KeyError:
-                pass
-
-    sre_dev_test = np.vstack([index_list, location_list, channel_list, speaker_list, read_list]).T
-    return sre_dev_enroll, sre_dev_test, sre_unlabeled
+    diarization_file = join_path(sre_loc, 'docs/sre18_{}_enrollment_diarization.tsv'.format(sre_set))
+    key_file = join_path(sre_loc, 'docs/sre18_{}_enrollment.tsv'.format(sre_set))
+
+    diarization_files, _, start_times, end_times = load_key_file(diarization_file, skip_rows=1, n_columns=4)
+    key_speakers, key_files = load_key_file(key_file, skip_rows=1, n_columns=2)
+
+    sph_names, sph_locs = make_file_arrays(sph_file_list)
+    flac_names, flac_locs = make_file_arrays(flac_file_list)
+    file_names = np.concatenate([sph_names, flac_names])
+    location_list = np.concatenate([sph_locs, flac_locs])
+    found, (speaker_list,) = join_keys(file_names, key_files, key_speakers)
+    if not np.all(found):
+        raise KeyError('No speaker in {} for {}.'.format(key_file, ', '.join(file_names[~found][:5])))
+
+    # Diarized flac files are trimmed to the enrolled speaker's segment.
+    diarized, (starts, ends) = join_keys(flac_names, diarization_files, start_times, end_times)
+    flac_read_list = []
+    for file_loc, has_segment, start_time, end_time in zip(flac_locs, diarized, starts, ends):
+        if has_segment:
+            flac_read_list.append('sox -t flac {} -r 8k -t wav -V0 - trim {} {}'
+                                  .format(file_loc, float(start_time), float(end_time) - float(start_time)))
+        else:
+            flac_read_list.append('sox -t flac {} -r 8k -t wav -V0 -'.format(file_loc))
+    read_list = np.concatenate([join_strings('sph2pipe -f wav -p -c 1 ', sph_locs),
+                                np.array(flac_read_list, dtype=str)])
+
+    index_list = join_strings('sre18_{}_enroll_'.format(sre_set), file_names)
+    return make_args(index_list, location_list, np.ones(len(index_list), dtype=int), speaker_list, read_list).T
 
 
 def make_sre18_eval_data(sre_config):
@@ -569,81 +408,26 @@ def make_sre18_eval_data(sre_config):
     data_loc = sre_data['LOCATION']['SRE18_EVAL']
     sre_loc = join_path(data_root, data_loc)
 
-    sph_file_list = get_file_list_as_dict(join_path(sre_loc, 'data/enrollment'), pattern='*.sph', ext=True)
-    flac_file_list = get_file_list_as_dict(join_path(sre_loc, 'data/enrollment'), pattern='*.flac', ext=True)
-    diarization_file = join_path(sre_loc, 'docs/sre18_eval_enrollment_diarization.tsv')
-    key_file = join_path(sre_loc, 'docs/sre18_eval_enrollment.tsv')
-
-    diarization_dict = dict()
-    with open(diarization_file) as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[\s]+', line.strip())
-            diarization_dict[tokens[0]] = (float(tokens[2]), float(tokens[3]))
-
-    utt_to_spk = dict()
-    with open(key_file) as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[\s]+', line.strip())
-            utt_to_spk[tokens[1]] = tokens[0]
-
-    index_list = []
-    location_list = []
-    speaker_list = []
-    channel_list = []
-    read_list = []
-    for key in sph_file_list.keys():
-        file_loc = sph_file_list[key]
-        index_list.append('sre18_eval_enroll_{}'.format(key))
-        location_list.append(file_loc)
-        speaker_list.append(utt_to_spk[key])
-        channel_list.append(1)
-        read_list.append('sph2pipe -f wav -p -c 1 {}'.format(file_loc))
-
-    for key in flac_file_list.keys():
-        file_loc = flac_file_list[key]
-        index_list.append('sre18_eval_enroll_{}'.format(key))
-        location_list.append(file_loc)
-        speaker_list.append(utt_to_spk[key])
-        channel_list.append(1)
-        try:
-            start_time, end_time = diarization_dict[key]
-            read_list.append('sox -t flac {} -r 8k -t wav -V0 - trim {} {}'
-                             .format(file_loc, start_time, float(end_time) - float(start_time)))
-        except KeyError:
-            read_list.append('sox -t flac {} -r 8k -t wav -V0 -'.format(file_loc))
-
-    sre_eval_enroll = np.vstack([index_list, location_list, channel_list, speaker_list, read_list]).T
+    sre_eval_enroll = make_sre18_enroll_data(sre_loc, 'eval')
+    sre_eval_test = make_sre18_test_data(sre_loc, 'eval')
+    return sre_eval_enroll, sre_eval_test
+
 
+def make_sre18_test_data(sre_loc, sre_set):
     sph_file_list = get_file_list_as_dict(join_path(sre_loc, 'data/test'), pattern='*.sph', ext=True)
     flac_file_list = get_file_list_as_dict(join_path(sre_loc, 'data/test'), pattern='*.flac', ext=True)
-    file_list = {**sph_file_list, **flac_file_list}
-    trials_key = join_path(sre_loc, 'docs/sre18_eval_trial_key.tsv')
-
-    index_list = []
-    location_list = []
-    speaker_list = []
-    channel_list = []
-    read_list = []
-    with open(trials_key) as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[\s]+', line.strip())
-            try:
-                file_loc = file_list[tokens[1]]
-                if tokens[3] == 'target':
-                    index_list.append(tokens[1])
-                    location_list.append(file_loc)
-                    speaker_list.append(tokens[1])
-                    channel_list.append(1)
-                    if tokens[1][-3:] == 'sph':
-                        read_list.append('sph2pipe -f wav -p -c 1 {}'.format(file_loc))
-                    else:
-                        read_list.append('sox -t flac {} -r 8k -t wav -V0 -'.format(file_loc))
-                    del file_list[tokens[1]]
-            except KeyError:
-                pass
-
-    sre_eval_test = np.vstack([index_list, location_list, channel_list, speaker_list, read_list]).T
-    return sre_eval_enroll, sre_eval_test
+    file_names, file_locs = make_file_arrays({**sph_file_list, **flac_file_list})
+    trials_key = join_path(sre_loc, 'docs/sre18_{}_trial_key.tsv'.format(sre_set))
+
+    _, test_files, _, target_types = load_key_file(trials_key, skip_rows=1, n_columns=4)
+    found, (location_list,) = join_keys(test_files, file_names, file_locs)
+    found = first_occurrence(test_files, found & (target_types == 'target'))
+    index_list = test_files[found]
+    location_list = location_list[found]
+    is_sph = np.char.endswith(index_list, 'sph')
+    read_list = np.where(is_sph, join_strings('sph2pipe -f wav -p -c 1 ', location_list),
+                         join_strings('sox -t flac ', location_list, ' -r 8k -t wav -V0 -'))
+    return make_args(index_list, location_list, np.ones(len(index_list), dtype=int), index_list, read_list).T
 
 
 def make_sre16_trials_file(sre_config, trials_file):
@@ -653,44 +437,14 @@ def make_sre16_trials_file(sre_config, trials_file):
     data_loc = sre_data['LOCATION']['SRE16_EVAL']
     sre_loc = join_path(data_root, data_loc)
 
-    segment_key = join_path(sre_loc, 'docs/sre16_eval_segment_key.tsv')
-    language_key = join_path(sre_loc, 'metadata/calls.tsv')
     trial_key = join_path(sre_loc, 'docs/sre16_eval_trial_key.tsv')
-
-    utt_to_call = dict()
-    with open(segment_key, 'r') as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[\s]+', line.strip())
-            utt_to_call[tokens[0]] = tokens[1]
-
-    call_to_language = dict()
-    with open(language_key, 'r') as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[\s]+', line.strip())
-            call_to_language[tokens[0]] = tokens[1]
-
-    trials_list = []
-    with open(trial_key, 'r') as f:
-        for line in f.readlines()[1:]:
-            tokens = re.split('[\s]+', line.strip())
-            speaker_id = tokens[0]
-            file_name = tokens[1]
-            target_type = tokens[3]
-            trials_list.append('sre16_eval_enroll_{} sre16_eval_test_{} {}'.format(speaker_id, file_name, target_type))
-
-    with open(trials_file, 'w') as f:
-        for trial in trials_list:
-            f.write('{}\n'.format(trial))
+    model_ids, test_files, _, target_types = load_key_file(trial_key, skip_rows=1, n_columns=4)
+    trial_list = make_trial_list(join_strings('sre16_eval_enroll_', model_ids),
+                                 join_strings('sre16_eval_test_', test_files), target_types)
+    trial_list.write(trials_file)
+    return trial_list
 
 
 def split_trials_file(trials_file):
-    index_list = []
-    label_list = []
-    target_list = []
-    with open(trials_file) as f:
-        for line in f.readlines():
-            tokens = re.split('[\s]+', line.strip())
-            index_list.append(tokens[1])
-            label_list.append(tokens[0])
-            target_list.append(tokens[2])
-    return index_list, label_list, target_list
+    trial_list = get_trial_list(trials_file)
+    return trial_list.test_keys(), trial_list.enroll_keys(), trial_list.target_names()
@@ -0,0 +1,80 @@
+from os.path import exists, getmtime, join as join_path
+
+import numpy as np
+
+from constants.app_constants import TRIAL_LIST_DIR
+from services.common import load_json_file, load_key_file, make_directory, save_json_file
+
+TARGET_NAMES = np.array(['', 'nontarget', 'target'])
+
+
+class TrialList:
+    def __init__(self, enroll_ids, test_ids, enroll_idx, test_idx, target):
+        self.enroll_ids = enroll_ids
+        self.test_ids = test_ids
+        self.enroll_idx = enroll_idx
+        self.test_idx = test_idx
+        self.target = target
+
+    def __len__(self):
+        return len(self.enroll_idx)
+
+    def enroll_keys(self):
+        return self.enroll_ids[self.enroll_idx]
+
+    def save(self, location):
+        make_directory(location)
+        for name in ['enroll_ids', 'test_ids', 'enroll_idx', 'test_idx', 'target']:
+            np.save(join_path(location, '{}.npy'.format(name)), np.asarray(getattr(self, name)))
+
+    def target_names(self):
+        # Trials without a key (target = -1) get an empty name.
+        return TARGET_NAMES[np.asarray(self.target) + 1]
+
+    def test_keys(self):
+        return self.test_ids[self.test_idx]
+
+    def write(self, trials_file):
+        # Unkeyed trials are written without the third column; keyed ones keep their label.
+        lines = np.char.add(np.char.add(self.enroll_keys(), ' '), self.test_keys())
+        names = self.target_names()
+        lines = np.char.add(np.char.add(lines, np.where(names == '', '', ' ')), names)
+        with open(trials_file, 'w') as f:
+            f.write('\n'.join(lines.tolist()))
+            f.write('\n' if len(lines) > 0 else '')
+
+
+def get_trial_list(trials_file):
+    # The binary copy next to the text file is rebuilt whenever the text file is newer.
+    location = TRIAL_LIST_DIR.format(trials_file)
+    meta_file = join_path(location, 'meta.json')
+    if exists(meta_file) and load_json_file(meta_file)['mtime'] == getmtime(trials_file):
+        return load_trial_list(location)
+    trial_list = read_trials_file(trials_file)
+    trial_list.save(location)
+    save_json_file(meta_file, {'mtime': getmtime(trials_file), 'n_trials': len(trial_list)})
+    return load_trial_list(location)
+
+
+def load_trial_list(location):
+    arrays = [np.load(join_path(location, '{}.npy'.format(name)), mmap_mode='r')
+              for name in ['enroll_ids', 'test_ids', 'enroll_idx', 'test_idx', 'target']]
+    return TrialList(*arrays)
+
+
+def make_trial_list(enroll_keys, test_keys, target=None):
+    enroll_ids, enroll_idx = np.unique(np.asarray(enroll_keys, dtype=str), return_inverse=True)
+    test_ids, test_idx = np.unique(np.asarray(test_keys, dtype=str), return_inverse=True)
+    if target is None:
+        target = -np.ones(len(enroll_idx), dtype=np.int8)
+    else:
+        target = np.asarray(target)
+        if target.dtype.kind in 'SU':
+            target = np.where(target == 'target', 1, np.where(target == 'nontarget', 0, -1))
+        target = target.astype(np.int8)
+    return TrialList(enroll_ids, test_ids, enroll_idx.astype(np.int32), test_idx.astype(np.int32), target)
+
+
+def read_trials_file(trials_file):
+    enroll_keys, test_keys, target = load_key_file(trials_file, n_columns=3)
+    return make_trial_list(enroll_keys, test_keys, target)